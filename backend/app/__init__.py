@@ -1,43 +1,48 @@
 import os
-import logging
-from logging.handlers import RotatingFileHandler
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from flask_migrate import Migrate
+from app.logs import setup_logging
 
 # Créer le dossier logs s'il n'existe pas
 logs_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
 os.makedirs(logs_dir, exist_ok=True)
 
-# Configurer le logging
-formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-
-# Logger pour le fichier
-file_handler = RotatingFileHandler(
-    os.path.join(logs_dir, 'itransfer.log'),
-    maxBytes=10485760,  # 10MB
-    backupCount=10
-)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-
-# Logger pour la console
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)
-
 # Créer l'application Flask
 app = Flask(__name__)
 app.config.from_object('app.config.Config')
 
-# Configurer le logger de l'application
-app.logger.addHandler(file_handler)
-app.logger.addHandler(console_handler)
-app.logger.setLevel(logging.INFO)
+# Configurer le logger de l'application (écriture hors du thread de la requête)
+log_handler = setup_logging(app, logs_dir)
 app.logger.info('iTransfer backend startup')
 
 # Initialiser les extensions
 db = SQLAlchemy(app)
-CORS(app, supports_credentials=True)
-
-from app import routes
+# Migrations du schéma (flask db upgrade, lancé par entrypoint.sh)
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations'))
+CORS(app, supports_credentials=True, expose_headers=['ETag', 'Content-Range', 'Content-Length', 'Content-Disposition'])
+
+from app import routes, resumable
+
+def is_cli_command():
+    """
+    Vrai si l'application est chargée par une commande `flask` (db upgrade,
+    outbox-send, shell...) : aucune requête à servir, donc pas de threads
+    d'arrière-plan. `flask run` sert l'application et les garde.
+    """
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != 'run'
+
+# Métriques du pool de connexions à la base (/metrics)
+from app.metrics import instrument_db_pool
+instrument_db_pool()
+
+# Démarrer l'envoi des emails et le nettoyage des transferts expirés (un seul
+# leader parmi les workers) en arrière-plan, sauf pour une commande CLI
+from app.outbox import start_outbox_sender
+from app.cleanup import start_cleanup_worker
+if not is_cli_command():
+    start_outbox_sender()
+    start_cleanup_worker()
@@ -0,0 +1,367 @@
+import os
+import time
+import uuid
+import fcntl
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+from flask import request, jsonify
+from . import app
+from .metrics import upload_rejections
+
+# Réservation d'un autre hôte (volume partagé) considérée comme abandonnée au-delà
+STALE_RESERVATION_SECONDS = 24 * 3600
+
+# Préfixe des réservations attachées à une session d'upload par morceaux
+SESSION_PREFIX = 'session-'
+
+class AdmissionRejected(Exception):
+    """
+    Upload refusé avant la lecture du corps : 503 (trop d'uploads en cours)
+    ou 507 (espace disque insuffisant)
+    """
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionStats:
+    """
+    Uploads admis et refusés par ce processus
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_space = 0
+        self.active = 0
+        self.reserved_bytes = 0
+
+    def record_admitted(self, size, session=False):
+        with self.lock:
+            self.admitted += 1
+            # Une réservation de session peut être libérée par un autre worker :
+            # elle n'apparaît que dans le registre partagé
+            if not session:
+                self.active += 1
+                self.reserved_bytes += size
+
+    def record_resized(self, delta):
+        with self.lock:
+            self.reserved_bytes += delta
+
+    def record_released(self, size):
+        with self.lock:
+            self.active -= 1
+            self.reserved_bytes -= size
+
+    def record_rejected(self, status):
+        with self.lock:
+            if status == 503:
+                self.rejected_busy += 1
+            else:
+                self.rejected_space += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'admitted': self.admitted,
+                'rejected_busy': self.rejected_busy,
+                'rejected_space': self.rejected_space,
+                'active': self.active,
+                'reserved_bytes': self.reserved_bytes
+            }
+
+admission_stats = AdmissionStats()
+
+class Reservation:
+    """
+    Espace disque réservé par un upload en cours, jusqu'à sa libération
+    """
+
+    def __init__(self, controller, path, size, session_id=None):
+        self.controller = controller
+        self.path = path
+        self.size = size
+        self.session_id = session_id
+        self.released = False
+
+    def resize(self, size):
+        """
+        Ajuste la réservation à la taille déclarée par le formulaire. Une
+        augmentation est vérifiée comme une nouvelle admission.
+        """
+        if size != self.size and not self.released:
+            self.controller.resize(self, size)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self)
+
+class AdmissionController:
+    """
+    Admission des uploads avant la lecture de leur corps. Les réservations
+    sont enregistrées dans un registre partagé par les workers : un fichier
+    par upload en cours dans `directory` (hôte, pid, octets réservés), créé
+    et relu sous verrou (flock). Une réservation dont le processus a disparu
+    est ignorée et supprimée. Celle d'une session d'upload par morceaux est
+    nommée d'après la session : elle dure jusqu'à sa finalisation, son
+    annulation ou sa purge.
+
+    L'espace déjà écrit par un upload en cours est à la fois réservé et
+    absent de l'espace libre : l'estimation est prudente.
+    """
+
+    def __init__(self, directory, disk_path, max_uploads, max_worker_uploads, min_free_bytes, retry_after):
+        self.directory = directory
+        self.disk_path = disk_path
+        self.max_uploads = max_uploads
+        self.max_worker_uploads = max_worker_uploads
+        self.min_free_bytes = min_free_bytes
+        self.retry_after = retry_after
+        self.hostname = socket.gethostname()
+        self.local_lock = threading.Lock()
+        self.active = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            os.path.join(config['UPLOAD_FOLDER'], 'reservations'),
+            config['UPLOAD_FOLDER'],
+            max_uploads=config['ADMISSION_MAX_UPLOADS'],
+            max_worker_uploads=config['ADMISSION_MAX_WORKER_UPLOADS'],
+            min_free_bytes=config['ADMISSION_MIN_FREE_BYTES'],
+            retry_after=config['ADMISSION_RETRY_AFTER']
+        )
+
+    @contextmanager
+    def ledger_lock(self):
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def is_stale(self, name, path):
+        if name.startswith(SESSION_PREFIX):
+            # Libérée explicitement, y compris par la purge des sessions abandonnées
+            return False
+        hostname, pid = name.rsplit('-', 2)[:2]
+        if hostname != self.hostname:
+            return time.time() - os.path.getmtime(path) > STALE_RESERVATION_SECONDS
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, ValueError):
+            pass
+        return False
+
+    def read_ledger(self, exclude=None):
+        """
+        Retourne (uploads en cours, octets réservés) sur tous les workers,
+        en supprimant les réservations abandonnées. À appeler sous verrou.
+        """
+        count = reserved = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or path == exclude:
+                continue
+            try:
+                if self.is_stale(name, path):
+                    os.remove(path)
+                    app.logger.warning("Réservation abandonnée supprimée : %s", name)
+                    continue
+                with open(path) as f:
+                    reserved += int(f.read() or 0)
+            except (OSError, ValueError):
+                continue
+            count += 1
+        return count, reserved
+
+    def check_space(self, size, reserved):
+        usage = shutil.disk_usage(self.disk_path)
+        if size > usage.total - self.min_free_bytes:
+            # Ne tiendra jamais sur ce disque : inutile de réessayer
+            raise AdmissionRejected(507, 'Espace disque insuffisant pour ce transfert')
+        if usage.free - reserved - self.min_free_bytes < size:
+            raise AdmissionRejected(507, 'Espace disque insuffisant, réessayez plus tard', self.retry_after)
+
+    def reject(self, error):
+        admission_stats.record_rejected(error.status)
+        upload_rejections.labels('busy' if error.status == 503 else 'space').inc()
+        app.logger.warning("Upload refusé (%d) : %s", error.status, error)
+        raise error
+
+    def session_path(self, session_id):
+        return os.path.join(self.directory, SESSION_PREFIX + session_id)
+
+    def admit(self, size, session_id=None):
+        """
+        Admet un upload de `size` octets (réservés sur le disque) ou lève
+        AdmissionRejected. La réservation doit être libérée par release().
+        Avec `session_id`, elle est attachée à la session d'upload par
+        morceaux et non au processus : elle survit à la requête et peut être
+        libérée par n'importe quel worker (release_session()).
+        """
+        # Le plafond par worker ne concerne que les requêtes en cours de ce processus
+        worker_bound = session_id is None
+        with self.local_lock:
+            if worker_bound and self.max_worker_uploads and self.active >= self.max_worker_uploads:
+                self.reject(AdmissionRejected(503, 'Trop de transferts en cours, réessayez plus tard', self.retry_after))
+            if worker_bound:
+                self.active += 1
+        try:
+            with self.ledger_lock():
+                count, reserved = self.read_ledger()
+                if self.max_uploads and count >= self.max_uploads:
+                    raise AdmissionRejected(503, 'Trop de transferts en cours, réessayez plus tard', self.retry_after)
+                self.check_space(size, reserved)
+                if worker_bound:
+                    path = os.path.join(self.directory, f"{self.hostname}-{os.getpid()}-{uuid.uuid4().hex}")
+                else:
+                    path = self.session_path(session_id)
+                with open(path, 'w') as f:
+                    f.write(str(size))
+        except AdmissionRejected as e:
+            if worker_bound:
+                with self.local_lock:
+                    self.active -= 1
+            self.reject(e)
+        except Exception:
+            if worker_bound:
+                with self.local_lock:
+                    self.active -= 1
+            raise
+        admission_stats.record_admitted(size, session=not worker_bound)
+        return Reservation(self, path, size, session_id)
+
+    def resize(self, reservation, size):
+        with self.ledger_lock():
+            if size > reservation.size:
+                _, reserved = self.read_ledger(exclude=reservation.path)
+                try:
+                    self.check_space(size, reserved)
+                except AdmissionRejected as e:
+                    self.reject(e)
+            with open(reservation.path, 'w') as f:
+                f.write(str(size))
+        if reservation.session_id is None:
+            admission_stats.record_resized(size - reservation.size)
+        reservation.size = size
+
+    def release(self, reservation):
+        if reservation.session_id is not None:
+            self.release_session(reservation.session_id)
+            return
+        try:
+            os.remove(reservation.path)
+        except FileNotFoundError:
+            pass
+        with self.local_lock:
+            self.active -= 1
+        admission_stats.record_released(reservation.size)
+
+    def release_session(self, session_id):
+        """
+        Libère la réservation d'une session d'upload par morceaux (sans effet
+        si elle n'existe pas ou a déjà été libérée)
+        """
+        try:
+            os.remove(self.session_path(session_id))
+        except FileNotFoundError:
+            pass
+
+admission = AdmissionController.from_config(app.config)
+
+def estimate_upload_space(size, names=None, spooled=False):
+    """
+    Espace disque nécessaire à un upload : les fichiers reçus, plus l'archive
+    (ZIP ou tar.zst) construite à côté d'eux (mode 'materialized', plusieurs
+    fichiers ou dossier). Sans la liste des fichiers, seule la réception est comptée :
+    la réservation est agrandie dès que le formulaire est lu, avant
+    l'écriture du premier fichier. Un corps mis en tampon sur disque par le
+    serveur asynchrone (`spooled`) occupe sa propre copie jusqu'à la fin de
+    la requête : elle est comptée en plus.
+    """
+    needed = 2 * size if spooled else size
+    if names is None or app.config['ARCHIVE_MODE'] != 'materialized':
+        return needed
+    if len(names) <= 1 and not any('/' in name for name in names):
+        return needed
+    return needed + size
+
+def get_declared_size(files_list):
+    try:
+        return sum(int(file_info.get('size') or 0) for file_info in files_list)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+def is_upload_request(method, path):
+    """
+    Requête soumise à l'admission (envoi d'un transfert en une requête)
+    """
+    if method != 'POST':
+        return False
+    try:
+        endpoint, _ = app.url_map.bind('').match(path, method)
+    except Exception:
+        return False
+    return endpoint == 'upload_file'
+
+def reserve_upload(files_list=None):
+    """
+    Réservation de l'upload en cours, prise avant la lecture du corps (par
+    le serveur asynchrone ou par la vue) et libérée à la fin de la requête.
+    Avec la liste des fichiers déclarée dans le formulaire, elle est ajustée
+    à l'espace réellement nécessaire. Lève AdmissionRejected.
+    """
+    # Content-Length fait foi ; à défaut (envoi chunked), la taille déclarée
+    size = request.content_length
+    names = None
+    if files_list is not None:
+        names = [str(file_info.get('name', '')) for file_info in files_list if isinstance(file_info, dict)]
+        if size is None:
+            size = get_declared_size(files_list)
+    needed = estimate_upload_space(size or 0, names, request.environ.get('itransfer.spooled', False))
+
+    reservation = request.environ.get('itransfer.reservation')
+    if reservation is None:
+        reservation = admission.admit(needed)
+        request.environ['itransfer.reservation'] = reservation
+        request.environ['itransfer.reservation_owned'] = True
+    else:
+        reservation.resize(needed)
+    return reservation
+
+@app.teardown_request
+def release_upload_reservation(error=None):
+    """
+    Libère la réservation prise par la vue (succès comme échec)
+    """
+    reservation = request.environ.get('itransfer.reservation')
+    if reservation is not None and request.environ.get('itransfer.reservation_owned'):
+        reservation.release()
+
+def rejection_response(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def get_admission_stats():
+    """
+    Retourne les admissions du processus et l'état du registre partagé
+    """
+    stats = admission_stats.as_dict()
+    with admission.ledger_lock():
+        stats['uploads_in_progress'], stats['reserved_bytes_total'] = admission.read_ledger()
+    stats['free_bytes'] = shutil.disk_usage(admission.disk_path).free
+    return stats
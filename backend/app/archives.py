@@ -0,0 +1,559 @@
+import os
+import json
+import zlib
+import struct
+import zipfile
+import hashlib
+import tempfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from . import app, db
+from .models import FileUpload, TransferArchive, TransferMember
+from .zipstream import ZipEntry, ZipLayout, ZipStreamWriter
+from .tarstream import TarEntry, TarLayout, compress_stream, write_compressed, iter_decompressed_range, is_zstd_available
+from .hashing import HashingWriter
+from .compression import CompressionPolicy
+from .blobstore import get_blob_key, lock_stored_blob
+from .storage import storage
+from .logs import FileLogSampler
+
+# Taille des blocs lus lors de la compression d'un fichier
+DEFLATE_BUFFER_SIZE = 1024 * 1024
+
+# Formats d'archive proposés, qui servent aussi d'extension au nom de l'archive
+ARCHIVE_FORMATS = ('zip', 'tar.zst')
+
+def get_archive_format(requested=None):
+    """
+    Format de l'archive d'un transfert : celui demandé par l'expéditeur s'il
+    est valide, sinon celui du déploiement (ARCHIVE_FORMAT). Sans le paquet
+    zstandard, les archives sont des ZIP.
+    """
+    archive_format = requested if requested in ARCHIVE_FORMATS else app.config['ARCHIVE_FORMAT']
+    if archive_format not in ARCHIVE_FORMATS:
+        archive_format = 'zip'
+    if archive_format == 'tar.zst' and not is_zstd_available():
+        app.logger.warning("Format tar.zst indisponible (paquet zstandard absent) : archive ZIP")
+        archive_format = 'zip'
+    return archive_format
+
+def get_archive_name(now=None, archive_format='zip'):
+    """
+    Nom de l'archive d'un transfert multi-fichiers (iTransfer_AAMMJJHHMM.zip
+    ou iTransfer_AAMMJJHHMM.tar.zst)
+    """
+    now = now or datetime.now()
+    return f"iTransfer_{now.strftime('%y%m%d%H%M')}.{archive_format}"
+
+def get_member_prefix(file_id):
+    """
+    Préfixe des clés des fichiers d'un transfert dont l'archive est générée au
+    téléchargement (dossier <file_id>/ avant le magasin de blobs)
+    """
+    return f"{file_id}/"
+
+def get_legacy_key(file_info, archive=None):
+    """
+    Emplacement d'un transfert enregistré avant le magasin de blobs : le
+    fichier final (fichier unique ou ZIP) sous son nom, ou le préfixe des
+    fichiers si l'archive est générée à la volée
+    """
+    if archive is None:
+        archive = TransferArchive.query.get(file_info.id)
+    if archive is not None and archive.mode == 'streamed':
+        return get_member_prefix(file_info.id)
+    return file_info.filename
+
+def get_stored_key(file_info, archive=None):
+    """
+    Clé de stockage d'un transfert : le blob du fichier final (fichier
+    unique ou ZIP), identifié par son hash, ou à défaut l'emplacement d'avant
+    le magasin de blobs. Pour une archive générée à la volée, les fichiers
+    sont des blobs distincts (voir get_member_source).
+    """
+    if archive is None:
+        archive = TransferArchive.query.get(file_info.id)
+    if archive is None or archive.mode != 'streamed':
+        blob_key = get_blob_key(file_info.encrypted_data)
+        if storage.exists(blob_key):
+            return blob_key
+    return get_legacy_key(file_info, archive)
+
+def stat_stored_file(file_info, archive=None):
+    """
+    Description (StoredObject) du fichier final d'un transfert, None s'il
+    n'est plus stocké
+    """
+    return storage.stat(get_stored_key(file_info, archive))
+
+def get_member_source(file_id, member):
+    """
+    Clé d'un fichier d'une archive générée à la volée
+    """
+    blob_key = get_blob_key(member['sha256'])
+    if storage.exists(blob_key):
+        return blob_key
+    return get_member_prefix(file_id) + member['name']
+
+def is_transfer_stored(file_info, archive=None):
+    """
+    Vérifie que le contenu d'un transfert est toujours présent dans le stockage
+    """
+    if archive is None:
+        archive = TransferArchive.query.get(file_info.id)
+    if archive is not None and archive.mode == 'streamed':
+        return all(storage.exists(get_member_source(file_info.id, member)) for member in archive.get_manifest())
+    return stat_stored_file(file_info, archive) is not None
+
+def store_streamed_archive(file_id, file_list, archive_format='zip'):
+    """
+    Prépare une archive générée au téléchargement : les fichiers reçus sont
+    conservés tels quels (dans le magasin de blobs) et seul le manifeste est
+    enregistré, sans construire d'archive.
+    Retourne un tuple (nom de l'archive, hash, TransferArchive non enregistrée).
+    """
+    now = datetime.now().replace(microsecond=0)
+    manifest = [
+        {
+            'name': file_info['name'],
+            'size': file_info['size'],
+            'crc32': file_info['crc32'],
+            'sha256': file_info['sha256']
+        }
+        for file_info in file_list
+    ]
+    archive = TransferArchive(
+        file_id=file_id,
+        mode='streamed',
+        archive_format=archive_format,
+        manifest=json.dumps(manifest),
+        date_time=now
+    )
+    # Pour un tar.zst, la taille compressée n'est connue qu'après compression :
+    # c'est la taille du tar qui est enregistrée
+    archive.content_length = build_archive_layout(archive, resolve_keys=False).content_length
+
+    # L'archive produite est déterministe : le hash du manifeste (et du format) l'identifie
+    identity = json.dumps(manifest, sort_keys=True) + now.isoformat()
+    if archive_format != 'zip':
+        identity += archive_format
+    encrypted_data = hashlib.sha256(identity.encode('utf-8')).hexdigest()
+    return get_archive_name(now, archive_format), encrypted_data, archive
+
+def build_zip_entries(manifest, file_id, date_time):
+    """
+    Entrées ZIP des fichiers d'une archive générée à la volée. Sans file_id,
+    les clés ne sont pas résolues (calcul de la taille uniquement).
+    """
+    return [
+        ZipEntry(
+            member['name'],
+            member['size'],
+            member['crc32'],
+            get_member_source(file_id, member) if file_id else None,
+            date_time
+        )
+        for member in manifest
+    ]
+
+def build_tar_entries(manifest, file_id, mtime):
+    """
+    Entrées tar des fichiers d'une archive générée à la volée. Sans file_id,
+    les clés ne sont pas résolues (calcul de la taille uniquement).
+    """
+    return [
+        TarEntry(
+            member['name'],
+            member['size'],
+            get_member_source(file_id, member) if file_id else None,
+            mtime
+        )
+        for member in manifest
+    ]
+
+def build_archive_layout(archive, resolve_keys=True):
+    """
+    Calcule la disposition de l'archive d'un transfert à partir de son
+    manifeste : le ZIP, ou le tar avant sa compression en zstd
+    """
+    file_id = archive.file_id if resolve_keys else None
+    manifest = archive.get_manifest()
+    if archive.archive_format == 'tar.zst':
+        entries = build_tar_entries(manifest, file_id, int(archive.date_time.timestamp()))
+        return TarLayout(entries, storage.open_range)
+    date_time = archive.date_time.timetuple()[:6]
+    # Les données des fichiers sont lues depuis le stockage, par plages
+    return ZipLayout(build_zip_entries(manifest, file_id, date_time), storage.open_range)
+
+def iter_compressed_tar(layout):
+    """
+    Produit une archive tar.zst en flux : le tar est lu dans l'ordre et
+    compressé au fil de l'eau (ZSTD_THREADS threads)
+    """
+    return compress_stream(layout, app.config['ZSTD_LEVEL'], app.config['ZSTD_THREADS'])
+
+def deflate_file(source, destination, level):
+    """
+    Compresse un fichier en flux DEFLATE brut (sans en-tête zlib), tel qu'il
+    est stocké dans un ZIP. Retourne un tuple (crc32, taille compressée).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc32 = 0
+    compressed_size = 0
+    with open(source, 'rb') as src, open(destination, 'wb') as out:
+        while True:
+            block = src.read(DEFLATE_BUFFER_SIZE)
+            if not block:
+                break
+            crc32 = zlib.crc32(block, crc32)
+            data = compressor.compress(block)
+            out.write(data)
+            compressed_size += len(data)
+        data = compressor.flush()
+        out.write(data)
+        compressed_size += len(data)
+    return crc32, compressed_size
+
+def get_scratch_dir():
+    """
+    Dossier des fichiers de travail (flux compressés), distinct des dossiers
+    où sont reçus les fichiers : aucun nom choisi par l'expéditeur ne peut
+    entrer en collision avec un fichier de travail
+    """
+    scratch_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp', 'scratch')
+    os.makedirs(scratch_dir, exist_ok=True)
+    return scratch_dir
+
+def prepare_zip_entry(policy, file_info, date_time):
+    """
+    Prépare l'entrée ZIP d'un fichier : choix de la méthode puis, si besoin,
+    compression dans un fichier de travail. Exécuté en parallèle pour chaque fichier.
+    Retourne un tuple (ZipEntry, CompressionDecision).
+    """
+    decision = policy.decide(file_info['temp_path'], file_info['name'], file_info['size'])
+    if decision.compress_type == zipfile.ZIP_DEFLATED:
+        fd, deflated_path = tempfile.mkstemp(suffix='.deflate', dir=get_scratch_dir())
+        os.close(fd)
+        try:
+            crc32, compressed_size = deflate_file(file_info['temp_path'], deflated_path, decision.compresslevel)
+        except Exception:
+            os.remove(deflated_path)
+            raise
+        if compressed_size < file_info['size']:
+            entry = ZipEntry(
+                file_info['name'], file_info['size'], crc32, deflated_path, date_time,
+                compress_type=zipfile.ZIP_DEFLATED, compressed_size=compressed_size
+            )
+            return entry, decision
+        # La compression n'apporte rien : stocker le fichier tel quel
+        os.remove(deflated_path)
+    crc32 = file_info.get('crc32')
+    if crc32 is None:
+        crc32 = zlib.crc32(b'')
+        with open(file_info['temp_path'], 'rb') as f:
+            for block in iter(lambda: f.read(DEFLATE_BUFFER_SIZE), b''):
+                crc32 = zlib.crc32(block, crc32)
+    entry = ZipEntry(file_info['name'], file_info['size'], crc32, file_info['temp_path'], date_time)
+    return entry, decision
+
+def remove_scratch_files(futures):
+    """
+    Supprime les flux compressés qui n'ont pas été écrits dans le ZIP
+    (construction interrompue)
+    """
+    for future in futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+        entry, _ = future.result()
+        if entry.compress_type == zipfile.ZIP_DEFLATED and os.path.exists(entry.path):
+            os.remove(entry.path)
+
+def build_zip_archive(file_list, zip_path, workers=None):
+    """
+    Construit un ZIP sur disque en compressant les fichiers en parallèle
+    (ZIP_WORKERS threads, zlib libère le GIL), puis en écrivant les flux
+    compressés dans l'ordre, au fil de leur disponibilité. Le format produit
+    est un ZIP standard, avec les enregistrements ZIP64 au-delà de 4 Go.
+    Retourne un tuple (sha256 de l'archive, nombre de fichiers stockés sans
+    compression, secondes de CPU économisées, entrées écrites avec leur position).
+    """
+    policy = CompressionPolicy.from_config(app.config)
+    workers = max(1, min(workers or app.config['ZIP_WORKERS'], len(file_list)))
+    date_time = datetime.now().timetuple()[:6]
+    stored_count = 0
+    cpu_seconds_saved = 0.0
+    file_log = FileLogSampler(app.logger, app.config['LOG_FILE_SAMPLE'])
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(prepare_zip_entry, policy, file_info, date_time) for file_info in file_list]
+        try:
+            # Le ZIP est hashé pendant son écriture, sans relecture
+            with open(zip_path, 'wb') as zip_file:
+                writer = HashingWriter(zip_file)
+                zip_writer = ZipStreamWriter(writer)
+                for future in futures:
+                    entry, decision = future.result()
+                    file_log.debug("Ajout au ZIP : %s (%s, %s)", entry.name, decision.method_name, decision.reason)
+                    if decision.compress_type == zipfile.ZIP_STORED:
+                        stored_count += 1
+                        cpu_seconds_saved += decision.estimated_seconds_saved
+                    zip_writer.add(entry)
+                    # Libérer l'espace de la copie compressée dès qu'elle est écrite
+                    if entry.compress_type == zipfile.ZIP_DEFLATED:
+                        os.remove(entry.path)
+                zip_writer.close()
+        except Exception:
+            failed = True
+            for future in futures:
+                future.cancel()
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            raise
+        finally:
+            if failed:
+                # Attendre les compressions en cours avant de supprimer leurs fichiers de travail
+                executor.shutdown(wait=True)
+                remove_scratch_files(futures)
+
+    return writer.hexdigest(), stored_count, cpu_seconds_saved, zip_writer.entries
+
+def build_tar_archive(file_list, archive_path):
+    """
+    Construit une archive tar.zst sur disque à partir des fichiers reçus,
+    sans compression préalable : le tar est écrit dans l'ordre et compressé
+    en zstd par ZSTD_THREADS threads, puis hashé pendant son écriture.
+    Retourne un tuple (sha256 de l'archive, entrées écrites avec leur
+    position dans le tar).
+    """
+    mtime = int(datetime.now().timestamp())
+    layout = TarLayout(TarEntry(f['name'], f['size'], f['temp_path'], mtime) for f in file_list)
+    try:
+        with open(archive_path, 'wb') as archive_file:
+            writer = HashingWriter(archive_file)
+            write_compressed(layout, writer, app.config['ZSTD_LEVEL'], app.config['ZSTD_THREADS'])
+    except Exception:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    return writer.hexdigest(), layout.entries
+
+def build_tar_index(file_id, archive_path, entries, file_list):
+    """
+    Index d'un tar.zst construit à l'upload : position des données de chaque
+    fichier dans le tar décompressé. Retourne une TransferArchive non enregistrée.
+    """
+    received = {file_info['name']: file_info for file_info in file_list}
+    return TransferArchive(
+        file_id=file_id,
+        mode='materialized',
+        archive_format='tar.zst',
+        content_length=os.path.getsize(archive_path),
+        manifest=json.dumps([
+            {
+                'name': entry.name,
+                'size': entry.size,
+                'crc32': received[entry.name].get('crc32'),
+                'sha256': received[entry.name].get('sha256'),
+                'data_offset': entry.data_offset
+            }
+            for entry in entries
+        ]),
+        date_time=datetime.fromtimestamp(entries[0].mtime) if entries else datetime.now()
+    )
+
+def describe_zip_entry(entry, sha256=None):
+    """
+    Entrée de l'index d'un ZIP : de quoi extraire le fichier sans relire l'archive
+    """
+    member = {
+        'name': entry.name,
+        'size': entry.size,
+        'crc32': entry.crc32,
+        'compress_type': entry.compress_type,
+        'compressed_size': entry.compressed_size,
+        'data_offset': entry.data_offset
+    }
+    if sha256:
+        member['sha256'] = sha256
+    return member
+
+def get_archive_content_key(file_list, archive_format):
+    """
+    Empreinte du contenu d'une archive construite à l'upload : son format
+    puis le nom, la taille et le SHA-256 de chaque fichier, dans l'ordre.
+    Deux envois des mêmes fichiers ont la même empreinte, quelle que soit
+    la date inscrite dans leur archive.
+    """
+    digest = hashlib.sha256(archive_format.encode('utf-8'))
+    for file_info in file_list:
+        digest.update(json.dumps([file_info['name'], file_info['size'], file_info['sha256']]).encode('utf-8'))
+    return digest.hexdigest()
+
+def find_materialized_archive(file_id, content_key):
+    """
+    Archive déjà construite pour les mêmes fichiers, à réutiliser telle
+    quelle : rien n'est construit ni stocké en double. Son blob reste
+    verrouillé jusqu'à la fin de la transaction. Retourne un tuple (index de
+    l'archive pour `file_id`, non enregistré, blob), ou None.
+    """
+    candidates = (
+        db.session.query(TransferArchive, FileUpload.encrypted_data)
+        .join(FileUpload, FileUpload.id == TransferArchive.file_id)
+        .filter(TransferArchive.content_key == content_key, TransferArchive.mode == 'materialized')
+        .limit(5)
+    )
+    for existing, sha256 in candidates:
+        blob = lock_stored_blob(sha256)
+        if blob is not None:
+            return TransferArchive(
+                file_id=file_id,
+                mode='materialized',
+                archive_format=existing.archive_format,
+                content_length=existing.content_length,
+                manifest=existing.manifest,
+                date_time=existing.date_time,
+                content_key=content_key
+            ), blob
+    return None
+
+def build_archive_index(file_id, zip_path, entries, file_list):
+    """
+    Index d'un ZIP construit à l'upload, tiré des entrées écrites (positions,
+    tailles compressées, CRC) : un fichier peut ensuite être servi seul.
+    Retourne une TransferArchive non enregistrée.
+    """
+    hashes = {file_info['name']: file_info.get('sha256') for file_info in file_list}
+    return TransferArchive(
+        file_id=file_id,
+        mode='materialized',
+        archive_format='zip',
+        content_length=os.path.getsize(zip_path),
+        manifest=json.dumps([describe_zip_entry(entry, hashes.get(entry.name)) for entry in entries]),
+        date_time=datetime(*entries[0].date_time) if entries else datetime.now()
+    )
+
+def index_zip_file(zip_path):
+    """
+    Indexe un ZIP existant à partir de son répertoire central (pour les
+    archives construites avant l'index) : seuls le répertoire central et
+    l'en-tête local de chaque fichier sont lus.
+    """
+    members = []
+    with open(zip_path, 'rb') as f, zipfile.ZipFile(f) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            # Les longueurs du nom et de l'extra de l'en-tête local peuvent différer du répertoire central
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            entry = ZipEntry(info.filename, info.file_size, info.CRC, zip_path, info.date_time, info.compress_type, info.compress_size)
+            entry.data_offset = info.header_offset + 30 + name_length + extra_length
+            members.append(describe_zip_entry(entry))
+    return members
+
+def add_transfer_members(file_id, members):
+    """
+    Enregistre les fichiers d'un transfert dans transfer_member, sans valider la transaction
+    """
+    for position, member in enumerate(members):
+        db.session.add(TransferMember.from_manifest(file_id, position, member))
+
+def get_archive_members(file_info, archive=None):
+    """
+    Fichiers d'un transfert pouvant être téléchargés séparément, lus dans
+    transfer_member. Un transfert qui n'y figure pas encore (ZIP construit
+    avant l'index) est indexé au premier accès.
+    """
+    rows = TransferMember.query.filter_by(file_id=file_info.id).order_by(TransferMember.position).all()
+    if rows:
+        return [row.to_manifest() for row in rows]
+
+    if archive is None:
+        archive = TransferArchive.query.get(file_info.id)
+    if archive is not None:
+        members = archive.get_manifest()
+    else:
+        stored = stat_stored_file(file_info, archive)
+        files_list = file_info.get_files_list()
+        single_file = len(files_list) <= 1 and all(f['name'] == file_info.filename for f in files_list)
+        # Les ZIP d'avant l'index n'existent que sur disque (stockage local)
+        path = storage.local_path(stored.key)
+        if single_file or path is None or not zipfile.is_zipfile(path):
+            # Fichier unique : il est son propre et seul membre
+            members = [{'name': file_info.filename, 'size': stored.size, 'sha256': file_info.encrypted_data}]
+        else:
+            members = index_zip_file(path)
+            db.session.add(TransferArchive(
+                file_id=file_info.id,
+                mode='materialized',
+                archive_format='zip',
+                content_length=stored.size,
+                manifest=json.dumps(members),
+                date_time=datetime.fromtimestamp(stored.modified).replace(microsecond=0)
+            ))
+
+    add_transfer_members(file_info.id, members)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Indexé au même moment par une autre requête
+        db.session.rollback()
+    return members
+
+def find_archive_member(file_info, archive, path):
+    """
+    Fichier d'un transfert désigné par son chemin : une seule ligne, lue par
+    l'index (file_id, path). Retourne None si le transfert ne le contient pas.
+    """
+    row = TransferMember.query.filter_by(file_id=file_info.id, path=path).first()
+    if row is not None:
+        return row.to_manifest()
+    return next((m for m in get_archive_members(file_info, archive) if m['name'] == path), None)
+
+def get_member_file(file_info, archive, member):
+    """
+    Clé de stockage du fichier si le membre est stocké seul (archive générée
+    à la volée ou fichier unique), None s'il se trouve dans un ZIP ou un tar.zst
+    """
+    if archive is not None and archive.mode == 'streamed':
+        return get_member_source(file_info.id, member)
+    if 'data_offset' not in member:
+        return get_stored_key(file_info, archive)
+    return None
+
+def iter_member(zip_key, member, start=0, end=None):
+    """
+    Produit les octets [start, end[ d'un fichier du ZIP d'après sa position
+    dans l'index, décompressés si besoin (depuis le début du flux compressé)
+    """
+    end = member['size'] if end is None else end
+    data_offset = member['data_offset']
+    if member['compress_type'] == zipfile.ZIP_STORED:
+        yield from storage.open_range(zip_key, data_offset + start, data_offset + end)
+        return
+
+    # Flux DEFLATE brut : décompresser en sautant les octets avant start
+    decompressor = zlib.decompressobj(-15)
+    position = 0
+    for block in storage.open_range(zip_key, data_offset, data_offset + member['compressed_size']):
+        data = decompressor.decompress(block)
+        if position + len(data) > start and position < end:
+            yield data[max(start - position, 0):end - position]
+        position += len(data)
+        if position >= end:
+            return
+    data = decompressor.flush()
+    if data and position < end:
+        yield data[max(start - position, 0):end - position]
+
+def iter_tar_member(archive_key, archive_size, member, start=0, end=None):
+    """
+    Produit les octets [start, end[ d'un fichier d'un tar.zst d'après sa
+    position dans le tar. Un flux zstd ne se lit pas à partir d'une position :
+    l'archive est décompressée depuis son début jusqu'au fichier.
+    """
+    end = member['size'] if end is None else end
+    data_offset = member['data_offset']
+    yield from iter_decompressed_range(storage.open_range(archive_key, 0, archive_size), data_offset + start, data_offset + end)
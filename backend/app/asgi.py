@@ -0,0 +1,360 @@
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from . import app
+from .admission import admission, AdmissionRejected, estimate_upload_space, is_upload_request
+
+# Taille des blocs lus dans un fichier envoyé par send_file (wsgi.file_wrapper)
+FILE_BLOCK_SIZE = 1024 * 1024
+
+# Taille à partir de laquelle le corps reçu est écrit sur disque plutôt qu'en mémoire
+SPOOL_WRITE_SIZE = 1024 * 1024
+
+class AsyncServerStats:
+    """
+    Statistiques du mode asynchrone : clients en cours de réception ou
+    d'envoi, et requêtes en cours de traitement par les threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.receiving = 0
+        self.sending = 0
+        self.dispatching = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.disconnects = 0
+        self.rejected = 0
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'receiving': self.receiving,
+                'sending': self.sending,
+                'dispatching': self.dispatching,
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'disconnects': self.disconnects,
+                'rejected': self.rejected
+            }
+
+async_stats = AsyncServerStats()
+
+class FileWrapper:
+    """
+    wsgi.file_wrapper lisant par blocs de FILE_BLOCK_SIZE : chaque bloc coûte
+    un passage par le pool de threads, les 8 Ko par défaut de Werkzeug seraient trop petits
+    """
+
+    def __init__(self, file, buffer_size=8192):
+        self.file = file
+        self.buffer_size = max(buffer_size, FILE_BLOCK_SIZE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.buffer_size)
+        if data:
+            return data
+        raise StopIteration()
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+class ClientDisconnected(Exception):
+    pass
+
+class AsyncServer:
+    """
+    Application ASGI servant l'application Flask sans bloquer un worker
+    pendant les transferts lents.
+
+    Les phases dépendant du débit du client sont asynchrones : le corps de
+    la requête est reçu dans un fichier tampon (écritures dans le pool de
+    threads) avant d'appeler la vue, et la réponse est lue bloc par bloc dans
+    le pool de threads puis envoyée sans attendre le client. Les vues Flask
+    (base de données, stockage, mise en file des emails) s'exécutent donc
+    telles quelles, dans un thread, pour la seule durée de leur traitement :
+    un processus sert des milliers de clients lents avec quelques dizaines
+    de threads.
+    """
+
+    def __init__(self, wsgi_app, threads=32, spool_memory=1024 * 1024, spool_dir=None, max_body_size=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.spool_memory = spool_memory
+        self.spool_dir = spool_dir
+        self.max_body_size = max_body_size
+        self.executor = None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, wsgi_app, config):
+        return cls(
+            wsgi_app,
+            threads=config['ASYNC_WORKER_THREADS'],
+            spool_memory=config['ASYNC_SPOOL_MEMORY'],
+            spool_dir=os.path.join(config['UPLOAD_FOLDER'], 'temp'),
+            max_body_size=config['MAX_CONTENT_LENGTH']
+        )
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi')
+        return self.executor
+
+    async def run_blocking(self, context, function, *args):
+        """
+        Exécute un appel bloquant dans le pool de threads, dans le contexte
+        (contextvars) de la requête : les contextes Flask ouverts par la vue
+        restent valides d'un bloc de la réponse à l'autre.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(), context.run, function, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Type de connexion non géré : {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.get_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def send_error(self, send, status, message, retry_after=None):
+        body = message.encode('utf-8')
+        headers = [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(body)).encode())]
+        if retry_after:
+            headers.append((b'retry-after', str(retry_after).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def receive_body(self, receive, context):
+        """
+        Reçoit le corps de la requête dans un fichier tampon (en mémoire
+        jusqu'à spool_memory, sur disque au-delà). Retourne (fichier, taille).
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_memory, dir=self.spool_dir)
+        size = 0
+        pending = bytearray()
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise ClientDisconnected()
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if self.max_body_size is not None and size > self.max_body_size:
+                    raise ValueError('Corps de requête trop volumineux')
+                pending += chunk
+                more_body = message.get('more_body', False)
+                # Écritures groupées : un passage par le pool de threads par Mo reçu
+                if len(pending) >= SPOOL_WRITE_SIZE or (pending and not more_body):
+                    await self.run_blocking(context, spool.write, bytes(pending))
+                    async_stats.add(bytes_received=len(pending))
+                    pending.clear()
+                if not more_body:
+                    break
+            spool.seek(0)
+            return spool, size
+        except BaseException:
+            spool.close()
+            raise
+
+    def build_environ(self, scope, body, body_size):
+        """
+        Environnement WSGI de la requête (PEP 3333)
+        """
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(body_size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+            'asgi.scope': scope
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+                continue
+            if name == 'CONTENT_LENGTH':
+                continue
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def start_wsgi_response(self, environ):
+        """
+        Appel de l'application WSGI : retourne (statut, en-têtes, itérable du corps)
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return self.write_not_supported
+
+        body = self.wsgi_app(environ, start_response)
+        iterator = iter(body)
+        # Le statut peut n'être fixé qu'au premier bloc (générateurs)
+        first = b''
+        if not response:
+            first = next(iterator, b'')
+        return response['status'], response['headers'], body, iterator, first
+
+    @staticmethod
+    def write_not_supported(data):
+        raise NotImplementedError("write() n'est pas disponible en mode asynchrone")
+
+    async def watch_disconnect(self, receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def handle_http(self, scope, receive, send):
+        async_stats.add(requests=1)
+        context = contextvars.copy_context()
+
+        # Refus immédiat d'un corps annoncé trop volumineux, avant de le lire
+        content_length = next((value for name, value in scope['headers'] if name == b'content-length'), None)
+        if content_length is not None and not content_length.isdigit():
+            async_stats.add(rejected=1)
+            await self.send_error(send, 400, 'Content-Length invalide')
+            return
+        if content_length is not None and self.max_body_size is not None and int(content_length) > self.max_body_size:
+            async_stats.add(rejected=1)
+            await self.send_error(send, 413, 'Transfert trop volumineux')
+            return
+
+        # Admission d'un upload avant de recevoir son corps : la réservation
+        # couvre la mise en tampon puis le traitement par la vue
+        reservation = None
+        if is_upload_request(scope['method'], scope['path']):
+            try:
+                size = int(content_length or 0)
+                size = estimate_upload_space(size, spooled=size > self.spool_memory)
+                reservation = await self.run_blocking(context, admission.admit, size)
+            except AdmissionRejected as e:
+                async_stats.add(rejected=1)
+                await self.send_error(send, e.status, str(e), e.retry_after)
+                return
+        try:
+            await self.handle_admitted(scope, receive, send, context, reservation)
+        finally:
+            if reservation is not None:
+                await self.run_blocking(context, reservation.release)
+
+    async def handle_admitted(self, scope, receive, send, context, reservation):
+        async_stats.add(receiving=1)
+        try:
+            body, body_size = await self.receive_body(receive, context)
+        except ClientDisconnected:
+            async_stats.add(disconnects=1)
+            return
+        except ValueError:
+            async_stats.add(rejected=1)
+            await self.send_error(send, 413, 'Transfert trop volumineux')
+            return
+        finally:
+            async_stats.add(receiving=-1)
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(self.watch_disconnect(receive, disconnected))
+        result = None
+        try:
+            async_stats.add(dispatching=1)
+            try:
+                environ = self.build_environ(scope, body, body_size)
+                environ['itransfer.reservation'] = reservation
+                # Corps écrit sur disque (au-delà de spool_memory) : compté par l'admission
+                environ['itransfer.spooled'] = body_size > self.spool_memory
+                status, headers, result, iterator, first = await self.run_blocking(context, self.start_wsgi_response, environ)
+            finally:
+                async_stats.add(dispatching=-1)
+
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            # Limites de débit (bandwidth.py) : attente dans la boucle, sans occuper de thread
+            shaping = environ.get('itransfer.shaping')
+            if shaping is not None:
+                shaping.start()
+            async_stats.add(sending=1)
+            try:
+                chunk = first
+                while True:
+                    if chunk and shaping is not None:
+                        wait = shaping.reserve(len(chunk))
+                        if wait:
+                            await asyncio.sleep(wait)
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                        async_stats.add(bytes_sent=len(chunk))
+                    if disconnected.is_set():
+                        async_stats.add(disconnects=1)
+                        return
+                    chunk = await self.run_blocking(context, next, iterator, None)
+                    if chunk is None:
+                        break
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                async_stats.add(sending=-1)
+                if shaping is not None:
+                    shaping.finish()
+        finally:
+            watcher.cancel()
+            if result is not None and hasattr(result, 'close'):
+                await self.run_blocking(context, result.close)
+            await self.run_blocking(context, body.close)
+
+asgi_app = AsyncServer.from_config(app, app.config)
+
+def get_async_server_stats():
+    """
+    Retourne les statistiques du mode asynchrone (nulles en mode synchrone)
+    """
+    return async_stats.as_dict()
@@ -0,0 +1,301 @@
+import os
+import mmap
+import time
+import types
+import zlib
+import fcntl
+import struct
+import threading
+from flask import request, jsonify
+from . import app
+from .tracing import require_admin
+from .metrics import download_throttle_seconds, shaped_downloads
+
+# Vues de téléchargement soumises aux limites de débit
+SHAPED_ENDPOINTS = {'download_file', 'download_member'}
+
+# Buckets par adresse IP et par transfert : les clés sont hachées sur ce nombre d'emplacements
+BUCKET_SLOTS = 4096
+
+# Retard accumulé au-delà duquel un bucket est réinitialisé (horloge modifiée, fichier d'un ancien démarrage)
+MAX_BACKLOG_SECONDS = 3600
+
+# Fenêtre de mesure du débit courant de chaque téléchargement
+RATE_WINDOW_SECONDS = 1.0
+
+class SharedBuckets:
+    """
+    Buckets de débit partagés par les workers, selon l'algorithme GCRA : un
+    bucket n'est qu'un instant théorique d'arrivée (double) dans un fichier
+    projeté en mémoire. Chaque envoi de n octets repousse cet instant de
+    n / débit et attend s'il dépasse maintenant + tolérance. Des
+    téléchargements concurrents sur un même bucket sont ainsi servis à tour
+    de rôle, chacun recevant une part égale du débit.
+
+    Les mises à jour se font sous verrou de plage (lockf) : deux buckets
+    différents ne se bloquent pas entre eux.
+    """
+
+    def __init__(self, path, slots):
+        self.size = slots * 8
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < self.size:
+            os.ftruncate(self.fd, self.size)
+        self.map = mmap.mmap(self.fd, self.size)
+        # Les verrous lockf appartiennent au processus : les threads d'un même worker
+        # sont départagés par ce verrou
+        self.lock = threading.Lock()
+
+    def reserve(self, slot, cost, tolerance, now):
+        """
+        Réserve `cost` secondes d'émission sur un bucket. Retourne le délai
+        à attendre avant d'envoyer (négatif ou nul : envoi immédiat).
+        """
+        offset = slot * 8
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 8, offset, os.SEEK_SET)
+            try:
+                tat, = struct.unpack_from('d', self.map, offset)
+                if tat < now or tat > now + MAX_BACKLOG_SECONDS:
+                    tat = now
+                tat += cost
+                struct.pack_into('d', self.map, offset, tat)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 8, offset, os.SEEK_SET)
+        return tat - tolerance - now
+
+class DownloadShaper:
+    """
+    Limites applicables à un téléchargement : liste de (emplacement, débit)
+    """
+
+    def __init__(self, buckets, limits, tolerance):
+        self.buckets = buckets
+        self.limits = limits
+        self.tolerance = tolerance
+
+    def reserve(self, size):
+        now = time.time()
+        return max(self.buckets.reserve(slot, size / rate, self.tolerance, now) for slot, rate in self.limits)
+
+class ShapedStream:
+    """
+    Téléchargement en cours : octets envoyés, attente cumulée et débit courant
+    """
+
+    def __init__(self, transfer_id, client):
+        self.transfer_id = transfer_id
+        self.client = client
+        self.started = time.perf_counter()
+        self.bytes = 0
+        self.waited = 0.0
+        self.window_start = self.started
+        self.window_bytes = 0
+        self.rate = 0.0
+
+    def record(self, size, waited):
+        now = time.perf_counter()
+        self.bytes += size
+        self.waited += waited
+        self.window_bytes += size
+        if now - self.window_start >= RATE_WINDOW_SECONDS:
+            self.rate = self.window_bytes / (now - self.window_start)
+            self.window_start = now
+            self.window_bytes = 0
+
+class BandwidthStats:
+    """
+    Téléchargements limités de ce processus et leur débit courant
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = set()
+        self.completed = 0
+        self.bytes = 0
+        self.wait_seconds = 0.0
+
+    def start(self, stream):
+        with self.lock:
+            self.streams.add(stream)
+        shaped_downloads.inc()
+
+    def finish(self, stream):
+        with self.lock:
+            self.streams.discard(stream)
+            self.completed += 1
+            self.bytes += stream.bytes
+            self.wait_seconds += stream.waited
+        shaped_downloads.dec()
+
+    def as_dict(self):
+        """
+        Compteurs agrégés, sans identifiant de transfert ni adresse de client
+        """
+        with self.lock:
+            streams = list(self.streams)
+            return {
+                'limits': {
+                    'global': app.config['BANDWIDTH_GLOBAL_LIMIT'],
+                    'per_ip': app.config['BANDWIDTH_PER_IP_LIMIT'],
+                    'per_transfer': app.config['BANDWIDTH_PER_TRANSFER_LIMIT']
+                },
+                'active': len(streams),
+                'completed': self.completed,
+                'bytes': self.bytes + sum(stream.bytes for stream in streams),
+                'wait_seconds': round(self.wait_seconds + sum(stream.waited for stream in streams), 3),
+                'current_rate': round(sum(stream.rate for stream in streams))
+            }
+
+    def describe_streams(self):
+        """
+        Détail des téléchargements en cours (réservé à l'administrateur :
+        l'identifiant du transfert suffit à le télécharger)
+        """
+        with self.lock:
+            streams = sorted(self.streams, key=lambda stream: stream.started)
+            return [{
+                'transfer_id': stream.transfer_id,
+                'client': stream.client,
+                'bytes': stream.bytes,
+                'seconds': round(time.perf_counter() - stream.started, 3),
+                'rate': round(stream.rate),
+                'wait_seconds': round(stream.waited, 3)
+            } for stream in streams]
+
+bandwidth_stats = BandwidthStats()
+
+def get_limits():
+    return (
+        app.config['BANDWIDTH_GLOBAL_LIMIT'],
+        app.config['BANDWIDTH_PER_IP_LIMIT'],
+        app.config['BANDWIDTH_PER_TRANSFER_LIMIT']
+    )
+
+# Table partagée ouverte seulement si une limite est configurée
+shared_buckets = SharedBuckets(app.config['BANDWIDTH_STATE_PATH'], 1 + 2 * BUCKET_SLOTS) if any(get_limits()) else None
+
+def get_slot(key):
+    return zlib.crc32(key.encode('utf-8')) % BUCKET_SLOTS
+
+def get_client_ip():
+    """
+    Adresse du client, derrière PROXY_COUNT proxies (X-Forwarded-For)
+    """
+    forwarded = request.headers.get('X-Forwarded-For')
+    count = app.config['PROXY_COUNT']
+    if count > 0 and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        if len(addresses) >= count:
+            return addresses[-count]
+    return request.remote_addr or ''
+
+def build_shaper(transfer_id, client):
+    global_limit, ip_limit, transfer_limit = get_limits()
+    limits = []
+    if global_limit:
+        limits.append((0, global_limit))
+    if ip_limit:
+        limits.append((1 + get_slot(client), ip_limit))
+    if transfer_limit and transfer_id:
+        limits.append((1 + BUCKET_SLOTS + get_slot(transfer_id), transfer_limit))
+    return DownloadShaper(shared_buckets, limits, app.config['BANDWIDTH_BURST_SECONDS'])
+
+def shape_blocks(body, shaper, stream, chunk_size):
+    """
+    Relaie le corps d'une réponse au débit autorisé, par blocs d'au plus
+    `chunk_size` octets
+    """
+    bandwidth_stats.start(stream)
+    try:
+        for block in body:
+            for offset in range(0, len(block), chunk_size):
+                piece = block if len(block) <= chunk_size else block[offset:offset + chunk_size]
+                wait = shaper.reserve(len(piece))
+                if wait > 0:
+                    time.sleep(wait)
+                    download_throttle_seconds.inc(wait)
+                stream.record(len(piece), max(wait, 0.0))
+                yield piece
+    finally:
+        bandwidth_stats.finish(stream)
+        if hasattr(body, 'close'):
+            body.close()
+
+def read_file_blocks(file, chunk_size):
+    try:
+        yield from iter(lambda: file.read(chunk_size), b'')
+    finally:
+        file.close()
+
+class AsyncShaping:
+    """
+    Limitation appliquée par le serveur asynchrone : l'attente se fait dans
+    la boucle d'événements plutôt que dans un thread du pool
+    """
+
+    def __init__(self, shaper, stream):
+        self.shaper = shaper
+        self.stream = stream
+
+    def start(self):
+        bandwidth_stats.start(self.stream)
+
+    def reserve(self, size):
+        wait = max(self.shaper.reserve(size), 0.0)
+        if wait:
+            download_throttle_seconds.inc(wait)
+        self.stream.record(size, wait)
+        return wait
+
+    def finish(self):
+        bandwidth_stats.finish(self.stream)
+
+@app.after_request
+def shape_download(response):
+    """
+    Applique les limites de débit aux téléchargements servis par le worker.
+    Les réponses déléguées au serveur frontal ou au stockage objet ne sont
+    pas concernées (limit_rate de nginx, par exemple).
+    """
+    if shared_buckets is None or request.endpoint not in SHAPED_ENDPOINTS:
+        return response
+    if response.status_code not in (200, 206) or 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers:
+        return response
+
+    transfer_id = (request.view_args or {}).get('file_id')
+    client = get_client_ip()
+    shaper = build_shaper(transfer_id, client)
+    stream = ShapedStream(transfer_id, client)
+
+    if 'asgi.scope' in request.environ:
+        request.environ['itransfer.shaping'] = AsyncShaping(shaper, stream)
+        return response
+
+    chunk_size = app.config['BANDWIDTH_CHUNK_SIZE']
+    body = response.response
+    if not isinstance(body, types.GeneratorType):
+        # Fichier local (send_file) : lu par blocs plutôt qu'envoyé par sendfile
+        file = getattr(body, 'file', None) or getattr(body, 'filelike', None)
+        if file is None:
+            return response
+        body = read_file_blocks(file, chunk_size)
+        response.direct_passthrough = True
+    response.response = shape_blocks(body, shaper, stream, chunk_size)
+    return response
+
+def get_bandwidth_stats():
+    """
+    Retourne les limites de débit et les compteurs des téléchargements limités
+    """
+    return bandwidth_stats.as_dict()
+
+@app.route('/api/admin/bandwidth', methods=['GET'])
+def get_shaped_streams():
+    """
+    Téléchargements limités en cours sur ce processus, un par un
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    return jsonify({'streams': bandwidth_stats.describe_streams()}), 200
@@ -0,0 +1,211 @@
+import os
+import time
+import posixpath
+from sqlalchemy.exc import IntegrityError
+from . import app, db
+from .models import Blob, TransferBlob
+from .storage import storage
+
+# Longueur d'un nom de blob (SHA-256 en hexadécimal)
+BLOB_NAME_LENGTH = 64
+
+# Préfixe des clés du magasin de blobs, adressés par le SHA-256 de leur contenu
+BLOB_PREFIX = 'blobs/'
+
+# Nombre de blobs sans ligne en base vérifiés par requête
+ORPHAN_CHECK_BATCH = 500
+
+def get_blob_key(sha256):
+    """
+    Clé d'un blob, répartie sur deux niveaux (blobs/ab/cd/abcd...) pour ne
+    pas accumuler des milliers de fichiers dans un même dossier
+    """
+    return f"{BLOB_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def lock_blob(sha256, size):
+    """
+    Verrouille la ligne du blob jusqu'à la fin de la transaction, en la créant
+    si besoin. Deux uploads du même contenu peuvent tenter la création en même
+    temps : le perdant relit la ligne créée par l'autre.
+    """
+    blob = Blob.query.filter_by(sha256=sha256).with_for_update().first()
+    if blob is not None:
+        return blob
+    try:
+        with db.session.begin_nested():
+            blob = Blob(sha256=sha256, size=size, refcount=0)
+            db.session.add(blob)
+        return blob
+    except IntegrityError:
+        return Blob.query.filter_by(sha256=sha256).with_for_update().one()
+
+def add_blob(file_id, temp_path, sha256, size):
+    """
+    Range un fichier reçu dans le magasin et y ajoute la référence du transfert.
+    Si le contenu est déjà stocké, le fichier temporaire est simplement
+    supprimé : aucun octet n'est écrit ni conservé en double. Sinon il est
+    confié au stockage (renommé sans copie sur disque, envoyé en multipart sur S3).
+    À appeler dans la transaction qui enregistre le transfert : la ligne du
+    blob reste verrouillée jusqu'au commit, le ramasse-miettes ne peut donc
+    pas supprimer le fichier entre-temps.
+    Retourne True si le contenu était déjà stocké.
+    """
+    blob = lock_blob(sha256, size)
+    if db.session.get(TransferBlob, (file_id, sha256)) is None:
+        db.session.add(TransferBlob(file_id=file_id, sha256=sha256))
+        blob.refcount += 1
+
+    key = get_blob_key(sha256)
+    stored = storage.stat(key)
+    if stored is not None and stored.size == size:
+        os.remove(temp_path)
+        return True
+
+    storage.put_file(key, temp_path)
+    return False
+
+def lock_stored_blob(sha256):
+    """
+    Verrouille jusqu'à la fin de la transaction un blob encore référencé et
+    présent dans le magasin : le ramasse-miettes ne peut plus le supprimer.
+    Retourne le blob, ou None.
+    """
+    blob = Blob.query.filter_by(sha256=sha256).with_for_update().first()
+    if blob is None or blob.refcount <= 0 or storage.stat(get_blob_key(sha256)) is None:
+        return None
+    return blob
+
+def reference_blob(file_id, blob):
+    """
+    Ajoute la référence d'un transfert à un blob verrouillé par
+    lock_stored_blob, sans fichier à ranger (archive identique à celle d'un
+    autre transfert). Comme add_blob, à appeler après l'ajout du transfert
+    dans la transaction qui l'enregistre.
+    """
+    if db.session.get(TransferBlob, (file_id, blob.sha256)) is None:
+        db.session.add(TransferBlob(file_id=file_id, sha256=blob.sha256))
+        blob.refcount += 1
+
+def release_transfer_blobs(file_id):
+    """
+    Retire les références d'un transfert avant sa suppression. Les blobs qui
+    ne sont plus référencés sont supprimés par collect_garbage.
+    Retourne le nombre de références retirées.
+    """
+    links = TransferBlob.query.filter_by(file_id=file_id).all()
+    for link in links:
+        blob = Blob.query.filter_by(sha256=link.sha256).with_for_update().first()
+        if blob is not None:
+            blob.refcount -= 1
+        db.session.delete(link)
+    return len(links)
+
+def delete_stored_blob(sha256):
+    """
+    Supprime l'objet d'un blob dans le stockage. Retourne les octets libérés.
+    """
+    stored = storage.stat(get_blob_key(sha256))
+    if stored is not None and storage.delete(stored.key):
+        return stored.size
+    return 0
+
+def delete_unreferenced_blobs(executor=None, batch_size=ORPHAN_CHECK_BATCH):
+    """
+    Supprime les blobs qui ne sont plus référencés, par lots : les lignes du
+    lot sont verrouillées (un upload ne peut pas les référencer pendant ce
+    temps), les objets supprimés en parallèle sur `executor` s'il est fourni,
+    puis les lignes supprimées et le lot validé.
+    Retourne un tuple (blobs supprimés, octets libérés).
+    """
+    deleted = 0
+    freed = 0
+    skipped = set()
+    while True:
+        query = db.session.query(Blob.sha256).filter(Blob.refcount <= 0)
+        if skipped:
+            query = query.filter(Blob.sha256.notin_(skipped))
+        batch = [sha256 for (sha256,) in query.limit(batch_size).all()]
+        if not batch:
+            return deleted, freed
+
+        # Le verrou empêche un upload de référencer le blob pendant sa suppression
+        blobs = Blob.query.filter(Blob.sha256.in_(batch), Blob.refcount <= 0).with_for_update().all()
+        try:
+            sizes = (executor.map if executor else map)(delete_stored_blob, [blob.sha256 for blob in blobs])
+            freed += sum(sizes)
+        except Exception as e:
+            # Lot laissé en place, il sera repris au prochain passage
+            db.session.rollback()
+            app.logger.error(f"Magasin de blobs : échec de la suppression d'un lot : {str(e)}")
+            skipped.update(batch)
+            continue
+        for blob in blobs:
+            db.session.delete(blob)
+        db.session.commit()
+        deleted += len(blobs)
+
+def sweep_orphan_blobs():
+    """
+    Supprime les objets du magasin sans ligne en base (transaction
+    interrompue après leur rangement) plus anciens que BLOB_ORPHAN_GRACE_SECONDS.
+    Retourne un tuple (blobs supprimés, octets libérés).
+    """
+    deleted = 0
+    freed = 0
+    cutoff = time.time() - app.config['BLOB_ORPHAN_GRACE_SECONDS']
+    candidates = []
+    for stored in storage.list(BLOB_PREFIX):
+        if len(posixpath.basename(stored.key)) == BLOB_NAME_LENGTH and stored.modified < cutoff:
+            candidates.append(stored)
+        if len(candidates) >= ORPHAN_CHECK_BATCH:
+            count, size = delete_orphan_blobs(candidates)
+            deleted, freed, candidates = deleted + count, freed + size, []
+    count, size = delete_orphan_blobs(candidates)
+    return deleted + count, freed + size
+
+def collect_garbage(executor=None):
+    """
+    Supprime les blobs qui ne sont plus référencés, ainsi que les objets
+    du magasin sans ligne en base.
+    Retourne un tuple (blobs supprimés, octets libérés).
+    """
+    deleted, freed = delete_unreferenced_blobs(executor)
+    orphans, orphan_bytes = sweep_orphan_blobs()
+    deleted += orphans
+    freed += orphan_bytes
+    if deleted:
+        app.logger.info(f"Magasin de blobs : {deleted} blob(s) supprimé(s), {freed} octets libérés")
+    return deleted, freed
+
+def delete_orphan_blobs(candidates):
+    """
+    Supprime, parmi les objets du magasin, ceux qui n'ont pas de ligne en base.
+    Retourne un tuple (blobs supprimés, octets libérés).
+    """
+    if not candidates:
+        return 0, 0
+    names = [posixpath.basename(stored.key) for stored in candidates]
+    known = {sha256 for (sha256,) in db.session.query(Blob.sha256).filter(Blob.sha256.in_(names)).all()}
+    deleted = 0
+    freed = 0
+    for name, stored in zip(names, candidates):
+        if name not in known and storage.delete(stored.key):
+            freed += stored.size
+            deleted += 1
+    return deleted, freed
+
+def get_blob_stats():
+    """
+    Volume stocké et volume économisé par la déduplication
+    """
+    count, stored_bytes = db.session.query(db.func.count(Blob.sha256), db.func.coalesce(db.func.sum(Blob.size), 0)).one()
+    referenced_bytes, unique_bytes = (
+        db.session.query(db.func.coalesce(db.func.sum(Blob.size * Blob.refcount), 0), db.func.coalesce(db.func.sum(Blob.size), 0))
+        .filter(Blob.refcount > 0)
+        .one()
+    )
+    return {
+        'blobs': count,
+        'stored_bytes': int(stored_bytes),
+        'deduplicated_bytes': int(referenced_bytes) - int(unique_bytes)
+    }
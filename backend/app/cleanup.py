@@ -0,0 +1,305 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from . import app, db
+from .models import FileUpload, TransferArchive, TransferMember, MaintenanceLease
+from .archives import get_legacy_key
+from .blobstore import release_transfer_blobs, delete_unreferenced_blobs, sweep_orphan_blobs
+from .storage import storage
+from .resumable import purge_stale_upload_sessions
+from .transfer_cache import transfer_cache
+from .metrics import record_cleanup_pass
+from .tracing import span, traced_task
+from .outbox import purge_sent_emails
+
+# Nom du bail du nettoyage : un seul worker (tous nœuds confondus) le détient
+CLEANUP_LEASE_NAME = 'cleanup'
+
+# Marge ajoutée à l'attente de la prochaine expiration
+EXPIRY_MARGIN_SECONDS = 1
+
+# Identifiant de ce worker pour l'élection du leader
+worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Réveille le thread de nettoyage avant la fin de son attente
+cleanup_event = threading.Event()
+cleanup_thread = None
+cleanup_lock = threading.Lock()
+
+class CleanupStats:
+    """
+    Statistiques du nettoyage pour ce processus (significatives sur le leader)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leader = False
+        self.passes = 0
+        self.transfers_deleted = 0
+        self.blobs_deleted = 0
+        self.bytes_freed = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.last_pass = None
+        self.next_expiry = None
+
+    def record_pass(self, transfers, blobs, freed, failures, seconds):
+        with self.lock:
+            self.passes += 1
+            self.transfers_deleted += transfers
+            self.blobs_deleted += blobs
+            self.bytes_freed += freed
+            self.failures += failures
+            self.seconds += seconds
+            self.last_pass = {
+                'at': datetime.now().isoformat(),
+                'transfers_deleted': transfers,
+                'blobs_deleted': blobs,
+                'bytes_freed': freed,
+                'failures': failures,
+                'seconds': round(seconds, 3),
+                'transfers_per_second': round(transfers / seconds, 1) if seconds > 0 else None,
+                'bytes_per_second': round(freed / seconds) if seconds > 0 else None
+            }
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'worker': worker_id,
+                'leader': self.leader,
+                'passes': self.passes,
+                'transfers_deleted': self.transfers_deleted,
+                'blobs_deleted': self.blobs_deleted,
+                'bytes_freed': self.bytes_freed,
+                'failures': self.failures,
+                'seconds': round(self.seconds, 3),
+                'last_pass': self.last_pass,
+                'next_expiry': self.next_expiry.isoformat() if self.next_expiry else None
+            }
+
+cleanup_stats = CleanupStats()
+
+def acquire_lease(name, holder, seconds):
+    """
+    Obtient ou prolonge un bail de maintenance. La prise est une mise à jour
+    conditionnelle (bail libre, expiré ou déjà détenu) : un seul worker
+    l'obtient, les autres restent en attente jusqu'à son expiration.
+    Retourne True si le bail est détenu par `holder`.
+    """
+    now = datetime.now()
+    if db.session.get(MaintenanceLease, name) is None:
+        try:
+            db.session.add(MaintenanceLease(name=name, holder=None, expires_at=now))
+            db.session.commit()
+        except IntegrityError:
+            # Créé au même moment par un autre worker
+            db.session.rollback()
+
+    updated = (
+        MaintenanceLease.query
+        .filter(
+            MaintenanceLease.name == name,
+            or_(MaintenanceLease.holder.is_(None), MaintenanceLease.holder == holder, MaintenanceLease.expires_at < now)
+        )
+        .update({'holder': holder, 'expires_at': now + timedelta(seconds=seconds)}, synchronize_session=False)
+    )
+    db.session.commit()
+    return bool(updated)
+
+def get_next_expiry(now=None):
+    """
+    Date de la prochaine expiration à venir (lecture de l'index sur expires_at).
+    Les transferts déjà expirés mais en erreur sont repris au passage suivant.
+    """
+    now = now or datetime.now()
+    return db.session.query(db.func.min(FileUpload.expires_at)).filter(FileUpload.expires_at >= now).scalar()
+
+def delete_legacy_content(target):
+    """
+    Supprime le contenu d'un transfert antérieur au magasin de blobs : le
+    fichier final, ou les fichiers d'une archive générée à la volée.
+    Retourne le nombre d'objets supprimés.
+    """
+    key, streamed = target
+    if streamed:
+        return storage.delete_prefix(key)
+    return int(storage.delete(key))
+
+def expire_batch(executor, batch_size, skipped):
+    """
+    Supprime un lot de transferts expirés dans une transaction courte, puis
+    leurs anciens fichiers en parallèle. Un transfert en erreur est ignoré
+    jusqu'au passage suivant (ajouté à `skipped`).
+    Retourne le nombre de transferts supprimés (None si aucun n'était expiré).
+    """
+    query = db.session.query(FileUpload.id).filter(FileUpload.expires_at < datetime.now())
+    if skipped:
+        query = query.filter(FileUpload.id.notin_(skipped))
+    ids = [file_id for (file_id,) in query.order_by(FileUpload.expires_at).limit(batch_size).all()]
+    if not ids:
+        return None
+
+    legacy_targets = []
+    deleted_ids = []
+    for file in FileUpload.query.filter(FileUpload.id.in_(ids)).all():
+        try:
+            with db.session.begin_nested():
+                # Retirer les références aux blobs : ils sont supprimés s'ils ne servent plus à aucun transfert
+                released = release_transfer_blobs(file.id)
+                archive = db.session.get(TransferArchive, file.id)
+                # Un transfert rangé dans le magasin de blobs n'a rien d'autre dans le stockage
+                if not released:
+                    legacy_targets.append((get_legacy_key(file, archive), archive is not None and archive.mode == 'streamed'))
+                if archive is not None:
+                    db.session.delete(archive)
+                TransferMember.query.filter_by(file_id=file.id).delete(synchronize_session=False)
+                db.session.delete(file)
+            deleted_ids.append(file.id)
+        except Exception as e:
+            skipped.add(file.id)
+            app.logger.error(f"Erreur lors de la suppression du fichier {file.id}: {str(e)}")
+    db.session.commit()
+    # Les transferts supprimés ne doivent plus être servis depuis le cache de ce processus
+    for file_id in deleted_ids:
+        transfer_cache.invalidate(file_id)
+
+    for target, count in zip(legacy_targets, executor.map(delete_legacy_content, legacy_targets)):
+        if count:
+            app.logger.debug("Fichier expiré supprimé : %s", target[0])
+    return len(deleted_ids)
+
+def cleanup_expired_files(renew_lease=None):
+    """
+    Supprime les transferts expirés par lots bornés, chacun validé séparément,
+    puis les blobs qui ne sont plus référencés. Les suppressions dans le
+    stockage sont faites en parallèle (CLEANUP_WORKERS threads).
+    `renew_lease()` est appelé entre les lots et doit retourner False si le
+    bail a été perdu.
+    Retourne un tuple (transferts supprimés, blobs supprimés, octets libérés).
+    """
+    start = time.perf_counter()
+    batch_size = app.config['CLEANUP_BATCH_SIZE']
+    transfers = 0
+    skipped = set()
+    blobs = freed = 0
+    with traced_task('cleanup') as trace, ThreadPoolExecutor(max_workers=app.config['CLEANUP_WORKERS']) as executor:
+        while True:
+            with span('expire_batch'):
+                deleted = expire_batch(executor, batch_size, skipped)
+            if deleted is None:
+                break
+            transfers += deleted
+            if renew_lease is not None:
+                with span('renew_lease'):
+                    renewed = renew_lease()
+                if not renewed:
+                    app.logger.warning("Bail du nettoyage perdu : arrêt du passage en cours")
+                    break
+        if transfers:
+            with span('delete_blobs'):
+                blobs, freed = delete_unreferenced_blobs(executor, batch_size)
+        trace.attributes.update({'transfers': transfers, 'blobs': blobs, 'bytes_freed': freed, 'failures': len(skipped)})
+        trace.discard = not transfers and not skipped
+
+    seconds = time.perf_counter() - start
+    cleanup_stats.record_pass(transfers, blobs, freed, len(skipped), seconds)
+    record_cleanup_pass(transfers, blobs, freed, seconds)
+    if transfers or skipped:
+        app.logger.info(
+            "Nettoyage : %d transfert(s) expiré(s) supprimé(s), %d blob(s), %d octets libérés en %.2f s (%d en erreur)",
+            transfers, blobs, freed, seconds, len(skipped),
+            extra={'transfers': transfers, 'blobs': blobs, 'bytes_freed': freed, 'failures': len(skipped)}
+        )
+    return transfers, blobs, freed
+
+def run_maintenance():
+    """
+    Tâches moins urgentes, exécutées par le leader toutes les
+    CLEANUP_MAINTENANCE_INTERVAL secondes
+    """
+    for task in (sweep_orphan_blobs, purge_stale_upload_sessions, purge_sent_emails):
+        try:
+            task()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Erreur lors de la maintenance ({task.__name__}) : {str(e)}")
+
+def get_cleanup_delay(now=None):
+    """
+    Attente avant le prochain passage : jusqu'à la prochaine expiration,
+    bornée par CLEANUP_MAX_SLEEP_SECONDS (nouveaux transferts, renouvellement du bail)
+    """
+    now = now or datetime.now()
+    max_sleep = app.config['CLEANUP_MAX_SLEEP_SECONDS']
+    next_expiry = get_next_expiry(now)
+    cleanup_stats.next_expiry = next_expiry
+    if next_expiry is None:
+        return max_sleep
+    return min(max(0, (next_expiry - now).total_seconds()) + EXPIRY_MARGIN_SECONDS, max_sleep)
+
+def run_cleanup_worker():
+    """
+    Boucle du thread de nettoyage. Chaque worker tente d'obtenir le bail ;
+    le leader supprime les transferts dès leur expiration puis dort jusqu'à
+    la suivante, les autres réessaient toutes les CLEANUP_MAX_SLEEP_SECONDS
+    et prennent le relais si le leader disparaît.
+    """
+    lease_seconds = app.config['CLEANUP_LEASE_SECONDS']
+    next_maintenance = 0.0
+    while True:
+        delay = app.config['CLEANUP_MAX_SLEEP_SECONDS']
+        try:
+            with app.app_context():
+                renew = lambda: acquire_lease(CLEANUP_LEASE_NAME, worker_id, lease_seconds)
+                cleanup_stats.leader = renew()
+                if cleanup_stats.leader:
+                    cleanup_expired_files(renew)
+                    if time.monotonic() >= next_maintenance:
+                        run_maintenance()
+                        next_maintenance = time.monotonic() + app.config['CLEANUP_MAINTENANCE_INTERVAL']
+                    delay = get_cleanup_delay()
+        except Exception as e:
+            app.logger.error(f"Erreur lors du nettoyage des fichiers expirés: {str(e)}")
+        cleanup_event.wait(delay)
+        cleanup_event.clear()
+
+def start_cleanup_worker():
+    """
+    Démarre le thread de nettoyage (un par processus, un seul leader actif)
+    """
+    global cleanup_thread
+    if not app.config['CLEANUP_ENABLED']:
+        return
+    if app.config['CLEANUP_MAX_SLEEP_SECONDS'] >= app.config['CLEANUP_LEASE_SECONDS']:
+        app.logger.warning("CLEANUP_MAX_SLEEP_SECONDS doit être inférieur à CLEANUP_LEASE_SECONDS : le bail expirera entre deux passages")
+    with cleanup_lock:
+        if cleanup_thread is None or not cleanup_thread.is_alive():
+            cleanup_thread = threading.Thread(target=run_cleanup_worker, name='cleanup', daemon=True)
+            cleanup_thread.start()
+
+def get_cleanup_stats():
+    """
+    Retourne les statistiques du nettoyage du processus
+    """
+    return cleanup_stats.as_dict()
+
+@app.cli.command('cleanup-run')
+def cleanup_run_command():
+    """Supprime immédiatement les transferts expirés et les blobs inutilisés."""
+    holder = f"cli:{worker_id}"
+    renew = lambda: acquire_lease(CLEANUP_LEASE_NAME, holder, app.config['CLEANUP_LEASE_SECONDS'])
+    if not renew():
+        print("Nettoyage déjà en cours sur un autre worker")
+        return
+    transfers, blobs, freed = cleanup_expired_files(renew)
+    run_maintenance()
+    # Libérer le bail pour que les workers reprennent la main sans attendre son expiration
+    MaintenanceLease.query.filter_by(name=CLEANUP_LEASE_NAME, holder=holder).update({'expires_at': datetime.now()})
+    db.session.commit()
+    print(f"{transfers} transfert(s) supprimé(s), {blobs} blob(s), {freed} octets libérés")
@@ -0,0 +1,232 @@
+import os
+import time
+import zlib
+import zipfile
+import mimetypes
+import threading
+from . import app
+
+try:
+    import magic
+except ImportError:  # libmagic absent du système : détection par extension uniquement
+    magic = None
+
+# Types MIME dont le contenu est déjà compressé : inutile de les dégonfler
+INCOMPRESSIBLE_MIME_TYPES = {
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+    'application/x-xz', 'application/x-7z-compressed', 'application/x-rar',
+    'application/vnd.rar', 'application/x-rar-compressed', 'application/zstd',
+    'application/x-lzip', 'application/x-lz4', 'application/java-archive',
+    'application/epub+zip', 'application/vnd.android.package-archive',
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/heic', 'image/heif', 'image/avif',
+}
+INCOMPRESSIBLE_MIME_PREFIXES = (
+    'video/',
+    'application/vnd.openxmlformats-officedocument.',
+    'application/vnd.oasis.opendocument.',
+)
+# Formats audio non compressés : on laisse la sonde décider
+COMPRESSIBLE_AUDIO_TYPES = {'audio/wav', 'audio/x-wav', 'audio/aiff', 'audio/x-aiff'}
+
+# Taille lue en tête de fichier pour la détection du type
+SNIFF_SIZE = 8192
+
+# Débit de compression supposé tant qu'aucune sonde n'a été mesurée (octets/s)
+DEFAULT_DEFLATE_THROUGHPUT = 40 * 1024 * 1024
+
+class CompressionStats:
+    """
+    Statistiques cumulées de la politique de compression pour ce processus
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members_stored = 0
+        self.members_deflated = 0
+        self.bytes_stored = 0
+        self.bytes_deflated = 0
+        self.probe_seconds = 0.0
+        self.cpu_seconds_saved = 0.0
+        # Débit de compression mesuré par les sondes (octets et secondes cumulés)
+        self.probed_bytes = 0
+        self.probed_seconds = 0.0
+
+    def deflate_throughput(self):
+        with self.lock:
+            if self.probed_bytes and self.probed_seconds > 0:
+                return self.probed_bytes / self.probed_seconds
+        return DEFAULT_DEFLATE_THROUGHPUT
+
+    def record_probe(self, sample_size, seconds):
+        with self.lock:
+            self.probe_seconds += seconds
+            self.probed_bytes += sample_size
+            self.probed_seconds += seconds
+
+    def record(self, decision, size):
+        with self.lock:
+            if decision.compress_type == zipfile.ZIP_STORED:
+                self.members_stored += 1
+                self.bytes_stored += size
+                self.cpu_seconds_saved += decision.estimated_seconds_saved
+            else:
+                self.members_deflated += 1
+                self.bytes_deflated += size
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'members_stored': self.members_stored,
+                'members_deflated': self.members_deflated,
+                'bytes_stored': self.bytes_stored,
+                'bytes_deflated': self.bytes_deflated,
+                'probe_seconds': round(self.probe_seconds, 3),
+                'cpu_seconds_saved': round(self.cpu_seconds_saved, 3)
+            }
+
+compression_stats = CompressionStats()
+
+class CompressionDecision:
+    """
+    Méthode de compression retenue pour un fichier de l'archive
+    """
+
+    def __init__(self, compress_type, compresslevel=None, reason='', estimated_seconds_saved=0.0):
+        self.compress_type = compress_type
+        self.compresslevel = compresslevel
+        self.reason = reason
+        self.estimated_seconds_saved = estimated_seconds_saved
+
+    @property
+    def method_name(self):
+        if self.compress_type == zipfile.ZIP_STORED:
+            return 'stored'
+        return f"deflate-{self.compresslevel}"
+
+def sniff_mime_type(path, name):
+    """
+    Détecte le type MIME d'un fichier avec libmagic, ou par son extension à défaut
+    """
+    if magic is not None:
+        try:
+            with open(path, 'rb') as f:
+                return magic.from_buffer(f.read(SNIFF_SIZE), mime=True)
+        except Exception as e:
+            app.logger.warning(f"Détection du type impossible pour {name} : {str(e)}")
+    mime_type, _ = mimetypes.guess_type(name)
+    return mime_type or 'application/octet-stream'
+
+def is_incompressible_type(mime_type):
+    """
+    Indique si le type MIME correspond à un contenu déjà compressé
+    """
+    if mime_type in COMPRESSIBLE_AUDIO_TYPES:
+        return False
+    return (
+        mime_type in INCOMPRESSIBLE_MIME_TYPES
+        or mime_type.startswith(INCOMPRESSIBLE_MIME_PREFIXES)
+        or mime_type.startswith('audio/')
+    )
+
+def read_probe_sample(path, size, probe_size):
+    """
+    Lit un échantillon réparti en trois points du fichier (début, milieu, fin)
+    pour éviter de se laisser tromper par un en-tête compressible
+    """
+    if size <= probe_size:
+        with open(path, 'rb') as f:
+            return f.read()
+    part = probe_size // 3
+    sample = bytearray()
+    with open(path, 'rb') as f:
+        for offset in (0, (size - part) // 2, size - part):
+            f.seek(offset)
+            sample.extend(f.read(part))
+    return bytes(sample)
+
+class CompressionPolicy:
+    """
+    Choisit, pour chaque fichier ajouté à un ZIP, entre STORED et DEFLATED
+    ainsi que le niveau de compression.
+
+    Modes (ZIP_COMPRESSION) :
+    - 'deflate' : tout est compressé au niveau ZIP_COMPRESSION_LEVEL (ancien comportement)
+    - 'store' : aucune compression
+    - 'adaptive' : les contenus déjà compressés (détectés par libmagic) sont
+      stockés tels quels ; pour les autres, un échantillon est compressé et le
+      gain mesuré décide entre STORED, compression rapide ou niveau configuré.
+    """
+
+    def __init__(self, mode='adaptive', level=6, probe_size=256 * 1024, min_gain=0.05, fast_gain=0.2, min_size=4096):
+        self.mode = mode
+        self.level = level
+        self.probe_size = probe_size
+        self.min_gain = min_gain
+        self.fast_gain = fast_gain
+        self.min_size = min_size
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            mode=config['ZIP_COMPRESSION'],
+            level=config['ZIP_COMPRESSION_LEVEL'],
+            probe_size=config['ZIP_PROBE_SIZE'],
+            min_gain=config['ZIP_MIN_GAIN'],
+            fast_gain=config['ZIP_FAST_GAIN']
+        )
+
+    def estimate_deflate_seconds(self, size):
+        return size / compression_stats.deflate_throughput()
+
+    def decide(self, path, name, size=None):
+        """
+        Retourne la CompressionDecision pour un fichier et met à jour les statistiques
+        """
+        if size is None:
+            size = os.path.getsize(path)
+        decision = self._decide(path, name, size)
+        compression_stats.record(decision, size)
+        return decision
+
+    def _decide(self, path, name, size):
+        if self.mode == 'store':
+            return CompressionDecision(zipfile.ZIP_STORED, reason='configuration')
+        if self.mode != 'adaptive':
+            return CompressionDecision(zipfile.ZIP_DEFLATED, self.level, reason='configuration')
+
+        # Les petits fichiers sont compressés sans analyse : le coût est négligeable
+        if size < self.min_size:
+            return CompressionDecision(zipfile.ZIP_DEFLATED, self.level, reason='petit fichier')
+
+        mime_type = sniff_mime_type(path, name)
+        if is_incompressible_type(mime_type):
+            return CompressionDecision(
+                zipfile.ZIP_STORED,
+                reason=mime_type,
+                estimated_seconds_saved=self.estimate_deflate_seconds(size)
+            )
+
+        # Sonde : compresser un échantillon au niveau configuré
+        sample = read_probe_sample(path, size, self.probe_size)
+        start = time.perf_counter()
+        compressed_size = len(zlib.compress(sample, self.level))
+        probe_seconds = time.perf_counter() - start
+        compression_stats.record_probe(len(sample), probe_seconds)
+        gain = 1 - compressed_size / max(len(sample), 1)
+
+        if gain < self.min_gain:
+            return CompressionDecision(
+                zipfile.ZIP_STORED,
+                reason=f"gain {gain:.0%}",
+                estimated_seconds_saved=max(self.estimate_deflate_seconds(size) - probe_seconds, 0.0)
+            )
+        if gain < self.fast_gain:
+            # Gain modeste : compression rapide
+            return CompressionDecision(zipfile.ZIP_DEFLATED, 1, reason=f"gain {gain:.0%}")
+        return CompressionDecision(zipfile.ZIP_DEFLATED, self.level, reason=f"gain {gain:.0%}")
+
+def get_compression_stats():
+    """
+    Retourne les statistiques cumulées de compression du processus
+    """
+    return compression_stats.as_dict()
@@ -1,5 +1,6 @@
 import os
 import secrets
+import tempfile
 from sqlalchemy import create_engine
 
 class Config:
@@ -29,6 +30,137 @@ class Config:
     # Configuration des chemins
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024 * 1024  # 50 GB max-limit
+
+    # Admission des uploads avant la lecture du corps : uploads simultanés (0 = sans limite)
+    # et espace disque réservé dans un registre partagé par les workers (503/507 + Retry-After)
+    ADMISSION_MAX_UPLOADS = int(os.environ.get('ADMISSION_MAX_UPLOADS', '64'))  # Tous workers confondus
+    ADMISSION_MAX_WORKER_UPLOADS = int(os.environ.get('ADMISSION_MAX_WORKER_UPLOADS', '16'))  # Par worker
+    ADMISSION_MIN_FREE_BYTES = int(os.environ.get('ADMISSION_MIN_FREE_BYTES', str(1024 * 1024 * 1024)))  # Marge toujours laissée libre
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '30'))  # Secondes
+    
+    # Mode de réception des uploads : 'streaming' (écriture directe, une seule fois)
+    # ou 'standard' (analyse multipart de Werkzeug avec fichiers temporaires)
+    UPLOAD_INGEST_MODE = os.environ.get('UPLOAD_INGEST_MODE', 'streaming')
+    
+    # Stockage des transferts multi-fichiers : 'materialized' (archive construite à l'upload)
+    # ou 'streamed' (fichiers conservés tels quels, archive produite en flux au téléchargement)
+    ARCHIVE_MODE = os.environ.get('ARCHIVE_MODE', 'materialized')
+
+    # Format des archives : 'zip' ou 'tar.zst' (tar compressé en zstd, paquet zstandard requis).
+    # Valeur par défaut du déploiement, que l'expéditeur peut choisir par transfert (champ archive_format)
+    ARCHIVE_FORMAT = os.environ.get('ARCHIVE_FORMAT', 'zip')
+
+    # Stockage des contenus : 'filesystem' (UPLOAD_FOLDER) ou 's3' (stockage objet compatible S3 :
+    # AWS, MinIO, Ceph...). Les fichiers temporaires de réception restent dans UPLOAD_FOLDER.
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'filesystem')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')  # Préfixe des clés dans le bucket
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # Ex. http://minio:9000 (vide pour AWS)
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    S3_ADDRESSING_STYLE = os.environ.get('S3_ADDRESSING_STYLE', 'auto')  # 'path' pour MinIO
+    S3_MULTIPART_CHUNK_SIZE = int(os.environ.get('S3_MULTIPART_CHUNK_SIZE', str(16 * 1024 * 1024)))
+    S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', '8'))  # Parties envoyées en parallèle
+    # Téléchargements redirigés vers une URL signée plutôt que relayés par le worker
+    S3_PRESIGNED_DOWNLOADS = os.environ.get('S3_PRESIGNED_DOWNLOADS', 'true').lower() == 'true'
+    S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', '300'))  # Validité de l'URL en secondes
+
+    # Magasin de blobs : délai avant suppression d'un fichier sans ligne en base
+    # (upload interrompu entre le rangement du fichier et l'enregistrement du transfert)
+    BLOB_ORPHAN_GRACE_SECONDS = int(os.environ.get('BLOB_ORPHAN_GRACE_SECONDS', '3600'))
+    
+    # Nettoyage des transferts expirés : un seul worker leader (bail en base), qui dort
+    # jusqu'à la prochaine expiration et supprime par lots validés séparément
+    CLEANUP_ENABLED = os.environ.get('CLEANUP_ENABLED', 'true').lower() == 'true'
+    CLEANUP_BATCH_SIZE = int(os.environ.get('CLEANUP_BATCH_SIZE', '200'))  # Transferts par transaction
+    CLEANUP_WORKERS = int(os.environ.get('CLEANUP_WORKERS', '8'))  # Suppressions parallèles dans le stockage
+    CLEANUP_LEASE_SECONDS = int(os.environ.get('CLEANUP_LEASE_SECONDS', '900'))  # Délai avant relève d'un leader disparu
+    CLEANUP_MAX_SLEEP_SECONDS = int(os.environ.get('CLEANUP_MAX_SLEEP_SECONDS', '300'))  # Attente maximale entre deux passages
+    CLEANUP_MAINTENANCE_INTERVAL = int(os.environ.get('CLEANUP_MAINTENANCE_INTERVAL', '3600'))  # Sessions, emails, blobs orphelins
+    
+    # Cache des métadonnées des transferts (page de téléchargement, autorisation des
+    # téléchargements) : LRU par processus, éventuellement partagé via Redis
+    TRANSFER_CACHE_SIZE = int(os.environ.get('TRANSFER_CACHE_SIZE', '1024'))  # 0 pour désactiver
+    TRANSFER_CACHE_TTL = int(os.environ.get('TRANSFER_CACHE_TTL', '60'))  # Secondes
+    TRANSFER_CACHE_REDIS_URL = os.environ.get('TRANSFER_CACHE_REDIS_URL')  # ex. redis://redis:6379/0
+    TRANSFER_CACHE_SHARED_TTL = int(os.environ.get('TRANSFER_CACHE_SHARED_TTL', '300'))
+
+    # Mode de service asynchrone (SERVER_MODE=async, serveur ASGI uvicorn) : les clients
+    # lents n'occupent pas de thread, seul le traitement des vues passe par ce pool
+    ASYNC_WORKER_THREADS = int(os.environ.get('ASYNC_WORKER_THREADS', '32'))
+    ASYNC_SPOOL_MEMORY = int(os.environ.get('ASYNC_SPOOL_MEMORY', str(1024 * 1024)))  # Corps gardés en mémoire jusqu'à cette taille
+
+    # Traces des requêtes (durée de chaque phase) : résumé dans les logs, traces lentes et
+    # profils gardés dans TRACE_DIR (partagé par les workers), consultables via /api/admin/traces
+    TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'true').lower() == 'true'
+    TRACE_DIR = os.environ.get('TRACE_DIR') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs', 'traces')
+    TRACE_SLOW_SECONDS = float(os.environ.get('TRACE_SLOW_SECONDS', '5'))  # Traces conservées au-delà
+    TRACE_KEEP = int(os.environ.get('TRACE_KEEP', '200'))  # Traces lentes conservées
+    TRACE_PROFILE_SAMPLE_RATE = float(os.environ.get('TRACE_PROFILE_SAMPLE_RATE', '0'))  # Part des requêtes profilées
+    TRACE_PROFILE_INTERVAL = float(os.environ.get('TRACE_PROFILE_INTERVAL', '0.005'))  # Intervalle d'échantillonnage
+    # Jeton des routes d'administration (/api/admin, /api/stats) et de l'en-tête X-Profile (désactivés sans jeton)
+    TRACE_ADMIN_TOKEN = os.environ.get('TRACE_ADMIN_TOKEN')
+
+    # Journalisation : file bornée vidée par un thread d'écriture, sortie 'json' (une ligne
+    # par enregistrement) ou 'text'. Les lignes par fichier d'un upload sont au niveau DEBUG.
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))  # Au-delà, DEBUG/INFO sont perdus (comptés)
+    LOG_FILE_SAMPLE = int(os.environ.get('LOG_FILE_SAMPLE', '20'))  # Lignes par fichier journalisées par requête
+
+    # Délégation de l'envoi des fichiers au serveur web frontal :
+    # 'none' (envoi par le worker), 'x-accel' (nginx) ou 'x-sendfile' (Apache, lighttpd)
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', 'none')
+    # Préfixe de la location nginx « internal » qui sert UPLOAD_FOLDER (mode x-accel)
+    DOWNLOAD_OFFLOAD_PREFIX = os.environ.get('DOWNLOAD_OFFLOAD_PREFIX', '/protected-uploads/')
+
+    # Limites de débit des téléchargements servis par les workers, en octets par seconde
+    # (0 = sans limite), partagées entre les workers d'un même hôte via BANDWIDTH_STATE_PATH
+    BANDWIDTH_GLOBAL_LIMIT = int(os.environ.get('BANDWIDTH_GLOBAL_LIMIT', '0'))
+    BANDWIDTH_PER_IP_LIMIT = int(os.environ.get('BANDWIDTH_PER_IP_LIMIT', '0'))
+    BANDWIDTH_PER_TRANSFER_LIMIT = int(os.environ.get('BANDWIDTH_PER_TRANSFER_LIMIT', '0'))
+    BANDWIDTH_BURST_SECONDS = float(os.environ.get('BANDWIDTH_BURST_SECONDS', '0.5'))  # Avance tolérée sur le débit
+    BANDWIDTH_CHUNK_SIZE = int(os.environ.get('BANDWIDTH_CHUNK_SIZE', str(256 * 1024)))  # Octets envoyés par réservation
+    BANDWIDTH_STATE_PATH = os.environ.get('BANDWIDTH_STATE_PATH') or os.path.join(tempfile.gettempdir(), 'itransfer-bandwidth')
+    
+    # Nombre de threads utilisés pour hasher les fichiers en parallèle
+    HASH_WORKERS = int(os.environ.get('HASH_WORKERS', str(os.cpu_count() or 4)))
+    
+    # Compression des archives ZIP : 'adaptive' (selon le contenu), 'deflate' ou 'store'
+    ZIP_COMPRESSION = os.environ.get('ZIP_COMPRESSION', 'adaptive')
+    ZIP_COMPRESSION_LEVEL = int(os.environ.get('ZIP_COMPRESSION_LEVEL', '6'))
+    ZIP_PROBE_SIZE = int(os.environ.get('ZIP_PROBE_SIZE', str(256 * 1024)))  # Échantillon analysé par fichier
+    ZIP_MIN_GAIN = float(os.environ.get('ZIP_MIN_GAIN', '0.05'))  # En dessous : fichier stocké sans compression
+    ZIP_FAST_GAIN = float(os.environ.get('ZIP_FAST_GAIN', '0.2'))  # En dessous : compression rapide (niveau 1)
+    ZIP_WORKERS = int(os.environ.get('ZIP_WORKERS', str(os.cpu_count() or 4)))  # Fichiers compressés en parallèle
+
+    # Compression des archives tar.zst
+    ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', '3'))  # 1 (rapide) à 19 (compact)
+    ZSTD_THREADS = int(os.environ.get('ZSTD_THREADS', str(os.cpu_count() or 4)))  # Threads de compression zstd (0 : un seul, sans thread dédié)
+    
+    # Configuration de l'upload par morceaux (reprise possible)
+    CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', str(8 * 1024 * 1024)))  # 8 MB par défaut
+    MAX_CHUNK_SIZE = 64 * 1024 * 1024  # Taille maximale acceptée pour un morceau
+    UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '48'))  # Durée de vie d'une session inachevée
+    
+    # Pool de sessions SMTP par processus (connexion, TLS et authentification réutilisés)
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', '2'))
+    SMTP_POOL_IDLE_TIMEOUT = int(os.environ.get('SMTP_POOL_IDLE_TIMEOUT', '60'))  # Fermeture après inactivité
+    SMTP_POOL_NOOP_INTERVAL = int(os.environ.get('SMTP_POOL_NOOP_INTERVAL', '10'))  # NOOP avant réutilisation au-delà
+    SMTP_POOL_MAX_AGE = int(os.environ.get('SMTP_POOL_MAX_AGE', '600'))  # Durée de vie maximale d'une session
+    SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '30'))  # Délai max de chaque opération réseau SMTP
+    
+    # File d'envoi des emails (outbox) : nouveaux essais avec délai croissant,
+    # puis abandon après OUTBOX_MAX_ATTEMPTS échecs
+    OUTBOX_SENDER_ENABLED = os.environ.get('OUTBOX_SENDER_ENABLED', 'true').lower() == 'true'
+    OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '5'))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '20'))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+    OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', '30'))
+    OUTBOX_RETRY_MAX_SECONDS = int(os.environ.get('OUTBOX_RETRY_MAX_SECONDS', '3600'))
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '300'))  # Délai avant de reprendre un envoi interrompu
+    OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', '30'))  # Conservation des emails envoyés
     
     # Configuration admin avec valeurs par défaut sécurisées
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME')
@@ -36,6 +168,7 @@ class Config:
     
     # Configuration SMTP
     SMTP_CONFIG_PATH = os.environ.get('SMTP_CONFIG_PATH') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'smtp_config.json')
+    SMTP_CONFIG_CHECK_INTERVAL = float(os.environ.get('SMTP_CONFIG_CHECK_INTERVAL', '2'))  # Délai max avant prise en compte par les autres workers
     
     # Configuration de l'environnement
     ENVIRONMENT = os.environ.get('FLASK_ENV', 'production')  # 'development' ou 'production'
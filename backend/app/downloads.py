@@ -0,0 +1,213 @@
+import os
+import secrets
+import mimetypes
+import unicodedata
+from urllib.parse import quote
+from flask import Response, request, send_file, redirect
+from werkzeug.http import dump_options_header
+from . import app
+from .storage import storage
+
+# Au-delà de ce nombre de plages, l'en-tête Range est ignoré et la ressource envoyée en entier
+MAX_RANGES = 16
+
+def content_disposition(filename):
+    """
+    Paramètres de l'en-tête Content-Disposition, avec la forme RFC 5987
+    pour les noms non ASCII
+    """
+    try:
+        filename.encode('ascii')
+        return {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='')}"}
+
+def get_offload_mode():
+    """
+    Mode de délégation des téléchargements au serveur web frontal :
+    'x-accel' (nginx), 'x-sendfile' (Apache, lighttpd) ou 'none'
+    """
+    mode = (app.config['DOWNLOAD_OFFLOAD'] or 'none').lower()
+    return mode if mode in ('x-accel', 'x-sendfile') else 'none'
+
+def build_offload_response(file_path, download_name):
+    """
+    Réponse vide dont un en-tête demande au serveur frontal d'envoyer
+    lui-même le fichier : le worker est libéré dès la réponse produite.
+    Retourne None si aucun mode de délégation n'est configuré.
+    """
+    mode = get_offload_mode()
+    if mode == 'none':
+        return None
+
+    response = Response(mimetype=guess_mimetype(download_name))
+    response.headers.set('Content-Disposition', 'attachment', **content_disposition(download_name))
+    if mode == 'x-accel':
+        # Chemin interne nginx : location « internal » pointant sur UPLOAD_FOLDER
+        relative_path = os.path.relpath(file_path, app.config['UPLOAD_FOLDER'])
+        prefix = app.config['DOWNLOAD_OFFLOAD_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(relative_path.replace(os.sep, '/'))}"
+    else:
+        # Les en-têtes WSGI sont en latin-1 : transmettre les octets UTF-8 du chemin tels quels
+        response.headers['X-Sendfile'] = os.path.abspath(file_path).encode('utf-8').decode('latin-1')
+    app.logger.info("Téléchargement délégué au serveur frontal (%s) : %s", mode, download_name)
+    return response
+
+def build_presigned_response(key, download_name):
+    """
+    Redirection vers une URL signée du stockage objet : le client télécharge
+    directement depuis le stockage (plages comprises), sans passer par le worker.
+    Retourne None si le stockage ne le permet pas.
+    """
+    if not storage.presigned_downloads:
+        return None
+    url = storage.get_download_url(key, dump_options_header('attachment', content_disposition(download_name)))
+    if url is None:
+        return None
+    response = redirect(url, code=302)
+    # L'URL expire : elle ne doit pas être gardée en cache
+    response.headers['Cache-Control'] = 'no-store'
+    app.logger.info("Téléchargement redirigé vers le stockage objet : %s", download_name)
+    return response
+
+def is_not_modified(etag):
+    """
+    Indique si le client possède déjà cette version (If-None-Match)
+    """
+    return request.if_none_match.contains_weak(etag)
+
+def get_requested_ranges(length, etag):
+    """
+    Plages d'octets à servir, sous forme de liste [(début, fin exclue)].
+    Retourne None si la ressource doit être envoyée en entière (pas de Range,
+    Range invalide, ou If-Range ne correspondant pas à la version actuelle),
+    et une liste vide si aucune plage n'est satisfiable.
+    """
+    if 'Range' not in request.headers:
+        return None
+    # If-Range : la reprise n'est valable que pour la même version (ETag forte)
+    if 'If-Range' in request.headers and request.if_range.etag != etag:
+        return None
+    # Werkzeug n'accepte que des plages croissantes et disjointes, les autres sont ignorées
+    requested = request.range
+    if requested is None or requested.units != 'bytes' or len(requested.ranges) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for start, stop in requested.ranges:
+        if start < 0:
+            start, stop = max(length + start, 0), length
+        elif stop is None or stop > length:
+            stop = length
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+def build_range_response(ranges, length, read_range, mimetype, etag, download_name):
+    """
+    Réponse 206 pour une ou plusieurs plages (multipart/byteranges), ou 416
+    si aucune plage n'est satisfiable. read_range(start, end) produit les
+    octets d'une plage.
+    """
+    if not ranges:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f"bytes */{length}"
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = Response(read_range(start, end), status=206, mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Range'] = f"bytes {start}-{end - 1}/{length}"
+        response.headers['Content-Length'] = str(end - start)
+    else:
+        boundary = secrets.token_hex(16)
+        heads = [
+            (b'\r\n' if index else b'') + (
+                f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{length}\r\n\r\n"
+            ).encode('ascii')
+            for index, (start, end) in enumerate(ranges)
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode('ascii')
+
+        def generate():
+            for head, (start, end) in zip(heads, ranges):
+                yield head
+                yield from read_range(start, end)
+            yield closing
+
+        content_length = sum(len(head) for head in heads) + sum(end - start for start, end in ranges) + len(closing)
+        response = Response(generate(), status=206, mimetype=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+        response.headers['Content-Length'] = str(content_length)
+
+    response.headers.set('Content-Disposition', 'attachment', **content_disposition(download_name))
+    set_validators(response, etag)
+    return response
+
+def set_validators(response, etag):
+    """
+    Ajoute l'ETag et l'annonce de la prise en charge des plages
+    """
+    response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def guess_mimetype(download_name):
+    return mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+def build_stream_response(length, read_range, mimetype, etag, download_name):
+    """
+    Réponse pour un contenu produit en flux (archive générée à la volée,
+    fichier extrait d'un ZIP) : 200 complet ou 206 selon l'en-tête Range.
+    read_range(start, end) produit les octets d'une plage.
+    """
+    ranges = get_requested_ranges(length, etag)
+    if ranges is not None:
+        return build_range_response(ranges, length, read_range, mimetype, etag, download_name)
+
+    response = Response(
+        read_range(0, length),
+        mimetype=mimetype,
+        headers={'Content-Length': str(length)},
+        direct_passthrough=True
+    )
+    response.headers.set('Content-Disposition', 'attachment', **content_disposition(download_name))
+    return set_validators(response, etag)
+
+def build_unsized_stream_response(chunks, mimetype, etag, download_name):
+    """
+    Réponse pour un contenu produit en flux dont la taille n'est pas connue
+    d'avance (archive compressée au téléchargement) : toujours envoyé en
+    entier, sans Content-Length, l'en-tête Range est ignoré
+    """
+    response = Response(chunks, mimetype=mimetype, direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment', **content_disposition(download_name))
+    response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'none'
+    return response
+
+def send_stored_file(key, download_name, etag):
+    """
+    Envoie un objet du stockage, entier ou par plages. Un fichier local est
+    envoyé directement, un objet distant est lu par plages.
+    """
+    path = storage.local_path(key)
+    if path is None:
+        read_range = lambda start, end: storage.open_range(key, start, end)
+        return build_stream_response(storage.stat(key).size, read_range, guess_mimetype(download_name), etag, download_name)
+
+    length = os.path.getsize(path)
+    ranges = get_requested_ranges(length, etag)
+    if ranges is not None:
+        read_range = lambda start, end: storage.open_range(key, start, end)
+        return build_range_response(ranges, length, read_range, guess_mimetype(download_name), etag, download_name)
+
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=False,
+        etag=False
+    )
+    return set_validators(response, etag)
@@ -0,0 +1,66 @@
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from . import app
+
+# Taille des blocs lus lors du calcul d'un hash
+HASH_BUFFER_SIZE = 1024 * 1024
+
+class HashingWriter:
+    """
+    Enveloppe un fichier ouvert en écriture et calcule le SHA-256, le CRC32
+    et la taille des données au fur et à mesure qu'elles sont écrites.
+    L'objet n'est pas « seekable » : zipfile écrit alors l'archive de façon
+    séquentielle, ce qui permet de la hasher sans la relire.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.crc32 = 0
+        self.size = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.hasher.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+def hash_file(path):
+    """
+    Calcule le SHA-256 et le CRC32 d'un fichier par blocs, sans le charger en mémoire.
+    Retourne un tuple (sha256, crc32).
+    """
+    hasher = hashlib.sha256()
+    crc32 = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BUFFER_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+            crc32 = zlib.crc32(block, crc32)
+    return hasher.hexdigest(), crc32
+
+def hash_files(paths):
+    """
+    Calcule le SHA-256 et le CRC32 de plusieurs fichiers en parallèle.
+    hashlib libère le GIL sur les gros blocs : les threads utilisent
+    réellement plusieurs cœurs.
+    """
+    paths = list(paths)
+    if len(paths) <= 1:
+        return [hash_file(path) for path in paths]
+    workers = min(app.config['HASH_WORKERS'], len(paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(hash_file, paths))
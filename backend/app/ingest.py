@@ -0,0 +1,115 @@
+import os
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge, ClientDisconnected
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NEED_DATA
+from . import app
+from .hashing import HashingWriter
+
+# Taille des blocs lus depuis le corps de la requête
+READ_BUFFER_SIZE = 1024 * 1024
+
+class MalformedMultipart(ValueError):
+    """
+    Corps multipart tronqué (client déconnecté pendant l'envoi) ou invalide
+    """
+
+def ingest_multipart(stream, boundary, dest_dir, before_files=None):
+    """
+    Lit un corps multipart/form-data au fil de l'eau, sans passer par les
+    fichiers temporaires de Werkzeug : chaque fichier est écrit une seule fois
+    dans `dest_dir`, sa taille, son SHA-256 et son CRC32 sont calculés pendant
+    l'écriture.
+
+    `before_files` est appelé avec les champs déjà reçus juste avant le premier
+    fichier, ce qui permet de refuser la requête avant d'écrire quoi que ce soit.
+
+    Retourne un tuple (champs du formulaire, fichiers reçus) où chaque fichier
+    est un dict avec filename, size, sha256, crc32 et temp_path.
+    Lève MalformedMultipart si le corps est tronqué ou invalide : les fichiers
+    déjà écrits sont alors supprimés.
+    """
+    # La limite mémoire ne s'applique qu'aux champs texte, pas au tampon
+    # du décodeur qui contient aussi les données des fichiers
+    max_field_size = app.config.get('MAX_FORM_MEMORY_SIZE')
+    decoder = MultipartDecoder(boundary)
+    form = MultiDict()
+    files = []
+
+    current_field = None
+    field_data = bytearray()
+    current_file = None
+    output = None
+
+    try:
+        while True:
+            try:
+                event = decoder.next_event()
+            except ValueError as e:
+                if decoder.complete:
+                    raise MalformedMultipart("Corps de requête multipart incomplet") from e
+                raise MalformedMultipart(f"Corps de requête multipart invalide : {e}") from e
+
+            if event is NEED_DATA:
+                if decoder.complete:
+                    raise MalformedMultipart("Corps de requête multipart incomplet")
+                try:
+                    data = stream.read(READ_BUFFER_SIZE)
+                except ClientDisconnected as e:
+                    raise MalformedMultipart("Client déconnecté pendant l'envoi") from e
+                decoder.receive_data(data or None)
+                continue
+
+            if isinstance(event, Field):
+                current_field = event.name
+                field_data = bytearray()
+            elif isinstance(event, File):
+                if before_files is not None and not files:
+                    before_files(form)
+                    before_files = None
+                current_field = None
+                current_file = {
+                    'field': event.name,
+                    'filename': event.filename,
+                    'temp_path': os.path.join(dest_dir, f".part-{len(files)}")
+                }
+                output = HashingWriter(open(current_file['temp_path'], 'wb'))
+            elif isinstance(event, Data):
+                if current_file is not None:
+                    output.write(event.data)
+                    if not event.more_data:
+                        output.fileobj.close()
+                        current_file['size'] = output.size
+                        current_file['sha256'] = output.hexdigest()
+                        current_file['crc32'] = output.crc32
+                        output = None
+                        files.append(current_file)
+                        current_file = None
+                elif current_field is not None:
+                    field_data.extend(event.data)
+                    if max_field_size is not None and len(field_data) > max_field_size:
+                        raise RequestEntityTooLarge()
+                    if not event.more_data:
+                        form.add(current_field, field_data.decode('utf-8', 'replace'))
+                        current_field = None
+            elif isinstance(event, Epilogue):
+                break
+    except Exception:
+        # Ne rien laisser d'un envoi interrompu : fichier en cours et fichiers complets
+        partial = [f['temp_path'] for f in files] + ([current_file['temp_path']] if current_file else [])
+        if output is not None:
+            output.fileobj.close()
+            output = None
+        for path in partial:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
+    finally:
+        if output is not None:
+            output.fileobj.close()
+
+    if before_files is not None:
+        before_files(form)
+
+    return form, files
@@ -0,0 +1,212 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from flask.logging import default_handler
+
+# Attributs propres à tout LogRecord : les autres viennent de `extra=` et sont
+# ajoutés tels quels à la sortie structurée
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+def get_extra(record):
+    return {key: value for key, value in record.__dict__.items() if key not in STANDARD_ATTRIBUTES}
+
+class JSONFormatter(logging.Formatter):
+    """
+    Une ligne JSON par enregistrement (lisible par Loki, Elasticsearch, jq...)
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName
+        }
+        entry.update(get_extra(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """
+    Format texte historique, suivi des champs structurés éventuels
+    """
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+
+    def format(self, record):
+        line = super().format(record)
+        extra = get_extra(record)
+        if extra:
+            line += ' ' + json.dumps(extra, ensure_ascii=False, default=str)
+        return line
+
+class LogStats:
+    """
+    Coût de la journalisation pour ce processus : temps passé dans le thread
+    appelant (mise en file) et dans le thread d'écriture, enregistrements perdus
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = 0
+        self.dropped = 0
+        self.written = 0
+        self.enqueue_seconds = 0.0
+        self.write_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def record_enqueue(self, seconds, depth):
+        with self.lock:
+            self.records += 1
+            self.enqueue_seconds += seconds
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def record_write(self, seconds):
+        with self.lock:
+            self.written += 1
+            self.write_seconds += seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'records': self.records,
+                'dropped': self.dropped,
+                'written': self.written,
+                'max_queue_depth': self.max_queue_depth,
+                'enqueue_seconds': round(self.enqueue_seconds, 6),
+                'enqueue_us_avg': round(self.enqueue_seconds / self.records * 1e6, 2) if self.records else 0.0,
+                'write_seconds': round(self.write_seconds, 6),
+                'write_us_avg': round(self.write_seconds / self.written * 1e6, 2) if self.written else 0.0
+            }
+
+log_stats = LogStats()
+
+class AsyncLogHandler(QueueHandler):
+    """
+    Met les enregistrements dans une file bornée, vidée par un thread
+    d'écriture : la requête ne formate ni n'écrit rien. File pleine :
+    les messages DEBUG/INFO sont perdus (et comptés), les avertissements
+    et erreurs attendent brièvement une place.
+    """
+
+    def __init__(self, maxsize, block_seconds=0.1):
+        super().__init__(queue.Queue(maxsize))
+        self.block_seconds = block_seconds
+
+    def prepare(self, record):
+        # Le message est formaté plus tard, dans le thread d'écriture : seule
+        # la trace d'une exception doit être rendue tant qu'elle existe
+        if record.exc_info:
+            record = copy.copy(record)
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                log_stats.record_drop()
+                return
+            try:
+                self.queue.put(record, timeout=self.block_seconds)
+            except queue.Full:
+                log_stats.record_drop()
+
+    def emit(self, record):
+        start = time.perf_counter()
+        super().emit(record)
+        log_stats.record_enqueue(time.perf_counter() - start, self.queue.qsize())
+
+class LogListener(QueueListener):
+    """
+    Thread d'écriture : formate les enregistrements et les transmet aux
+    handlers (fichier, console) en mesurant le temps passé
+    """
+
+    def handle(self, record):
+        start = time.perf_counter()
+        super().handle(record)
+        log_stats.record_write(time.perf_counter() - start)
+
+class FileLogSampler:
+    """
+    Lignes de log par fichier d'une requête : seules les `sample` premières
+    sont journalisées (DEBUG), les suivantes sont comptées pour le résumé
+    """
+
+    def __init__(self, logger, sample):
+        self.logger = logger
+        self.sample = sample
+        self.count = 0
+
+    def debug(self, msg, *args):
+        self.count += 1
+        if self.count <= self.sample:
+            self.logger.debug(msg, *args)
+
+    @property
+    def skipped(self):
+        return max(0, self.count - self.sample)
+
+def setup_logging(app, logs_dir):
+    """
+    Journalisation de l'application : handler asynchrone sur app.logger,
+    écriture dans logs/itransfer.log (rotation) et sur la console par un
+    thread dédié. Retourne le handler, sur lequel ajouter les filtres
+    d'enrichissement (exécutés dans le thread appelant).
+    """
+    formatter = JSONFormatter() if app.config['LOG_FORMAT'] == 'json' else TextFormatter()
+    level = logging.getLevelName(app.config['LOG_LEVEL'].upper())
+
+    # Logger pour le fichier
+    file_handler = RotatingFileHandler(
+        os.path.join(logs_dir, 'itransfer.log'),
+        maxBytes=10485760,  # 10MB
+        backupCount=10
+    )
+    file_handler.setFormatter(formatter)
+
+    # Logger pour la console
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    handler = AsyncLogHandler(app.config['LOG_QUEUE_SIZE'])
+    listener = LogListener(handler.queue, file_handler, console_handler)
+    listener.start()
+    # Vider la file à l'arrêt du processus
+    atexit.register(listener.stop)
+
+    # Le handler par défaut de Flask doublerait chaque ligne sur la console
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(handler)
+    app.logger.setLevel(level)
+    return handler
+
+def get_log_stats():
+    """
+    Retourne le coût cumulé de la journalisation du processus
+    """
+    return log_stats.as_dict()
@@ -0,0 +1,202 @@
+import os
+import time
+import types
+from contextlib import contextmanager
+from flask import Response, request
+from sqlalchemy import event
+from . import app, db
+from .tracing import span
+
+try:
+    from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus_client absent : métriques désactivées
+    multiprocess = None
+    Counter = Histogram = Gauge = None
+
+# Intervalles des histogrammes (secondes) : des requêtes rapides aux uploads de plusieurs minutes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Vues de téléchargement mesurées et type de contenu correspondant
+DOWNLOAD_ENDPOINTS = {'download_file': 'transfer', 'download_member': 'member'}
+
+class NullMetric:
+    """
+    Métrique sans effet, utilisée quand prometheus_client n'est pas installé
+    """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    def set(self, value):
+        pass
+
+def counter(name, documentation, labels=()):
+    return Counter(name, documentation, labels) if Counter else NullMetric()
+
+def histogram(name, documentation, labels=(), buckets=DURATION_BUCKETS):
+    return Histogram(name, documentation, labels, buckets=buckets) if Histogram else NullMetric()
+
+def gauge(name, documentation):
+    # En mode multiprocessus, la valeur exportée est la somme sur les workers vivants
+    return Gauge(name, documentation, multiprocess_mode='livesum') if Gauge else NullMetric()
+
+upload_bytes = counter('itransfer_upload_bytes_total', 'Octets reçus dans les transferts finalisés')
+upload_duration = histogram('itransfer_upload_duration_seconds', "Durée de traitement d'un upload", ['status'])
+upload_phase_duration = histogram(
+    'itransfer_upload_phase_seconds',
+    "Durée de chaque phase d'un upload (save, zip ou tar, hash, store, db, email)",
+    ['phase']
+)
+upload_rejections = counter(
+    'itransfer_upload_admission_rejected_total',
+    "Uploads refusés avant la lecture du corps (busy : trop d'uploads en cours, space : espace disque)",
+    ['reason']
+)
+download_bytes = counter('itransfer_download_bytes_total', 'Octets envoyés par le worker', ['kind'])
+downloads = counter(
+    'itransfer_downloads_total',
+    'Téléchargements par mode de livraison (direct, offload, redirect, not_modified)',
+    ['kind', 'delivery']
+)
+download_first_byte = histogram(
+    'itransfer_download_first_byte_seconds',
+    'Délai entre la réception de la requête et le premier octet envoyé',
+    ['kind'],
+    LATENCY_BUCKETS
+)
+download_throttle_seconds = counter(
+    'itransfer_download_throttle_seconds_total',
+    'Attente imposée aux téléchargements par les limites de débit'
+)
+shaped_downloads = gauge('itransfer_download_shaped_active', 'Téléchargements limités en cours')
+cleanup_duration = histogram('itransfer_cleanup_duration_seconds', "Durée d'un passage de nettoyage")
+cleanup_transfers = counter('itransfer_cleanup_transfers_deleted_total', 'Transferts expirés supprimés')
+cleanup_blobs = counter('itransfer_cleanup_blobs_deleted_total', 'Blobs supprimés par le nettoyage')
+cleanup_bytes = counter('itransfer_cleanup_bytes_freed_total', 'Octets libérés par le nettoyage')
+smtp_handshake = histogram(
+    'itransfer_smtp_handshake_seconds',
+    "Ouverture d'une session SMTP (connexion, TLS, authentification)",
+    buckets=LATENCY_BUCKETS
+)
+db_pool_checkouts = counter('itransfer_db_pool_checkouts_total', 'Connexions empruntées au pool SQLAlchemy')
+db_pool_checked_out = gauge('itransfer_db_pool_checked_out', 'Connexions du pool actuellement empruntées')
+db_pool_overflow = gauge('itransfer_db_pool_overflow', 'Connexions ouvertes au-delà de pool_size')
+db_pool_size = gauge('itransfer_db_pool_size', 'Taille du pool (pool_size), somme sur les workers')
+db_pool_max_overflow = gauge('itransfer_db_pool_max_overflow', 'Connexions supplémentaires autorisées (max_overflow)')
+
+@contextmanager
+def upload_phase(phase):
+    """
+    Mesure la durée d'une phase d'un upload (histogramme et trace de la requête)
+    """
+    try:
+        with span(phase) as current:
+            yield
+    finally:
+        upload_phase_duration.labels(phase).observe(current.duration)
+
+def record_cleanup_pass(transfers, blobs, freed, seconds):
+    cleanup_duration.observe(seconds)
+    cleanup_transfers.inc(transfers)
+    cleanup_blobs.inc(blobs)
+    cleanup_bytes.inc(freed)
+
+def instrument_db_pool():
+    """
+    Suit les emprunts de connexions du pool SQLAlchemy (événements
+    checkout/checkin, sans interroger le pool à chaque collecte)
+    """
+    with app.app_context():
+        engine = db.engine
+    pool = engine.pool
+    if not hasattr(pool, 'overflow'):
+        # Pool sans débordement (SQLite en mémoire, NullPool) : rien à suivre
+        return
+    db_pool_size.set(pool.size())
+    db_pool_max_overflow.set(app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow', 10))
+
+    def update_gauges():
+        db_pool_checked_out.set(pool.checkedout())
+        db_pool_overflow.set(max(0, pool.overflow()))
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checkouts.inc()
+        update_gauges()
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        update_gauges()
+
+@app.before_request
+def start_request_timer():
+    request.environ['itransfer.started'] = time.perf_counter()
+
+def count_sent_bytes(body, kind, started):
+    """
+    Relaie le corps d'une réponse produite en flux en mesurant le premier
+    octet et les octets réellement envoyés (téléchargement interrompu compris)
+    """
+    sent = 0
+    try:
+        for block in body:
+            if not sent:
+                download_first_byte.labels(kind).observe(time.perf_counter() - started)
+            sent += len(block)
+            yield block
+    finally:
+        download_bytes.labels(kind).inc(sent)
+        if hasattr(body, 'close'):
+            body.close()
+
+@app.after_request
+def record_download_metrics(response):
+    kind = DOWNLOAD_ENDPOINTS.get(request.endpoint)
+    if kind is None:
+        return response
+    started = request.environ.get('itransfer.started', time.perf_counter())
+    if response.status_code == 304:
+        delivery = 'not_modified'
+    elif 300 <= response.status_code < 400:
+        delivery = 'redirect'
+    elif 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers:
+        delivery = 'offload'
+    elif response.status_code in (200, 206):
+        delivery = 'direct'
+        if isinstance(response.response, types.GeneratorType):
+            response.response = count_sent_bytes(response.response, kind, started)
+        else:
+            # Fichier local (send_file) : envoyé tel quel, sendfile compris
+            download_first_byte.labels(kind).observe(time.perf_counter() - started)
+            download_bytes.labels(kind).inc(response.content_length or 0)
+    else:
+        return response
+    downloads.labels(kind, delivery).inc()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Métriques au format Prometheus. Avec plusieurs workers (gunicorn),
+    PROMETHEUS_MULTIPROC_DIR doit pointer vers un dossier partagé : chaque
+    collecte agrège alors les valeurs de tous les workers.
+    """
+    if multiprocess is None:
+        return Response("prometheus_client n'est pas installé\n", status=501, mimetype='text/plain')
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
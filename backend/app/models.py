@@ -5,12 +5,12 @@ class FileUpload(db.Model):
     __tablename__ = 'file_upload'
     id = db.Column(db.String(36), primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
-    email = db.Column(db.String(256), nullable=False)
-    sender_email = db.Column(db.String(256), nullable=False)
+    email = db.Column(db.String(256), nullable=False, index=True)
+    sender_email = db.Column(db.String(256), nullable=False, index=True)
     encrypted_data = db.Column(db.String(256), nullable=False)
-    downloaded = db.Column(db.Boolean, default=False)
+    downloaded = db.Column(db.Boolean, default=False, index=True)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Prochaine expiration : lecture d'index
     files_list = db.Column(db.Text, nullable=True)  # Stocke la liste des fichiers en JSON
 
     def set_files_list(self, files):
@@ -20,3 +20,126 @@ class FileUpload(db.Model):
     def get_files_list(self):
         """Récupère et désérialise la liste des fichiers"""
         return json.loads(self.files_list) if self.files_list else []
+
+class TransferMember(db.Model):
+    """Fichier d'un transfert : chemin, taille, hash et position dans le ZIP stocké"""
+    __tablename__ = 'transfer_member'
+    file_id = db.Column(db.String(36), db.ForeignKey('file_upload.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Ordre dans l'archive
+    path = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)
+    crc32 = db.Column(db.BigInteger, nullable=True)
+    # Position dans le ZIP stocké (absente si le fichier est stocké seul)
+    compress_type = db.Column(db.SmallInteger, nullable=True)
+    compressed_size = db.Column(db.BigInteger, nullable=True)
+    data_offset = db.Column(db.BigInteger, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_transfer_member_path', 'file_id', 'path'),
+    )
+
+    # Champs du manifeste repris tels quels (les absents ne sont pas renseignés)
+    OPTIONAL_FIELDS = ('sha256', 'crc32', 'compress_type', 'compressed_size', 'data_offset')
+
+    @classmethod
+    def from_manifest(cls, file_id, position, member):
+        """Crée la ligne d'un fichier à partir d'une entrée de manifeste"""
+        return cls(
+            file_id=file_id,
+            position=position,
+            path=member['name'],
+            size=member['size'],
+            **{field: member.get(field) for field in cls.OPTIONAL_FIELDS}
+        )
+
+    def to_manifest(self):
+        """Entrée de manifeste (name, size, et hash/position s'ils sont connus)"""
+        member = {'name': self.path, 'size': self.size}
+        for field in self.OPTIONAL_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                member[field] = value
+        return member
+
+class UploadSession(db.Model):
+    """Session d'upload par morceaux, reprise possible après interruption"""
+    __tablename__ = 'upload_session'
+    id = db.Column(db.String(36), primary_key=True)
+    email = db.Column(db.String(256), nullable=False)
+    sender_email = db.Column(db.String(256), nullable=False)
+    expiration_days = db.Column(db.Integer, nullable=False, default=7)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    files_list = db.Column(db.Text, nullable=True)  # Liste déclarée par le client (JSON)
+    members = db.Column(db.Text, nullable=False)  # Fichiers attendus : name, size, folder (JSON)
+    archive_format = db.Column(db.String(16), nullable=True)  # Format demandé par l'expéditeur (zip, tar.zst)
+    status = db.Column(db.String(16), nullable=False, default='open')  # open, completing, aborted
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def get_files_list(self):
+        """Récupère et désérialise la liste des fichiers déclarée"""
+        return json.loads(self.files_list) if self.files_list else []
+
+    def get_members(self):
+        """Récupère et désérialise la liste des fichiers attendus"""
+        return json.loads(self.members) if self.members else []
+
+class UploadChunk(db.Model):
+    """Morceau reçu et écrit sur disque pour une session d'upload"""
+    __tablename__ = 'upload_chunk'
+    session_id = db.Column(db.String(36), db.ForeignKey('upload_session.id', ondelete='CASCADE'), primary_key=True)
+    member_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    chunk_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+class TransferArchive(db.Model):
+    """Archive d'un transfert multi-fichiers (ZIP ou tar.zst), construite à l'upload ou générée au téléchargement"""
+    __tablename__ = 'transfer_archive'
+    file_id = db.Column(db.String(36), db.ForeignKey('file_upload.id', ondelete='CASCADE'), primary_key=True)
+    mode = db.Column(db.String(16), nullable=False, default='streamed')
+    archive_format = db.Column(db.String(16), nullable=False, default='zip')
+    content_length = db.Column(db.BigInteger, nullable=False)
+    manifest = db.Column(db.Text, nullable=False)  # Fichiers de l'archive : name, size, crc32, sha256 (JSON)
+    date_time = db.Column(db.DateTime, nullable=False)  # Date inscrite dans l'archive pour tous les fichiers
+    content_key = db.Column(db.String(64), nullable=True, index=True)  # Empreinte des fichiers d'une archive construite à l'upload
+
+    def get_manifest(self):
+        """Récupère et désérialise la liste des fichiers de l'archive"""
+        return json.loads(self.manifest) if self.manifest else []
+
+class EmailOutbox(db.Model):
+    """Email en attente d'envoi par le thread d'arrière-plan"""
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(256), nullable=False)
+    subject = db.Column(db.String(512), nullable=True)
+    message = db.Column(db.Text, nullable=False)  # Message MIME complet sérialisé
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+class Blob(db.Model):
+    """Contenu stocké une seule fois, adressé par son SHA-256"""
+    __tablename__ = 'blob'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)  # Nombre de transferts qui l'utilisent
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+class TransferBlob(db.Model):
+    """Référence d'un transfert vers un blob du magasin"""
+    __tablename__ = 'transfer_blob'
+    file_id = db.Column(db.String(36), db.ForeignKey('file_upload.id'), primary_key=True)
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), primary_key=True)
+
+class MaintenanceLease(db.Model):
+    """Bail d'une tâche de maintenance : seul le worker qui le détient l'exécute"""
+    __tablename__ = 'maintenance_lease'
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=True)  # hôte:pid:jeton du worker leader
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,195 @@
+import email
+import threading
+from email.utils import formataddr
+from datetime import datetime, timedelta
+from . import app, db
+from .models import EmailOutbox
+from .smtp_pool import smtp_pool
+from .smtp_settings import get_smtp_config
+
+# Réveille le thread d'envoi dès qu'un email est mis en file
+outbox_event = threading.Event()
+sender_thread = None
+sender_lock = threading.Lock()
+
+def enqueue_email(msg):
+    """
+    Met un email en file d'attente pour envoi par le thread d'arrière-plan.
+    Retourne True si le message a bien été enregistré.
+    """
+    try:
+        db.session.add(EmailOutbox(
+            recipient=msg['To'],
+            subject=msg['Subject'],
+            message=msg.as_string(),
+            status='pending',
+            attempts=0,
+            next_attempt_at=datetime.now()
+        ))
+        db.session.commit()
+        outbox_event.set()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de la mise en file de l'email : {str(e)}")
+        return False
+
+def get_retry_delay(attempts):
+    """
+    Délai avant le prochain essai : croissance exponentielle bornée
+    """
+    delay = app.config['OUTBOX_RETRY_BASE_SECONDS'] * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, app.config['OUTBOX_RETRY_MAX_SECONDS']))
+
+def claim_due_emails(limit):
+    """
+    Réserve les emails à envoyer. Un email en cours d'envoi depuis trop
+    longtemps (worker arrêté en plein envoi) est de nouveau éligible.
+    La réservation est une mise à jour conditionnelle : un seul worker l'obtient.
+    Elle compte comme un essai : un email dont l'envoi bloque ou arrête le
+    worker à chaque fois est abandonné après OUTBOX_MAX_ATTEMPTS réservations.
+    """
+    now = datetime.now()
+    # Pour un email 'sending', next_attempt_at est la fin du bail de réservation
+    candidates = (
+        db.session.query(EmailOutbox.id)
+        .filter(EmailOutbox.status.in_(['pending', 'sending']), EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(limit)
+        .all()
+    )
+
+    claimed = []
+    lease = now + timedelta(seconds=app.config['OUTBOX_LEASE_SECONDS'])
+    for (email_id,) in candidates:
+        updated = (
+            EmailOutbox.query
+            .filter(EmailOutbox.id == email_id, EmailOutbox.status.in_(['pending', 'sending']), EmailOutbox.next_attempt_at <= now)
+            .update({'status': 'sending', 'next_attempt_at': lease, 'attempts': EmailOutbox.attempts + 1}, synchronize_session=False)
+        )
+        db.session.commit()
+        if not updated:
+            continue
+        outbox_email = db.session.get(EmailOutbox, email_id)
+        db.session.refresh(outbox_email)
+        if outbox_email.attempts > app.config['OUTBOX_MAX_ATTEMPTS']:
+            # Le dernier essai autorisé n'a jamais abouti (bail expiré)
+            outbox_email.status = 'dead'
+            outbox_email.attempts -= 1
+            outbox_email.last_error = "Envoi interrompu avant la fin (bail expiré)"
+            db.session.commit()
+            app.logger.error(f"Email {email_id} abandonné après {outbox_email.attempts} essais : envoi interrompu")
+            continue
+        claimed.append(outbox_email)
+    return claimed
+
+def process_outbox(limit=None):
+    """
+    Envoie les emails en attente dont l'heure d'envoi est venue.
+    Retourne un tuple (emails traités, emails envoyés avec succès).
+    """
+    # Import différé : routes importe ce module
+    from .routes import send_email_with_smtp
+
+    limit = limit or app.config['OUTBOX_BATCH_SIZE']
+    claimed = claim_due_emails(limit)
+    if not claimed:
+        return 0, 0
+
+    smtp_config = get_smtp_config()
+    sent = 0
+    for outbox_email in claimed:
+        error = None
+        if smtp_config is None:
+            error = "Configuration SMTP absente"
+        else:
+            try:
+                msg = email.message_from_string(outbox_email.message)
+                # L'expéditeur suit la configuration en vigueur au moment de l'envoi
+                del msg['From']
+                msg['From'] = formataddr(("iTransfer", smtp_config.get('smtp_sender_email', '')))
+                if not send_email_with_smtp(msg, smtp_config):
+                    error = "Échec de l'envoi SMTP"
+            except Exception as e:
+                error = str(e)
+
+        # L'essai a été compté à la réservation
+        if error is None:
+            outbox_email.status = 'sent'
+            outbox_email.sent_at = datetime.now()
+            outbox_email.last_error = None
+            sent += 1
+        elif outbox_email.attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+            # Trop d'échecs : l'email est mis de côté (dead letter)
+            outbox_email.status = 'dead'
+            outbox_email.last_error = error
+            app.logger.error(f"Email {outbox_email.id} abandonné après {outbox_email.attempts} essais : {error}")
+        else:
+            outbox_email.status = 'pending'
+            outbox_email.last_error = error
+            outbox_email.next_attempt_at = datetime.now() + get_retry_delay(outbox_email.attempts)
+            app.logger.warning(f"Email {outbox_email.id} non envoyé (essai {outbox_email.attempts}) : {error}")
+        db.session.commit()
+
+    return len(claimed), sent
+
+def purge_sent_emails():
+    """
+    Supprime les emails envoyés depuis plus de OUTBOX_RETENTION_DAYS jours
+    """
+    limit = datetime.now() - timedelta(days=app.config['OUTBOX_RETENTION_DAYS'])
+    deleted = EmailOutbox.query.filter(EmailOutbox.status == 'sent', EmailOutbox.sent_at < limit).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def run_outbox_sender():
+    """
+    Boucle du thread d'envoi : traite la file puis attend un nouvel email
+    ou l'intervalle de scrutation (pour les nouveaux essais et les autres workers)
+    """
+    while True:
+        outbox_event.wait(app.config['OUTBOX_POLL_SECONDS'])
+        outbox_event.clear()
+        try:
+            with app.app_context():
+                # Vider la file tant qu'il reste des emails prêts
+                while process_outbox()[0] >= app.config['OUTBOX_BATCH_SIZE']:
+                    pass
+            # Fermer les sessions SMTP restées inactives
+            smtp_pool.prune()
+        except Exception as e:
+            app.logger.error(f"Erreur dans le thread d'envoi des emails : {str(e)}")
+
+def start_outbox_sender():
+    """
+    Démarre le thread d'envoi des emails (un par processus)
+    """
+    global sender_thread
+    if not app.config['OUTBOX_SENDER_ENABLED']:
+        return
+    with sender_lock:
+        if sender_thread is None or not sender_thread.is_alive():
+            sender_thread = threading.Thread(target=run_outbox_sender, name='outbox-sender', daemon=True)
+            sender_thread.start()
+
+@app.cli.command('outbox-send')
+def outbox_send_command():
+    """Envoie immédiatement les emails en attente."""
+    total_processed = total_sent = 0
+    while True:
+        processed, sent = process_outbox()
+        total_processed += processed
+        total_sent += sent
+        if processed < app.config['OUTBOX_BATCH_SIZE']:
+            break
+    print(f"{total_sent} email(s) envoyé(s) sur {total_processed}")
+
+@app.cli.command('outbox-retry')
+def outbox_retry_command():
+    """Remet en file les emails abandonnés après trop d'échecs."""
+    count = EmailOutbox.query.filter_by(status='dead').update(
+        {'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.now()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    print(f"{count} email(s) remis en file")
@@ -0,0 +1,425 @@
+import os
+import uuid
+import json
+import shutil
+from datetime import datetime, timedelta
+from flask import request, jsonify
+from sqlalchemy import func, exc
+from . import app, db
+from .models import FileUpload, UploadSession, UploadChunk
+from .admission import admission, AdmissionRejected, estimate_upload_space, rejection_response
+from .routes import clean_upload_path, finalize_upload, parse_expiration_days
+from .archives import ARCHIVE_FORMATS
+
+# Taille des blocs lus depuis le corps de la requête lors de l'écriture d'un morceau
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def get_session_dir(upload_id):
+    """
+    Retourne le dossier temporaire d'une session d'upload
+    """
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'temp', upload_id)
+
+def get_staging_dir(upload_id):
+    """
+    Retourne le dossier de travail de la finalisation d'une session
+    """
+    return get_session_dir(upload_id) + '.finalize'
+
+def remove_session_files(upload_id):
+    """
+    Supprime les fichiers temporaires d'une session et de sa finalisation
+    """
+    for path in (get_session_dir(upload_id), get_staging_dir(upload_id)):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+def stage_session_files(upload_id, members):
+    """
+    Prépare les fichiers à finaliser par liens physiques (sans copie des
+    données) : la finalisation peut les déplacer vers le magasin de blobs ou
+    les supprimer, les fichiers de la session restent intacts jusqu'à
+    l'enregistrement du transfert et une finalisation interrompue peut être
+    relancée. Retourne le dossier de travail.
+    """
+    session_dir = get_session_dir(upload_id)
+    staging_dir = get_staging_dir(upload_id)
+    # Reste d'une tentative précédente
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    for member in members:
+        source = os.path.join(session_dir, member['name'])
+        target = os.path.join(staging_dir, member['name'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError:
+            # Système de fichiers sans liens physiques
+            shutil.copyfile(source, target)
+    return staging_dir
+
+def find_path_conflict(paths):
+    """
+    Retourne un chemin qui est aussi le dossier parent d'un autre chemin de
+    la liste (« a » et « a/b »), ou None
+    """
+    folders = set()
+    for path in paths:
+        parts = path.split('/')[:-1]
+        folders.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return next((path for path in paths if path in folders), None)
+
+def count_chunks(size, chunk_size):
+    """
+    Nombre de morceaux attendus pour un fichier (au moins un, même vide)
+    """
+    return max(1, -(-size // chunk_size))
+
+def expected_chunk_size(member, chunk_index, chunk_size):
+    """
+    Taille attendue d'un morceau : le dernier peut être plus petit
+    """
+    return min(chunk_size, member['size'] - chunk_index * chunk_size)
+
+def get_received_chunks(upload_id):
+    """
+    Retourne, pour chaque fichier de la session, l'ensemble des morceaux déjà reçus
+    """
+    received = {}
+    rows = db.session.query(UploadChunk.member_index, UploadChunk.chunk_index).filter_by(session_id=upload_id)
+    for member_index, chunk_index in rows:
+        received.setdefault(member_index, set()).add(chunk_index)
+    return received
+
+def describe_session(upload_session):
+    """
+    Décrit l'état d'une session : morceaux attendus et morceaux manquants par fichier
+    """
+    received = get_received_chunks(upload_session.id)
+    members = []
+    for index, member in enumerate(upload_session.get_members()):
+        total_chunks = count_chunks(member['size'], upload_session.chunk_size)
+        done = received.get(index, set())
+        members.append({
+            'name': member['name'],
+            'size': member['size'],
+            'total_chunks': total_chunks,
+            'missing': [i for i in range(total_chunks) if i not in done]
+        })
+    return {
+        'upload_id': upload_session.id,
+        'chunk_size': upload_session.chunk_size,
+        'status': upload_session.status,
+        'members': members
+    }
+
+def write_chunk(path, offset, stream, expected_size):
+    """
+    Écrit un morceau directement à sa position dans le fichier final.
+    Les morceaux peuvent arriver dans le désordre ou en parallèle : chaque
+    écriture est positionnée (pwrite) et ne touche que sa propre plage.
+    Retourne le nombre d'octets écrits.
+    """
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        written = 0
+        while True:
+            block = stream.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            if written + len(block) > expected_size:
+                raise ValueError("Morceau plus grand que la taille attendue")
+            view = memoryview(block)
+            while view:
+                count = os.pwrite(fd, view, offset + written)
+                written += count
+                view = view[count:]
+        # S'assurer que les données sont sur disque avant d'enregistrer le morceau
+        os.fsync(fd)
+        return written
+    finally:
+        os.close(fd)
+
+def purge_stale_upload_sessions():
+    """
+    Supprime les sessions d'upload abandonnées et leurs fichiers temporaires
+    """
+    limit = datetime.now() - timedelta(hours=app.config['UPLOAD_SESSION_TTL_HOURS'])
+    stale_sessions = UploadSession.query.filter(
+        UploadSession.status.in_(['open', 'completing']),
+        UploadSession.updated_at < limit
+    ).all()
+
+    for upload_session in stale_sessions:
+        try:
+            remove_session_files(upload_session.id)
+            UploadChunk.query.filter_by(session_id=upload_session.id).delete()
+            db.session.delete(upload_session)
+            db.session.commit()
+            admission.release_session(upload_session.id)
+            app.logger.info(f"Session d'upload abandonnée supprimée: {upload_session.id}")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Erreur lors de la suppression de la session {upload_session.id}: {str(e)}")
+
+@app.route('/upload/init', methods=['POST'])
+def init_upload():
+    """
+    Ouvre une session d'upload par morceaux.
+    Le client envoie les emails, la durée d'expiration, la liste des fichiers
+    (files_list), les fichiers réellement envoyés avec leur chemin et leur taille
+    et, s'il le choisit, le format de l'archive (archive_format).
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Requête invalide'}), 400
+        email = data.get('email')
+        sender_email = data.get('sender_email')
+        expiration_days = parse_expiration_days(data.get('expiration_days', 7))
+
+        if not email or not sender_email:
+            return jsonify({'error': 'Email addresses are required'}), 400
+
+        files_list = data.get('files_list') or []
+        files = data.get('files') or []
+        if not files_list or not files or not isinstance(files_list, list) or not isinstance(files, list):
+            return jsonify({'error': 'Liste des fichiers invalide'}), 400
+        # files_list sert aux emails de la finalisation : nom et taille de chaque fichier
+        for file_info in files_list:
+            if not isinstance(file_info, dict) or 'name' not in file_info:
+                return jsonify({'error': 'Liste des fichiers invalide'}), 400
+            int(file_info.get('size', 0))
+
+        archive_format = data.get('archive_format') or None
+        if archive_format is not None and archive_format not in ARCHIVE_FORMATS:
+            return jsonify({'error': 'Format d\'archive invalide'}), 400
+
+        # Taille des morceaux : valeur du client bornée par la configuration
+        chunk_size = int(data.get('chunk_size') or app.config['CHUNK_SIZE'])
+        if chunk_size <= 0 or chunk_size > app.config['MAX_CHUNK_SIZE']:
+            return jsonify({'error': 'Taille de morceau invalide'}), 400
+
+        members = []
+        seen_paths = set()
+        for file_info in files:
+            if not isinstance(file_info, dict):
+                return jsonify({'error': 'Liste des fichiers invalide'}), 400
+            clean_path, parent_folder = clean_upload_path(str(file_info.get('path', '')))
+            size = int(file_info.get('size', -1))
+            if size < 0 or clean_path in seen_paths:
+                return jsonify({'error': 'Liste des fichiers invalide'}), 400
+            seen_paths.add(clean_path)
+            members.append({'name': clean_path, 'size': size, 'folder': parent_folder})
+        # Un fichier ne peut pas être aussi le dossier d'un autre fichier
+        if find_path_conflict(seen_paths):
+            return jsonify({'error': 'Liste des fichiers invalide'}), 400
+
+        total_size = sum(member['size'] for member in members)
+        if total_size > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({'error': 'Transfert trop volumineux'}), 413
+
+        # Admission : l'espace du transfert complet est réservé pour toute la session
+        upload_id = str(uuid.uuid4())
+        admission.admit(estimate_upload_space(total_size, [member['name'] for member in members]), session_id=upload_id)
+
+        # Préparer les fichiers de destination à leur taille finale
+        session_dir = get_session_dir(upload_id)
+        os.makedirs(session_dir, exist_ok=True)
+        for member in members:
+            if member['folder']:
+                os.makedirs(os.path.dirname(os.path.join(session_dir, member['name'])), exist_ok=True)
+            with open(os.path.join(session_dir, member['name']), 'wb') as f:
+                f.truncate(member['size'])
+
+        upload_session = UploadSession(
+            id=upload_id,
+            email=email,
+            sender_email=sender_email,
+            expiration_days=expiration_days,
+            chunk_size=chunk_size,
+            files_list=json.dumps(files_list),
+            members=json.dumps(members),
+            archive_format=archive_format,
+            status='open'
+        )
+        db.session.add(upload_session)
+        db.session.commit()
+        app.logger.info("Session d'upload créée : %s (%d fichier(s))", upload_id, len(members))
+
+        return jsonify(describe_session(upload_session)), 201
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+    except (TypeError, ValueError) as e:
+        app.logger.error(f"Session d'upload refusée : {str(e)}")
+        return jsonify({'error': 'Liste des fichiers invalide'}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de la création de la session d'upload : {str(e)}")
+        if 'session_dir' in locals():
+            admission.release_session(upload_id)
+            if os.path.exists(session_dir):
+                shutil.rmtree(session_dir)
+        return jsonify({'error': 'Une erreur interne est survenue'}), 500
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """
+    Retourne l'état d'une session pour permettre la reprise après interruption
+    """
+    upload_session = UploadSession.query.get(upload_id)
+    if not upload_session:
+        if FileUpload.query.get(upload_id):
+            return jsonify({'upload_id': upload_id, 'status': 'completed'}), 200
+        return jsonify({'error': 'Session d\'upload introuvable'}), 404
+    return jsonify(describe_session(upload_session)), 200
+
+@app.route('/upload/<upload_id>/chunk/<int:member_index>/<int:chunk_index>', methods=['PUT'])
+def upload_chunk(upload_id, member_index, chunk_index):
+    """
+    Reçoit un morceau brut (corps de la requête) pour un fichier de la session
+    """
+    try:
+        upload_session = UploadSession.query.get(upload_id)
+        if not upload_session:
+            return jsonify({'error': 'Session d\'upload introuvable'}), 404
+        if upload_session.status != 'open':
+            return jsonify({'error': 'Session d\'upload déjà finalisée'}), 409
+
+        members = upload_session.get_members()
+        if member_index >= len(members):
+            return jsonify({'error': 'Fichier inconnu'}), 400
+        member = members[member_index]
+        chunk_size = upload_session.chunk_size
+        if chunk_index >= count_chunks(member['size'], chunk_size):
+            return jsonify({'error': 'Index de morceau invalide'}), 400
+
+        # Un morceau déjà reçu (nouvel essai du client) est simplement acquitté
+        if UploadChunk.query.get((upload_id, member_index, chunk_index)):
+            return jsonify({'received': True}), 200
+
+        expected_size = expected_chunk_size(member, chunk_index, chunk_size)
+        member_path = os.path.join(get_session_dir(upload_id), member['name'])
+        written = write_chunk(member_path, chunk_index * chunk_size, request.stream, expected_size)
+        if written != expected_size:
+            app.logger.error(f"Morceau incomplet {upload_id}/{member_index}/{chunk_index}: {written}/{expected_size} octets")
+            return jsonify({'error': 'Morceau incomplet'}), 400
+
+        db.session.add(UploadChunk(
+            session_id=upload_id,
+            member_index=member_index,
+            chunk_index=chunk_index,
+            size=written
+        ))
+        upload_session.updated_at = datetime.now()
+        try:
+            db.session.commit()
+        except exc.IntegrityError:
+            # Le même morceau a été enregistré en parallèle par un autre worker
+            db.session.rollback()
+
+        return jsonify({'received': True}), 200
+
+    except ValueError as e:
+        app.logger.error(f"Morceau refusé {upload_id}/{member_index}/{chunk_index}: {str(e)}")
+        return jsonify({'error': 'Morceau invalide'}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de la réception du morceau : {str(e)}")
+        return jsonify({'error': 'Une erreur interne est survenue'}), 500
+
+@app.route('/upload/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Finalise une session dont tous les morceaux ont été reçus : les fichiers
+    sont déjà assemblés à leur place, il ne reste qu'à créer le transfert.
+    """
+    try:
+        if FileUpload.query.get(upload_id):
+            return jsonify({'success': True, 'file_id': upload_id, 'message': 'Fichiers uploadés avec succès'}), 200
+
+        upload_session = UploadSession.query.get(upload_id)
+        if not upload_session:
+            return jsonify({'error': 'Session d\'upload introuvable'}), 404
+
+        # Vérifier que tous les morceaux sont présents
+        counts = dict(
+            db.session.query(UploadChunk.member_index, func.count(UploadChunk.chunk_index))
+            .filter_by(session_id=upload_id)
+            .group_by(UploadChunk.member_index)
+        )
+        members = upload_session.get_members()
+        for index, member in enumerate(members):
+            if counts.get(index, 0) != count_chunks(member['size'], upload_session.chunk_size):
+                return jsonify({'error': 'Upload incomplet', **describe_session(upload_session)}), 409
+
+        # Réserver la finalisation pour éviter un double traitement entre workers
+        claimed = UploadSession.query.filter_by(id=upload_id, status='open').update({'status': 'completing'})
+        db.session.commit()
+        if not claimed:
+            return jsonify({'error': 'Finalisation déjà en cours'}), 409
+
+        try:
+            staging_dir = stage_session_files(upload_id, members)
+            file_list = [{
+                'name': member['name'],
+                'size': member['size'],
+                'folder': member['folder'],
+                'temp_path': os.path.join(staging_dir, member['name'])
+            } for member in members]
+            response_data = finalize_upload(
+                upload_id,
+                file_list,
+                upload_session.get_files_list(),
+                upload_session.email,
+                upload_session.sender_email,
+                upload_session.expiration_days,
+                upload_session.archive_format
+            )
+        except Exception:
+            # Les fichiers de la session sont intacts : le client peut relancer la finalisation
+            db.session.rollback()
+            if os.path.exists(get_staging_dir(upload_id)):
+                shutil.rmtree(get_staging_dir(upload_id))
+            UploadSession.query.filter_by(id=upload_id).update({'status': 'open'})
+            db.session.commit()
+            raise
+
+        # La session n'est plus nécessaire une fois le transfert créé
+        UploadChunk.query.filter_by(session_id=upload_id).delete()
+        UploadSession.query.filter_by(id=upload_id).delete()
+        db.session.commit()
+        remove_session_files(upload_id)
+        admission.release_session(upload_id)
+
+        app.logger.info("Upload par morceaux terminé avec succès : %s", upload_id)
+        return jsonify(response_data), 200
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de la finalisation de l'upload : {str(e)}")
+        return jsonify({'error': 'Une erreur interne est survenue'}), 500
+
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """
+    Abandonne une session d'upload et libère l'espace disque
+    """
+    try:
+        deleted = UploadSession.query.filter_by(id=upload_id, status='open').update({'status': 'aborted'})
+        db.session.commit()
+        if not deleted:
+            return jsonify({'error': 'Session d\'upload introuvable'}), 404
+
+        remove_session_files(upload_id)
+        UploadChunk.query.filter_by(session_id=upload_id).delete()
+        UploadSession.query.filter_by(id=upload_id).delete()
+        db.session.commit()
+        admission.release_session(upload_id)
+        return jsonify({'message': 'Session d\'upload annulée'}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erreur lors de l'annulation de l'upload : {str(e)}")
+        return jsonify({'error': 'Une erreur interne est survenue'}), 500
@@ -1,22 +1,44 @@
 import os
 import uuid
-import hashlib
-import smtplib
 import json
-from flask import request, jsonify, send_file
+from flask import request, jsonify, Response
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formatdate, make_msgid, formataddr
 from . import app, db
 from .models import FileUpload
-import zipfile
+from .ingest import ingest_multipart, MalformedMultipart
+from .hashing import HashingWriter, hash_files
+from .outbox import enqueue_email
+from .smtp_settings import get_smtp_config, save_smtp_config
+from .downloads import (
+    build_offload_response, build_presigned_response, get_offload_mode, is_not_modified, set_validators,
+    build_stream_response, build_unsized_stream_response, send_stored_file, guess_mimetype
+)
+from .storage import storage
+from .smtp_pool import smtp_pool, get_smtp_pool_stats
+from .compression import get_compression_stats
+from .blobstore import add_blob, reference_blob, get_blob_stats
+from .archives import (
+    get_archive_name, get_archive_format, stat_stored_file, store_streamed_archive, build_zip_archive, build_archive_index,
+    build_tar_archive, build_tar_index, iter_compressed_tar, iter_member, iter_tar_member, add_transfer_members,
+    get_archive_content_key, find_materialized_archive
+)
+from .transfer_cache import transfer_cache, get_transfer, get_transfer_cache_stats
+from .metrics import upload_phase, upload_bytes, upload_duration
+from .tracing import span, require_admin
+from .logs import FileLogSampler, get_log_stats
+from .admission import AdmissionRejected, reserve_upload, rejection_response, get_admission_stats
+from .bandwidth import get_bandwidth_stats
 import shutil
 from datetime import datetime, timedelta
 import pytz
 import schedule
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 def format_size(bytes):
     """
@@ -30,36 +52,14 @@ def format_size(bytes):
 
 def send_email_with_smtp(msg, smtp_config):
     """
-    Envoie un email en utilisant le mode de connexion approprié selon le port SMTP
+    Envoie un email sur une session SMTP du pool (ouverte selon le port ou smtp_security)
     """
-    server = None
     try:
-        # Choisir le type de connexion en fonction du port
-        port = int(smtp_config['smtp_port'])
-        if port == 465:
-            # Port 465 : SMTP_SSL
-            app.logger.info("Utilisation de SMTP_SSL (port 465)")
-            server = smtplib.SMTP_SSL(smtp_config['smtp_server'], port)
-        else:
-            # Port 587 ou autre : SMTP + STARTTLS
-            app.logger.info(f"Utilisation de SMTP + STARTTLS (port {port})")
-            server = smtplib.SMTP(smtp_config['smtp_server'], port)
-            server.starttls()
-        
-        server.login(smtp_config['smtp_user'], smtp_config['smtp_password'])
-        server.send_message(msg)
+        smtp_pool.send_message(msg, smtp_config)
         return True
-        
     except Exception as e:
         app.logger.error(f"Erreur lors de l'envoi de l'email : {str(e)}")
         return False
-        
-    finally:
-        if server:
-            try:
-                server.quit()
-            except Exception as e:
-                app.logger.error(f"Erreur lors de la fermeture de la connexion SMTP : {str(e)}")
 
 def get_backend_url():
     """
@@ -250,7 +250,7 @@ Envoyé via iTransfer
 
 def send_recipient_notification_with_files(recipient_email, file_id, file_name, files_summary, total_size, smtp_config, sender_email):
     """
-    Envoie un email de notification au destinataire avec le résumé des fichiers
+    Met en file l'email de notification au destinataire avec le résumé des fichiers
     """
     try:
         # Récupérer les informations du fichier pour avoir la date d'expiration
@@ -284,14 +284,14 @@ def send_recipient_notification_with_files(recipient_email, file_id, file_name,
         msg.attach(MIMEText(text, 'plain'))
         msg.attach(MIMEText(html, 'html'))
         
-        return send_email_with_smtp(msg, smtp_config)
+        return enqueue_email(msg)
     except Exception as e:
         app.logger.error(f"Erreur lors de la préparation de l'email : {str(e)}")
         return False
 
 def send_sender_upload_confirmation_with_files(sender_email, file_id, file_name, files_list, total_size, smtp_config, recipient_email):
     """
-    Envoie un email de confirmation à l'expéditeur avec le résumé des fichiers envoyés
+    Met en file l'email de confirmation à l'expéditeur avec le résumé des fichiers envoyés
     """
     try:
         # Obtenir l'URL frontend depuis la variable d'environnement
@@ -319,7 +319,7 @@ def send_sender_upload_confirmation_with_files(sender_email, file_id, file_name,
         msg.attach(MIMEText(text, 'plain'))
         msg.attach(MIMEText(html, 'html'))
         
-        return send_email_with_smtp(msg, smtp_config)
+        return enqueue_email(msg)
     except Exception as e:
         app.logger.error(f"Erreur lors de la préparation de l'email : {str(e)}")
         return False
@@ -348,8 +348,7 @@ def send_download_notification(sender_email, file_id, smtp_config):
         files_list = file_info.get_files_list()
         if not files_list:
             # Si pas de liste stockée, utiliser le fichier final
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_info.filename)
-            file_size = os.path.getsize(file_path)
+            file_size = stat_stored_file(file_info).size
             files_summary = f"- {file_info.filename} ({format_size(file_size)})"
             total_size_formatted = format_size(file_size)
         else:
@@ -369,182 +368,210 @@ def send_download_notification(sender_email, file_id, smtp_config):
         msg.attach(MIMEText(text, 'plain'))
         msg.attach(MIMEText(html, 'html'))
         
-        return send_email_with_smtp(msg, smtp_config)
+        return enqueue_email(msg)
     except Exception as e:
         app.logger.error(f"Erreur lors de l'envoi de la notification de téléchargement: {str(e)}")
         return False
 
-@app.route('/upload', methods=['POST', 'OPTIONS'])
-def upload_file():
-    if request.method == 'OPTIONS':
-        return jsonify({'message': 'CORS preflight success'}), 200
-
-    try:
-        app.logger.info("Début du traitement de l'upload")
-        app.logger.info(f"Files in request: {request.files}")
-        app.logger.info(f"Form data: {request.form}")
-        
-        if 'files[]' not in request.files:
-            app.logger.error("Pas de fichiers dans la requête")
-            return jsonify({'error': 'Aucun fichier envoyé'}), 400
-        
-        files = request.files.getlist('files[]')
-        paths = request.form.getlist('paths[]')
-        email = request.form.get('email')
-        sender_email = request.form.get('sender_email')
-        expiration_days = int(request.form.get('expiration_days', '7'))
-        
-        # Valider la durée d'expiration
-        if expiration_days not in [3, 5, 7, 10]:
-            expiration_days = 7  # Valeur par défaut si invalide
-            
-        app.logger.info(f"Durée d'expiration choisie: {expiration_days} jours")
-        
-        if not email or not sender_email:
-            return jsonify({'error': 'Email addresses are required'}), 400
-
-        # Récupérer et valider la liste des fichiers
-        files_list = json.loads(request.form.get('files_list', '[]'))
-        if not files_list:
-            return jsonify({'error': 'Liste des fichiers invalide'}), 400
-
-        # Calculer la taille totale pour affichage
-        total_size = sum(file_info['size'] for file_info in files_list)
-        total_size_mb = total_size / (1024 * 1024)
+class UploadFormError(ValueError):
+    """Formulaire d'upload invalide (réponse 400)"""
 
-        # Préparer le contenu des fichiers pour les emails
-        files_content = ""
-        for file_info in files_list:
-            size_mb = file_info['size'] / (1024 * 1024)
-            files_content += f"- {file_info['name']} ({format_size(file_info['size'])})\n"
+def clean_upload_path(path):
+    """
+    Nettoie le chemin relatif d'un fichier envoyé et extrait son dossier de
+    premier niveau. L'arborescence est conservée : les fichiers d'un dossier
+    sont envoyés tels quels, l'archive est construite par le serveur.
+    Retourne un tuple (chemin nettoyé, dossier de premier niveau).
+    """
+    clean_path = path.replace('\\', '/').lstrip('/')
+    path_parts = clean_path.split('/')
+    if any(part in ('', '.', '..') for part in path_parts):
+        raise UploadFormError(f"Chemin de fichier invalide : {path}")
+    parent_folder = path_parts[0] if len(path_parts) > 1 else ''
+    return clean_path, parent_folder
+
+def finalize_upload(file_id, file_list, files_list, email, sender_email, expiration_days, archive_format=None):
+    """
+    Finalise un transfert dont les fichiers sont déjà sur disque :
+    création de l'archive (ZIP ou tar.zst) ou déplacement du fichier unique,
+    hash, enregistrement en base et envoi des notifications.
+    `file_list` contient les fichiers reçus (name, size, folder, temp_path, et
+    sha256/crc32 s'ils ont été calculés à la réception),
+    `files_list` la liste déclarée par le client pour les emails,
+    `archive_format` le format demandé par l'expéditeur (à défaut, ARCHIVE_FORMAT).
+    Retourne les données de la réponse JSON.
+    """
+    # Regrouper les fichiers par dossier parent
+    folders = {}
+    for file_info in file_list:
+        folders.setdefault(file_info['folder'], []).append(file_info)
+
+    # Calculer la taille totale pour affichage
+    total_size = sum(file_info['size'] for file_info in files_list)
+
+    # Calculer en parallèle le hash des fichiers qui n'ont pas pu être hashés
+    # pendant leur écriture (upload par morceaux), en même temps que le ZIP
+    unhashed = [f for f in file_list if not f.get('sha256')]
+    hash_executor = ThreadPoolExecutor(max_workers=1)
+    hash_future = hash_executor.submit(hash_files, [f['temp_path'] for f in unhashed])
+
+    # Déterminer si on doit créer une archive
+    needs_zip = len(file_list) > 1 or any(f['folder'] for f in file_list)
+    archive_format = get_archive_format(archive_format)
+    # En mode 'streamed', l'archive n'est pas construite ici mais au téléchargement
+    streamed = needs_zip and app.config['ARCHIVE_MODE'] == 'streamed'
+    archive = None
+    # Archive déjà construite pour les mêmes fichiers : (index, blob)
+    reused = None
 
-        # Sauvegarder les fichiers
-        file_id = str(uuid.uuid4())
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp', file_id)
-        os.makedirs(temp_dir, exist_ok=True)
-        app.logger.info(f"Dossier temporaire créé: {temp_dir}")
-
-        folders = {}
-        file_list = []
-
-        # Sauvegarder les fichiers avec leur structure de dossiers
-        for file, path in zip(files, paths):
-            if file.filename:
-                # Nettoyer le chemin et extraire le dossier parent
-                clean_path = path.lstrip('/')
-                # S'assurer qu'il n'y a qu'un seul niveau de dossier
-                path_parts = clean_path.split('/')
-                if len(path_parts) > 1:
-                    parent_folder = path_parts[0]
-                    filename = path_parts[-1]
-                    clean_path = f"{parent_folder}/{filename}" if parent_folder else filename
-                else:
-                    parent_folder = ''
-                    
-                if parent_folder not in folders:
-                    folders[parent_folder] = []
-                
-                # Créer le dossier temporaire si nécessaire
-                temp_file_path = os.path.join(temp_dir, clean_path)
-                if parent_folder:
-                    os.makedirs(os.path.join(temp_dir, parent_folder), exist_ok=True)
-                    app.logger.info(f"Création du dossier: {os.path.join(temp_dir, parent_folder)}")
-                
-                # Sauvegarder le fichier
-                file.save(temp_file_path)
-                app.logger.info(f"Fichier sauvegardé: {temp_file_path}")
-                
-                file_size = os.path.getsize(temp_file_path)
-                app.logger.info(f"Taille du fichier: {format_size(file_size)}")
-                
-                # Ajouter à la liste des fichiers avec la structure correcte
-                file_info = {
-                    'name': clean_path,
-                    'size': file_size,
-                    'folder': parent_folder,
-                    'temp_path': temp_file_path
-                }
-                folders[parent_folder].append(file_info)
-                file_list.append(file_info)
-
-        # Déterminer si on doit créer un zip
-        needs_zip = len(file_list) > 1 or any(f['folder'] for f in file_list)
-        
-        if needs_zip:
-            # Créer le ZIP avec la même structure
+    try:
+        if needs_zip and not streamed:
+            # Créer l'archive avec la même structure
             # Créer un nom de fichier avec la date et l'heure
-            now = datetime.now()
-            date_str = now.strftime("%y%m%d%H%M")
-            final_filename = f"iTransfer_{date_str}.zip"
-            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], final_filename)
-            app.logger.info(f"Création du ZIP: {zip_path}")
-
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for parent_folder, folder_files in folders.items():
-                    for file_info in folder_files:
-                        app.logger.info(f"Ajout au ZIP: {file_info['name']}")
-                        # Utiliser le nom nettoyé pour l'archivage
-                        zipf.write(file_info['temp_path'], file_info['name'])
-
-            # Hasher le fichier zip
-            with open(zip_path, 'rb') as f:
-                encrypted_data = hashlib.sha256(f.read()).hexdigest()
-            
-            final_path = zip_path
+            final_filename = get_archive_name(archive_format=archive_format)
+            # L'archive est construite dans le dossier temporaire puis rangée dans le magasin de blobs
+            archive_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp', f"{file_id}.{archive_format}")
+            ordered_files = [file_info for folder_files in folders.values() for file_info in folder_files]
+
+            # Fichiers déjà hashés à la réception : une archive identique est réutilisée sans être construite
+            if not unhashed:
+                reused = find_materialized_archive(file_id, get_archive_content_key(ordered_files, archive_format))
+
+        if needs_zip and not streamed and reused is None:
+            app.logger.debug("Création de l'archive : %s", archive_path)
+            if archive_format == 'tar.zst':
+                # Fichiers écrits tels quels dans le tar, compressé en zstd par plusieurs threads
+                with upload_phase('tar'):
+                    encrypted_data, tar_entries = build_tar_archive(ordered_files, archive_path)
+            else:
+                # Compresser les fichiers en parallèle puis assembler le ZIP
+                with upload_phase('zip'):
+                    encrypted_data, stored_count, cpu_seconds_saved, zip_entries = build_zip_archive(ordered_files, archive_path)
+                app.logger.info(
+                    "Compression : %d/%d fichier(s) stocké(s) sans compression, environ %.2f s de CPU économisées",
+                    stored_count, len(file_list), cpu_seconds_saved
+                )
+
+        # Temps d'attente des hash restants (calculés en même temps que le ZIP)
+        with upload_phase('hash'):
+            hashes = hash_future.result()
+        for file_info, (digest, crc32) in zip(unhashed, hashes):
+            file_info['sha256'] = digest
+            file_info['crc32'] = crc32
+    finally:
+        hash_executor.shutdown()
+
+    if needs_zip and not streamed and reused is None and unhashed:
+        # Upload par morceaux : l'archive construite est abandonnée si une archive identique existe
+        reused = find_materialized_archive(file_id, get_archive_content_key(ordered_files, archive_format))
+        if reused is not None:
+            os.remove(archive_path)
+
+    # Contenus à ranger dans le magasin de blobs : (fichier, hash, taille)
+    if needs_zip and not streamed and reused is not None:
+        # Le blob de l'archive existe déjà, rien à ranger
+        archive, reused_blob = reused
+        encrypted_data = reused_blob.sha256
+        blobs = []
+        app.logger.debug("Archive identique à celle d'un transfert existant : %s", encrypted_data)
+    elif needs_zip and not streamed:
+        # Indexer l'archive pour servir chaque fichier séparément
+        if archive_format == 'tar.zst':
+            archive = build_tar_index(file_id, archive_path, tar_entries, file_list)
         else:
-            # Cas d'un fichier unique
-            single_file = file_list[0]
-            final_filename = single_file['name']
-            final_path = single_file['temp_path']
-            
-            # Hasher le fichier unique
-            with open(final_path, 'rb') as f:
-                encrypted_data = hashlib.sha256(f.read()).hexdigest()
-            
-            # Déplacer le fichier vers le dossier final
-            final_destination = os.path.join(app.config['UPLOAD_FOLDER'], final_filename)
-            shutil.move(final_path, final_destination)
-            final_path = final_destination
-
-        app.logger.info(f"Hash du fichier: {encrypted_data}")
-
-        # Préparer la liste des fichiers initiale avec les tailles et noms originaux
-        original_files = []
-        for file_info in files_list:
-            original_files.append({
-                'name': file_info['name'],
-                'size': file_info['size']
-            })
+            archive = build_archive_index(file_id, archive_path, zip_entries, file_list)
+        archive.content_key = get_archive_content_key(ordered_files, archive_format)
+        blobs = [(archive_path, encrypted_data, os.path.getsize(archive_path))]
+    elif streamed:
+        # Conserver les fichiers tels quels, l'archive sera produite en flux
+        final_filename, encrypted_data, archive = store_streamed_archive(file_id, file_list, archive_format)
+        blobs = [(f['temp_path'], f['sha256'], f['size']) for f in file_list]
+        app.logger.debug("Fichiers conservés pour une archive générée au téléchargement : %d", len(blobs))
+    else:
+        # Cas d'un fichier unique
+        single_file = file_list[0]
+        final_filename = single_file['name']
+        encrypted_data = single_file['sha256']
+        blobs = [(single_file['temp_path'], single_file['sha256'], single_file['size'])]
+
+
+    # Préparer la liste des fichiers initiale avec les tailles et noms originaux,
+    # complétée par le SHA-256 de chaque fichier reçu tel quel
+    member_hashes = {file_info['name']: file_info['sha256'] for file_info in file_list}
+    original_files = []
+    for file_info in files_list:
+        original_file = {
+            'name': file_info['name'],
+            'size': file_info['size']
+        }
+        if file_info['name'] in member_hashes:
+            original_file['sha256'] = member_hashes[file_info['name']]
+        original_files.append(original_file)
+
+    # Sauvegarder en base avec la liste des fichiers originaux
+    # Créer l'entrée en base avec la liste des fichiers originaux
+    new_file = FileUpload(
+        id=file_id,
+        filename=final_filename,
+        email=email,
+        sender_email=sender_email,
+        encrypted_data=encrypted_data,
+        downloaded=False,
+        expires_at=datetime.now() + timedelta(days=expiration_days)
+    )
+    new_file.set_files_list(original_files)
+    db.session.add(new_file)
+    if archive is not None:
+        db.session.add(archive)
+        add_transfer_members(file_id, archive.get_manifest())
+    else:
+        add_transfer_members(file_id, [{
+            'name': final_filename,
+            'size': single_file['size'],
+            'sha256': encrypted_data,
+            'crc32': single_file['crc32']
+        }])
+    try:
+        # Les références aux blobs sont enregistrées dans la même transaction
+        # que le transfert : un contenu déjà stocké n'est pas écrit une seconde fois
+        with upload_phase('store'):
+            deduplicated = sum(add_blob(file_id, path, sha256, size) for path, sha256, size in blobs)
+            if reused is not None:
+                reference_blob(file_id, reused_blob)
+                deduplicated += 1
+        with upload_phase('db'):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if needs_zip and not streamed and os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    received_bytes = sum(file_info['size'] for file_info in file_list)
+    # Une ligne de résumé par transfert, quel que soit le nombre de fichiers
+    app.logger.info(
+        "Transfert %s enregistré : %d fichier(s), %s",
+        file_id, len(file_list), format_size(received_bytes),
+        extra={
+            'transfer_id': file_id,
+            'files': len(file_list),
+            'bytes': received_bytes,
+            'sha256': encrypted_data,
+            'deduplicated': deduplicated,
+            'archive': 'streamed' if streamed else ('zip' if needs_zip else None),
+            'archive_format': archive_format if needs_zip else None
+        }
+    )
+    upload_bytes.inc(received_bytes)
 
-        # Sauvegarder en base avec la liste des fichiers originaux
-        # Créer l'entrée en base avec la liste des fichiers originaux
-        new_file = FileUpload(
-            id=file_id,
-            filename=final_filename,
-            email=email,
-            sender_email=sender_email,
-            encrypted_data=encrypted_data,
-            downloaded=False,
-            expires_at=datetime.now() + timedelta(days=expiration_days)
-        )
-        new_file.set_files_list(original_files)
-        db.session.add(new_file)
-        db.session.commit()
-        app.logger.info(f"Fichier enregistré en base avec l'ID: {file_id}")
+    total_size_formatted = format_size(total_size)
 
-        # Préparer le résumé des fichiers à partir des données brutes
-        files_summary = ""
-        for file_info in files_list:
-            files_summary += f"- {file_info['name']} ({format_size(file_info['size'])})\n"
-        total_size_formatted = format_size(total_size)
-
-        # Envoyer les notifications
-        with open(app.config['SMTP_CONFIG_PATH'], 'r') as config_file:
-            smtp_config = json.load(config_file)
+    # Mettre les notifications en file : elles sont envoyées en arrière-plan
+    smtp_config = get_smtp_config() or {}
 
-        notification_errors = []
+    notification_errors = []
 
-        try:
+    try:
+        with upload_phase('email'):
             # Récupérer la liste des fichiers stockée pour les notifications
             stored_files = new_file.get_files_list()
             files_summary = ""
@@ -554,144 +581,409 @@ def upload_file():
             if not send_recipient_notification_with_files(email, file_id, final_filename, files_summary, total_size_formatted, smtp_config, sender_email):
                 app.logger.error(f"Échec de l'envoi de la notification au destinataire: {email}")
                 notification_errors.append("destinataire")
-            
+
             if not send_sender_upload_confirmation_with_files(sender_email, file_id, final_filename, stored_files, total_size_formatted, smtp_config, email):
                 app.logger.error(f"Échec de l'envoi de la notification à l'expéditeur: {sender_email}")
                 notification_errors.append("expéditeur")
-        except Exception as e:
-            app.logger.error(f"Erreur lors de l'envoi des emails : {str(e)}")
-            notification_errors.append("tous les destinataires")
+    except Exception as e:
+        app.logger.error(f"Erreur lors de la mise en file des emails : {str(e)}")
+        notification_errors.append("tous les destinataires")
 
-        response_data = {
-            'success': True,
-            'file_id': file_id,
-            'message': 'Fichiers uploadés avec succès'
-        }
+    response_data = {
+        'success': True,
+        'file_id': file_id,
+        'message': 'Fichiers uploadés avec succès'
+    }
 
-        if notification_errors:
-            response_data['warning'] = f"Impossible d'envoyer les notifications aux destinataires suivants: {', '.join(notification_errors)}"
+    if notification_errors:
+        response_data['warning'] = f"Impossible d'envoyer les notifications aux destinataires suivants: {', '.join(notification_errors)}"
+
+    return response_data
+
+def parse_expiration_days(value):
+    """
+    Valide la durée d'expiration demandée (7 jours par défaut si invalide)
+    """
+    try:
+        expiration_days = int(value)
+    except (TypeError, ValueError):
+        return 7
+    if expiration_days not in [3, 5, 7, 10]:
+        return 7  # Valeur par défaut si invalide
+    return expiration_days
+
+def read_upload_form(form):
+    """
+    Valide les champs du formulaire d'upload.
+    Retourne un tuple (email, sender_email, expiration_days, files_list, archive_format).
+    """
+    email = form.get('email')
+    sender_email = form.get('sender_email')
+    expiration_days = parse_expiration_days(form.get('expiration_days', '7'))
+
+    if not email or not sender_email:
+        raise UploadFormError('Email addresses are required')
+
+    # Récupérer et valider la liste des fichiers
+    try:
+        files_list = json.loads(form.get('files_list', '[]'))
+    except ValueError:
+        files_list = None
+    if not files_list:
+        raise UploadFormError('Liste des fichiers invalide')
+
+    # Format de l'archive choisi par l'expéditeur (facultatif, validé à la finalisation)
+    archive_format = form.get('archive_format') or None
+
+    return email, sender_email, expiration_days, files_list, archive_format
+
+def admit_upload_form(form):
+    """
+    Valide le formulaire et ajuste la réservation d'espace disque à la liste
+    des fichiers déclarée, avant d'écrire le premier fichier
+    """
+    email, sender_email, expiration_days, files_list, archive_format = read_upload_form(form)
+    reserve_upload(files_list)
+    return email, sender_email, expiration_days, files_list, archive_format
+
+def place_uploaded_file(temp_dir, path):
+    """
+    Calcule l'emplacement d'un fichier reçu dans le dossier temporaire
+    et crée son dossier parent si nécessaire.
+    Retourne un tuple (chemin nettoyé, dossier parent, chemin sur disque).
+    """
+    # Nettoyer le chemin et extraire le dossier parent
+    clean_path, parent_folder = clean_upload_path(path)
+    
+    # Créer le dossier temporaire si nécessaire
+    temp_file_path = os.path.join(temp_dir, clean_path)
+    if parent_folder:
+        os.makedirs(os.path.dirname(temp_file_path), exist_ok=True)
+    return clean_path, parent_folder, temp_file_path
+
+def save_uploaded_files(files, paths, temp_dir):
+    """
+    Sauvegarde les fichiers déjà analysés par Werkzeug (mode standard)
+    """
+    file_list = []
+    file_log = FileLogSampler(app.logger, app.config['LOG_FILE_SAMPLE'])
+
+    # Sauvegarder les fichiers avec leur structure de dossiers
+    for file, path in zip(files, paths):
+        if file.filename:
+            clean_path, parent_folder, temp_file_path = place_uploaded_file(temp_dir, path)
+            
+            # Sauvegarder le fichier en calculant son hash au passage
+            with open(temp_file_path, 'wb') as output:
+                writer = HashingWriter(output)
+                file.save(writer)
+            file_log.debug("Fichier sauvegardé : %s (%d octets)", temp_file_path, writer.size)
+            
+            # Ajouter à la liste des fichiers avec la structure correcte
+            file_list.append({
+                'name': clean_path,
+                'size': writer.size,
+                'folder': parent_folder,
+                'temp_path': temp_file_path,
+                'sha256': writer.hexdigest(),
+                'crc32': writer.crc32
+            })
+
+    if file_log.skipped:
+        app.logger.debug("%d autre(s) fichier(s) sauvegardé(s), non détaillé(s)", file_log.skipped)
+    return file_list
+
+def ingest_uploaded_files(temp_dir):
+    """
+    Lit le corps de la requête au fil de l'eau (mode streaming) : chaque
+    fichier est écrit une seule fois puis renommé à son emplacement définitif.
+    Retourne un tuple (champs du formulaire, fichiers reçus).
+    """
+    boundary = request.mimetype_params.get('boundary', '').encode('latin-1')
+    if not boundary:
+        raise UploadFormError('Requête multipart invalide')
+
+    form, parts = ingest_multipart(request.stream, boundary, temp_dir, before_files=admit_upload_form)
+    file_parts = [part for part in parts if part['field'] == 'files[]']
+    paths = form.getlist('paths[]')
+
+    file_list = []
+    file_log = FileLogSampler(app.logger, app.config['LOG_FILE_SAMPLE'])
+    for part, path in zip(file_parts, paths):
+        if part['filename']:
+            clean_path, parent_folder, temp_file_path = place_uploaded_file(temp_dir, path)
+            # Simple renommage dans le même dossier : aucune copie des données
+            os.replace(part['temp_path'], temp_file_path)
+            file_log.debug("Fichier reçu : %s (%d octets)", temp_file_path, part['size'])
+            file_list.append({
+                'name': clean_path,
+                'size': part['size'],
+                'folder': parent_folder,
+                'temp_path': temp_file_path,
+                'sha256': part['sha256'],
+                'crc32': part['crc32']
+            })
+
+    if file_log.skipped:
+        app.logger.debug("%d autre(s) fichier(s) reçu(s), non détaillé(s)", file_log.skipped)
+    return form, file_list
+
+@app.route('/upload', methods=['POST', 'OPTIONS'])
+def upload_file():
+    if request.method == 'OPTIONS':
+        return jsonify({'message': 'CORS preflight success'}), 200
+
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        app.logger.info("Début du traitement de l'upload")
+
+        # Admission : places et espace disque réservés avant de lire le corps
+        reserve_upload()
+
+        # Sauvegarder les fichiers
+        file_id = str(uuid.uuid4())
+        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp', file_id)
+        os.makedirs(temp_dir, exist_ok=True)
+        app.logger.debug("Dossier temporaire créé : %s", temp_dir)
+
+        # Réception du corps et écriture des fichiers
+        with upload_phase('save'):
+            if app.config['UPLOAD_INGEST_MODE'] == 'streaming' and request.mimetype == 'multipart/form-data':
+                form, file_list = ingest_uploaded_files(temp_dir)
+                email, sender_email, expiration_days, files_list, archive_format = read_upload_form(form)
+            else:
+                app.logger.debug("Formulaire : %d fichier(s), champs %s", len(request.files.getlist('files[]')), sorted(request.form))
+
+                if 'files[]' not in request.files:
+                    app.logger.error("Pas de fichiers dans la requête")
+                    return jsonify({'error': 'Aucun fichier envoyé'}), 400
+
+                email, sender_email, expiration_days, files_list, archive_format = admit_upload_form(request.form)
+                file_list = save_uploaded_files(request.files.getlist('files[]'), request.form.getlist('paths[]'), temp_dir)
+            
+        app.logger.debug("Durée d'expiration choisie : %d jours", expiration_days)
+
+        if not file_list:
+            app.logger.error("Pas de fichiers dans la requête")
+            return jsonify({'error': 'Aucun fichier envoyé'}), 400
+
+        response_data = finalize_upload(file_id, file_list, files_list, email, sender_email, expiration_days, archive_format)
 
         app.logger.info("Upload terminé avec succès")
+        status = 'success'
         return jsonify(response_data), 200
 
+    except UploadFormError as e:
+        app.logger.error(f"Upload refusé : {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    except MalformedMultipart as e:
+        # Envoi interrompu par le client : cas attendu, pas une erreur du serveur
+        app.logger.warning("Upload interrompu : %s", e)
+        status = 'aborted'
+        return jsonify({'error': str(e)}), 400
+
+    except AdmissionRejected as e:
+        status = 'rejected'
+        return rejection_response(e)
+
+    except RequestEntityTooLarge:
+        app.logger.error("Upload refusé : transfert trop volumineux")
+        return jsonify({'error': 'Transfert trop volumineux'}), 413
+
     except Exception as e:
         app.logger.error(f"Erreur lors du traitement des fichiers: {str(e)}")
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        if 'zip_path' in locals() and os.path.exists(zip_path):
-            os.remove(zip_path)
         return jsonify({'error': 'Une erreur interne est survenue'}), 500
 
     finally:
         if 'temp_dir' in locals() and os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
+        upload_duration.labels(status).observe(time.perf_counter() - started)
 
 @app.route('/transfer/<file_id>', methods=['GET'])
 def get_transfer_details(file_id):
     try:
-        # Récupérer les informations du fichier depuis la base de données
-        file_info = FileUpload.query.get(file_id)
-        if not file_info:
+        # Métadonnées du transfert, lues en base et dans le stockage au premier accès seulement
+        with span('lookup'):
+            transfer = get_transfer(file_id)
+        if not transfer:
             app.logger.error(f"Fichier non trouvé: {file_id}")
             return jsonify({'error': 'Fichier non trouvé'}), 404
 
         # Vérifier l'expiration
-        if datetime.now() > file_info.expires_at:
-            app.logger.info(f"Tentative d'accès à un fichier expiré: {file_id}")
+        if transfer.is_expired():
+            app.logger.info("Tentative d'accès à un fichier expiré : %s", file_id)
             return jsonify({'error': 'Le lien de téléchargement a expiré'}), 410
 
-        # Récupérer la liste des fichiers stockée
-        files_list = file_info.get_files_list()
-        
-        if not files_list:
-            # Si pas de liste stockée, vérifier si le fichier existe
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_info.filename)
-            if not os.path.exists(file_path):
-                return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
-                
-            # Créer une liste avec le fichier unique
-            file_size = os.path.getsize(file_path)
-            files_list = [{
-                'name': file_info.filename,
-                'size': file_size
-            }]
-        else:
-            # Vérifier si le fichier final existe (ZIP ou fichier unique)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_info.filename)
-            if not os.path.exists(file_path):
-                return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
+        # Vérifier si le contenu est toujours stocké (ZIP, fichier unique ou fichiers de l'archive)
+        if not transfer.stored:
+            return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
+
+        # Récupérer la liste des fichiers stockée, ou créer une liste avec le fichier unique
+        files_list = transfer.get_files_list() or [{
+            'name': transfer.filename,
+            'size': transfer.size
+        }]
 
         # Retourner la liste des fichiers avec les détails
         return jsonify({
             'files': files_list,
-            'expires_at': file_info.expires_at.isoformat()
+            # Nom du fichier téléchargé (archive ou fichier unique)
+            'filename': transfer.filename,
+            # Fichiers téléchargeables séparément
+            'members': [{'name': m['name'], 'size': m['size']} for m in transfer.members],
+            'expires_at': transfer.expires_at.isoformat()
         }), 200
 
     except Exception as e:
         app.logger.error(f"Erreur lors de la récupération des détails : {str(e)}")
         return jsonify({'error': 'Une erreur est survenue'}), 500
 
+def record_download(transfer):
+    """
+    Marque le transfert comme téléchargé et prévient l'expéditeur au premier téléchargement.
+    La mise à jour est conditionnelle : une seule requête envoie la notification,
+    même si plusieurs téléchargements commencent en même temps.
+    """
+    if transfer.downloaded:
+        return
+    updated = (
+        FileUpload.query
+        .filter(FileUpload.id == transfer.id, FileUpload.downloaded.is_(False))
+        .update({'downloaded': True}, synchronize_session=False)
+    )
+    db.session.commit()
+    transfer_cache.mark_downloaded(transfer.id)
+    if not updated:
+        return
+
+    # Mettre en file la notification à l'expéditeur
+    smtp_config = get_smtp_config() or {}
+    send_download_notification(transfer.sender_email, transfer.id, smtp_config)
+
 @app.route('/download/<file_id>', methods=['GET'])
 def download_file(file_id):
     try:
-        # Récupérer les informations du fichier depuis la base de données
-        file_info = FileUpload.query.get(file_id)
-        if not file_info:
+        with span('lookup'):
+            transfer = get_transfer(file_id)
+        if not transfer:
             app.logger.error(f"Fichier non trouvé: {file_id}")
             return jsonify({'error': 'Fichier non trouvé'}), 404
 
         # Vérifier l'expiration
-        if datetime.now() > file_info.expires_at:
-            app.logger.info(f"Tentative d'accès à un fichier expiré: {file_id}")
+        if transfer.is_expired():
+            app.logger.info("Tentative d'accès à un fichier expiré : %s", file_id)
             return jsonify({'error': 'Le lien de téléchargement a expiré'}), 410
 
-        # Construire le chemin du fichier
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_info.filename)
-        
-        if not os.path.exists(file_path):
+        if not transfer.stored:
             return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
 
+        # Clé du fichier final dans le stockage (aucune si l'archive est générée à la volée)
+        stored_key = transfer.stored_key
+        file_path = storage.local_path(stored_key) if stored_key else None
+
+        # Le hash stocké identifie le contenu : c'est l'ETag du transfert
+        etag = transfer.encrypted_data
+        offload = get_offload_mode() != 'none' and file_path is not None
+        if not offload and is_not_modified(etag):
+            return set_validators(Response(status=304), etag)
+
         # Marquer le fichier comme téléchargé
-        if not file_info.downloaded:
-            file_info.downloaded = True
-            db.session.commit()
+        with span('record'):
+            record_download(transfer)
 
-            # Charger la configuration SMTP
-            with open(app.config['SMTP_CONFIG_PATH'], 'r') as config_file:
-                smtp_config = json.load(config_file)
+        download_name = os.path.basename(transfer.filename)
 
-            # Récupérer la liste des fichiers depuis la base de données
-            files_list = file_info.get_files_list()
-            
-            # Préparer le résumé des fichiers
-            total_size = 0
-            files_summary = ""
-            
-            if files_list:
-                for f in files_list:
-                    files_summary += f"- {f['name']} ({format_size(f['size'])})\n"
-                    total_size += f['size']
-                total_size_formatted = format_size(total_size)
-            else:
-                # Fallback pour un seul fichier
-                file_size = os.path.getsize(file_path)
-                files_summary = f"- {file_info.filename} ({format_size(file_size)})"
-                total_size_formatted = format_size(file_size)
-
-            # Envoyer une notification à l'expéditeur
-            send_download_notification(file_info.sender_email, file_id, smtp_config)
-
-        # Envoyer le fichier
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=os.path.basename(file_info.filename)
-        )
+        # Déléguer l'envoi au serveur frontal si configuré (X-Accel-Redirect / X-Sendfile) :
+        # il gère lui-même les plages et les validateurs du fichier
+        if offload:
+            return build_offload_response(file_path, download_name)
+
+        # L'archive générée à la volée n'existe pas sur disque : elle est produite
+        # en flux, avec une taille connue d'avance, et chaque plage est calculable
+        if transfer.streamed:
+            layout = transfer.get_archive_layout()
+            if transfer.archive_format == 'tar.zst':
+                # Compressée au fil de l'envoi : taille inconnue, pas de reprise par plages
+                return build_unsized_stream_response(iter_compressed_tar(layout), 'application/zstd', etag, download_name)
+            return build_stream_response(layout.content_length, layout.iter_range, 'application/zip', etag, download_name)
+
+        # Stockage objet : le client télécharge directement via une URL signée
+        presigned = build_presigned_response(stored_key, download_name)
+        if presigned is not None:
+            return presigned
+
+        # Envoyer le fichier, entier ou par plages (reprise d'un téléchargement interrompu)
+        return send_stored_file(stored_key, download_name, etag)
 
     except Exception as e:
         app.logger.error(f"Erreur lors du téléchargement : {str(e)}")
         return jsonify({'error': 'Une erreur est survenue lors du téléchargement'}), 500
 
+@app.route('/download/<file_id>/member/<path:member_path>', methods=['GET'])
+def download_member(file_id, member_path):
+    """
+    Télécharge un seul fichier d'un transfert, sans récupérer l'archive entière
+    """
+    try:
+        with span('lookup'):
+            transfer = get_transfer(file_id)
+        if not transfer:
+            app.logger.error(f"Fichier non trouvé: {file_id}")
+            return jsonify({'error': 'Fichier non trouvé'}), 404
+
+        # Vérifier l'expiration
+        if transfer.is_expired():
+            app.logger.info("Tentative d'accès à un fichier expiré : %s", file_id)
+            return jsonify({'error': 'Le lien de téléchargement a expiré'}), 410
+
+        if not transfer.stored:
+            return jsonify({'error': 'Fichier non trouvé sur le serveur'}), 404
+
+        # L'index de l'archive donne la position du fichier dans le ZIP ou le tar
+        member = transfer.find_member(member_path)
+        if member is None:
+            return jsonify({'error': 'Fichier non trouvé dans le transfert'}), 404
+
+        etag = member.get('sha256') or f"{transfer.encrypted_data}-{member['crc32']:08x}"
+        member_key = transfer.get_member_key(member)
+        local_path = storage.local_path(member_key) if member_key else None
+        offload = get_offload_mode() != 'none' and local_path is not None
+        if not offload and is_not_modified(etag):
+            return set_validators(Response(status=304), etag)
+
+        with span('record'):
+            record_download(transfer)
+        download_name = os.path.basename(member['name'])
+
+        # Fichier stocké seul : envoi direct
+        if member_key is not None:
+            if offload:
+                return build_offload_response(local_path, download_name)
+            presigned = build_presigned_response(member_key, download_name)
+            if presigned is not None:
+                return presigned
+            return send_stored_file(member_key, download_name, etag)
+
+        # Fichier dans l'archive : lu à sa position, décompressé si besoin
+        archive_key = transfer.stored_key
+        if transfer.archive_format == 'tar.zst':
+            read_range = lambda start, end: iter_tar_member(archive_key, transfer.size, member, start, end)
+        else:
+            read_range = lambda start, end: iter_member(archive_key, member, start, end)
+        return build_stream_response(
+            member['size'],
+            read_range,
+            guess_mimetype(download_name),
+            etag,
+            download_name
+        )
+
+    except Exception as e:
+        app.logger.error(f"Erreur lors du téléchargement du fichier {member_path} : {str(e)}")
+        return jsonify({'error': 'Une erreur est survenue lors du téléchargement'}), 500
+
 @app.route('/login', methods=['POST', 'OPTIONS'])
 def login():
     if request.method == 'OPTIONS':
@@ -732,12 +1024,14 @@ def save_smtp_settings():
             'smtp_password': data['smtpPassword'],
             'smtp_sender_email': data['smtpSenderEmail']
         }
+        # Mode de connexion optionnel : 'ssl', 'starttls' ou 'none' (sinon déduit du port)
+        if data.get('smtpSecurity') in ('ssl', 'starttls', 'none'):
+            smtp_config['smtp_security'] = data['smtpSecurity']
 
         app.logger.info("Configuration SMTP reçue et sauvegardée (détails non inclus pour des raisons de sécurité)")
         
-        # Sauvegarder la configuration
-        with open(app.config['SMTP_CONFIG_PATH'], 'w') as config_file:
-            json.dump(smtp_config, config_file, indent=2)
+        # Sauvegarder la configuration (écriture atomique, prise en compte immédiate)
+        save_smtp_config(smtp_config)
         
         app.logger.info("Configuration SMTP sauvegardée avec succès")
         return jsonify({'message': 'Configuration SMTP sauvegardée'}), 200
@@ -756,9 +1050,10 @@ def test_smtp():
         
         # Charger la configuration SMTP
         try:
-            with open(app.config['SMTP_CONFIG_PATH'], 'r') as config_file:
-                smtp_config = json.load(config_file)
-                app.logger.info(f"Configuration SMTP chargée : serveur={smtp_config['smtp_server']}, port={smtp_config['smtp_port']}, user={smtp_config['smtp_user']}, sender={smtp_config['smtp_sender_email']}")
+            smtp_config = get_smtp_config()
+            if smtp_config is None:
+                raise FileNotFoundError(app.config['SMTP_CONFIG_PATH'])
+            app.logger.info(f"Configuration SMTP chargée : serveur={smtp_config['smtp_server']}, port={smtp_config['smtp_port']}, user={smtp_config['smtp_user']}, sender={smtp_config['smtp_sender_email']}")
         except Exception as e:
             app.logger.error(f"Erreur lors du chargement de la configuration SMTP : {str(e)}")
             return jsonify({'error': 'Configuration SMTP non trouvée. Veuillez d\'abord configurer les paramètres SMTP.'}), 404
@@ -801,3 +1096,30 @@ def test_smtp():
     except Exception as e:
         app.logger.error(f"Erreur inattendue lors du test SMTP : {str(e)}")
         return jsonify({'error': 'Une erreur interne est survenue lors du test SMTP.'}), 500
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    Statistiques du processus : pool SMTP, compression des archives,
+    occupation du magasin de blobs, cache des transferts, nettoyage des
+    transferts expirés, serveur asynchrone, journalisation, admission
+    des uploads et débit des téléchargements. Réservé à l'administrateur
+    (TRACE_ADMIN_TOKEN), comme les routes /api/admin.
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    # Import différé : cleanup importe resumable, qui importe ce module
+    from .cleanup import get_cleanup_stats
+    from .asgi import get_async_server_stats
+    return jsonify({
+        'smtp_pool': get_smtp_pool_stats(),
+        'compression': get_compression_stats(),
+        'blobs': get_blob_stats(),
+        'transfer_cache': get_transfer_cache_stats(),
+        'cleanup': get_cleanup_stats(),
+        'async_server': get_async_server_stats(),
+        'logging': get_log_stats(),
+        'admission': get_admission_stats(),
+        'bandwidth': get_bandwidth_stats()
+    }), 200
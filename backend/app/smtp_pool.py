@@ -0,0 +1,240 @@
+import time
+import smtplib
+import hashlib
+import threading
+from . import app
+from .metrics import smtp_handshake
+
+class PooledConnection:
+    """
+    Session SMTP authentifiée conservée dans le pool
+    """
+
+    def __init__(self, key, server):
+        self.key = key
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.reused = False
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+class SMTPConnectionPool:
+    """
+    Pool de sessions SMTP par processus. Une session ouverte (connexion,
+    TLS et authentification) est réutilisée pour les envois suivants tant
+    qu'elle n'est pas restée inactive plus de idle_timeout secondes. Une
+    session inactive depuis plus de noop_interval secondes est vérifiée
+    par un NOOP avant d'être réutilisée.
+    """
+
+    def __init__(self, max_size=2, idle_timeout=60, noop_interval=10, max_age=600, timeout=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.noop_interval = noop_interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.idle = []
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.discarded = 0
+        self.messages_sent = 0
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_size=config['SMTP_POOL_SIZE'],
+            idle_timeout=config['SMTP_POOL_IDLE_TIMEOUT'],
+            noop_interval=config['SMTP_POOL_NOOP_INTERVAL'],
+            max_age=config['SMTP_POOL_MAX_AGE'],
+            timeout=config['SMTP_TIMEOUT']
+        )
+
+    @staticmethod
+    def config_key(smtp_config):
+        """
+        Identifie les paramètres de connexion : une configuration modifiée
+        n'utilise jamais une session ouverte avec les anciens paramètres
+        """
+        password = hashlib.sha256(str(smtp_config.get('smtp_password', '')).encode('utf-8')).hexdigest()
+        return (
+            smtp_config['smtp_server'],
+            int(smtp_config['smtp_port']),
+            smtp_config.get('smtp_security') or '',
+            smtp_config.get('smtp_user') or '',
+            password
+        )
+
+    def connect(self, smtp_config):
+        """
+        Ouvre une nouvelle session : connexion, chiffrement puis authentification.
+        Le mode est smtp_security ('ssl', 'starttls' ou 'none') s'il est
+        renseigné, sinon il est déduit du port. Chaque opération réseau est
+        limitée à `timeout` secondes : un relais bloqué ne retient pas le
+        thread d'envoi.
+        """
+        port = int(smtp_config['smtp_port'])
+        security = smtp_config.get('smtp_security') or ('ssl' if port == 465 else 'starttls')
+        start = time.perf_counter()
+        if security == 'ssl':
+            # Port 465 : SMTP_SSL
+            app.logger.info(f"Utilisation de SMTP_SSL (port {port})")
+            server = smtplib.SMTP_SSL(smtp_config['smtp_server'], port, timeout=self.timeout)
+        elif security == 'starttls':
+            # Port 587 ou autre : SMTP + STARTTLS
+            app.logger.info(f"Utilisation de SMTP + STARTTLS (port {port})")
+            server = smtplib.SMTP(smtp_config['smtp_server'], port, timeout=self.timeout)
+        else:
+            # Relais local sans chiffrement (serveur de test, relais interne)
+            app.logger.info(f"Utilisation de SMTP sans chiffrement (port {port})")
+            server = smtplib.SMTP(smtp_config['smtp_server'], port, timeout=self.timeout)
+        try:
+            if security == 'starttls':
+                server.starttls()
+            if smtp_config.get('smtp_user'):
+                server.login(smtp_config['smtp_user'], smtp_config['smtp_password'])
+        except Exception:
+            # Échec du chiffrement ou de l'authentification : fermer la socket ouverte
+            try:
+                server.close()
+            except Exception:
+                pass
+            raise
+        elapsed = time.perf_counter() - start
+        smtp_handshake.observe(elapsed)
+        with self.lock:
+            self.handshakes += 1
+            self.handshake_seconds += elapsed
+        return PooledConnection(self.config_key(smtp_config), server)
+
+    def is_usable(self, connection, now):
+        """
+        Vérifie qu'une session du pool peut encore servir
+        """
+        if now - connection.last_used > self.idle_timeout or now - connection.created_at > self.max_age:
+            return False
+        if now - connection.last_used > self.noop_interval:
+            try:
+                code, _ = connection.server.noop()
+                return code == 250
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, smtp_config):
+        """
+        Retourne une session pour cette configuration : une session du pool
+        si possible, une nouvelle sinon
+        """
+        key = self.config_key(smtp_config)
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                index = next((i for i, c in enumerate(self.idle) if c.key == key), None)
+                connection = self.idle.pop(index) if index is not None else None
+            if connection is None:
+                break
+            if self.is_usable(connection, now):
+                with self.lock:
+                    self.hits += 1
+                connection.reused = True
+                return connection
+            self.discard(connection)
+
+        with self.lock:
+            self.misses += 1
+        return self.connect(smtp_config)
+
+    def release(self, connection):
+        """
+        Remet une session dans le pool, ou la ferme si le pool est plein
+        """
+        connection.last_used = time.monotonic()
+        with self.lock:
+            # Les sessions d'une autre configuration ne resserviront plus
+            stale = [c for c in self.idle if c.key != connection.key]
+            self.idle = [c for c in self.idle if c.key == connection.key]
+            if len(self.idle) < self.max_size:
+                self.idle.append(connection)
+                connection = None
+        for old in stale:
+            self.discard(old)
+        if connection is not None:
+            connection.close()
+
+    def discard(self, connection):
+        with self.lock:
+            self.discarded += 1
+        connection.close()
+
+    def send_message(self, msg, smtp_config):
+        """
+        Envoie un message sur une session du pool. Si une session réutilisée
+        a été fermée par le serveur, l'envoi est repris sur une nouvelle session.
+        """
+        connection = self.acquire(smtp_config)
+        try:
+            connection.server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            self.discard(connection)
+            if not connection.reused:
+                raise
+            app.logger.warning(f"Session SMTP interrompue, reconnexion : {str(e)}")
+            with self.lock:
+                self.reconnects += 1
+            connection = self.connect(smtp_config)
+            try:
+                connection.server.send_message(msg)
+            except Exception:
+                self.discard(connection)
+                raise
+        except Exception:
+            self.discard(connection)
+            raise
+        self.release(connection)
+        with self.lock:
+            self.messages_sent += 1
+
+    def prune(self):
+        """
+        Ferme les sessions restées inactives trop longtemps
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [c for c in self.idle if now - c.last_used > self.idle_timeout or now - c.created_at > self.max_age]
+            self.idle = [c for c in self.idle if c not in expired]
+        for connection in expired:
+            self.discard(connection)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'idle_connections': len(self.idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'discarded': self.discarded,
+                'messages_sent': self.messages_sent,
+                'handshakes': self.handshakes,
+                'handshake_seconds': round(self.handshake_seconds, 3),
+                'avg_handshake_seconds': round(self.handshake_seconds / self.handshakes, 3) if self.handshakes else 0.0
+            }
+
+smtp_pool = SMTPConnectionPool.from_config(app.config)
+
+def get_smtp_pool_stats():
+    """
+    Retourne les statistiques du pool SMTP du processus
+    """
+    return smtp_pool.as_dict()
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from . import app
+
+class SMTPConfigCache:
+    """
+    Configuration SMTP gardée en mémoire par chaque worker. Le fichier n'est
+    relu que si son mtime, son inode ou sa taille ont changé, et cette
+    vérification (un simple stat) n'a lieu qu'au plus toutes les
+    check_interval secondes : une configuration enregistrée par un autre
+    worker est donc prise en compte dans ce délai.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.config = None
+        self.signature = None
+        self.checked_at = None
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def _reload(self, signature):
+        if signature is None:
+            self.config = None
+        else:
+            try:
+                with open(self.path, 'r') as config_file:
+                    self.config = json.load(config_file)
+            except FileNotFoundError:
+                self.config, signature = None, None
+            except ValueError as e:
+                # Fichier illisible : conserver la dernière configuration valide
+                app.logger.error(f"Configuration SMTP invalide ({self.path}) : {str(e)}")
+                return
+            app.logger.info("Configuration SMTP chargée")
+        self.signature = signature
+
+    def get(self):
+        """
+        Retourne une copie de la configuration SMTP, None si elle n'existe pas
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at is None or now - self.checked_at >= self.check_interval:
+                self.checked_at = now
+                signature = self._signature()
+                if signature != self.signature:
+                    self._reload(signature)
+            return dict(self.config) if self.config is not None else None
+
+    def save(self, smtp_config):
+        """
+        Enregistre la configuration dans un fichier temporaire puis le renomme :
+        les lecteurs voient l'ancienne ou la nouvelle version, jamais un fichier partiel
+        """
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.smtp_config-', suffix='.json', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as config_file:
+                json.dump(smtp_config, config_file, indent=2)
+                config_file.flush()
+                os.fsync(config_file.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self.lock:
+            self.config = dict(smtp_config)
+            self.signature = self._signature()
+            self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Force la vérification du fichier au prochain accès
+        """
+        with self.lock:
+            self.checked_at = None
+
+smtp_config_cache = SMTPConfigCache(app.config['SMTP_CONFIG_PATH'], app.config['SMTP_CONFIG_CHECK_INTERVAL'])
+
+def get_smtp_config():
+    """
+    Retourne la configuration SMTP en vigueur, None si elle n'a pas encore été enregistrée
+    """
+    return smtp_config_cache.get()
+
+def save_smtp_config(smtp_config):
+    """
+    Enregistre la configuration SMTP et la rend immédiatement active dans ce worker
+    """
+    smtp_config_cache.save(smtp_config)
@@ -0,0 +1,309 @@
+import os
+import shutil
+import tempfile
+import posixpath
+from stat import S_ISREG
+from . import app
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 absent : seul le stockage sur disque est disponible
+    boto3 = None
+
+# Taille des blocs lus pour produire une plage d'un objet
+READ_BLOCK_SIZE = 1024 * 1024
+
+class StoredObject:
+    """
+    Description d'un objet stocké
+    """
+
+    def __init__(self, key, size, modified):
+        self.key = key
+        self.size = size
+        self.modified = modified
+
+def iter_file_range(path, start, end):
+    """
+    Produit les octets [start, end[ d'un fichier
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise IOError(f"Fichier tronqué : {path}")
+            remaining -= len(block)
+            yield block
+
+class StorageBackend:
+    """
+    Stockage des contenus des transferts. Les objets sont désignés par une
+    clé relative (« blobs/ab/cd/abcd... »), indépendante du support.
+    """
+
+    # Le client peut télécharger directement l'objet via une URL signée
+    presigned_downloads = False
+
+    def put_file(self, key, path):
+        """
+        Range un fichier local sous cette clé. Le fichier local est consommé.
+        """
+        with open(path, 'rb') as stream:
+            self.put_stream(key, stream)
+        os.remove(path)
+
+    def put_stream(self, key, stream):
+        raise NotImplementedError
+
+    def open_range(self, key, start, end):
+        """
+        Produit les octets [start, end[ d'un objet
+        """
+        raise NotImplementedError
+
+    def stat(self, key):
+        """
+        Retourne un StoredObject, None si l'objet n'existe pas
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        return self.stat(key) is not None
+
+    def delete(self, key):
+        """
+        Supprime un objet. Retourne False s'il n'existait pas.
+        """
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        """
+        Parcourt les objets dont la clé commence par prefix
+        """
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """
+        Supprime les objets dont la clé commence par prefix.
+        Retourne le nombre d'objets supprimés.
+        """
+        return sum(self.delete(stored.key) for stored in list(self.list(prefix)))
+
+    def local_path(self, key):
+        """
+        Chemin sur disque de l'objet, None si le support n'est pas un disque local
+        """
+        return None
+
+    def get_download_url(self, key, content_disposition):
+        """
+        URL temporaire de téléchargement direct, None si non disponible
+        """
+        return None
+
+class FilesystemStorage(StorageBackend):
+    """
+    Stockage sur disque local (ou partagé) sous un dossier racine
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def local_path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        # Une clé ne doit jamais sortir du dossier racine
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Clé de stockage invalide : {key}")
+        return path
+
+    def put_file(self, key, path):
+        # Simple renommage : aucune copie sur le même système de fichiers
+        destination = self.local_path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+        # La date sert au ramasse-miettes pour les objets orphelins
+        os.utime(destination)
+
+    def put_stream(self, key, stream):
+        destination = self.local_path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Nom unique, y compris entre threads d'un même processus écrivant la même clé
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(destination) + '.part-', dir=os.path.dirname(destination))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                # Mêmes droits qu'un fichier reçu (mkstemp crée en 0600)
+                os.fchmod(out.fileno(), 0o644)
+                for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b''):
+                    out.write(block)
+            os.replace(temp_path, destination)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open_range(self, key, start, end):
+        return iter_file_range(self.local_path(key), start, end)
+
+    def stat(self, key):
+        try:
+            stat = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, prefix=''):
+        directory = self.local_path(posixpath.dirname(prefix))
+        for dirpath, _, filenames in os.walk(directory):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def delete_prefix(self, prefix):
+        directory = self.local_path(prefix)
+        if not prefix.endswith('/') or not os.path.isdir(directory):
+            return super().delete_prefix(prefix)
+        # Préfixe d'un dossier : le supprimer avec ses sous-dossiers
+        count = sum(len(filenames) for _, _, filenames in os.walk(directory))
+        shutil.rmtree(directory)
+        return count
+
+class S3Storage(StorageBackend):
+    """
+    Stockage objet compatible S3 (AWS, MinIO, Ceph...). Les fichiers sont
+    envoyés en multipart, les parties en parallèle, et les téléchargements
+    peuvent être redirigés vers une URL signée pour ne pas transiter par le worker.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, addressing_style='auto', chunk_size=8 * 1024 * 1024,
+                 concurrency=4, presigned_downloads=True, presign_expires=300):
+        if boto3 is None:
+            raise RuntimeError("Le stockage S3 nécessite le paquet boto3")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET doit être renseigné pour le stockage S3")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.presigned_downloads = presigned_downloads
+        self.presign_expires = presign_expires
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            config=BotoConfig(signature_version='s3v4', s3={'addressing_style': addressing_style})
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunk_size,
+            multipart_chunksize=chunk_size,
+            max_concurrency=concurrency,
+            use_threads=concurrency > 1
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            access_key_id=config['S3_ACCESS_KEY_ID'],
+            secret_access_key=config['S3_SECRET_ACCESS_KEY'],
+            addressing_style=config['S3_ADDRESSING_STYLE'],
+            chunk_size=config['S3_MULTIPART_CHUNK_SIZE'],
+            concurrency=config['S3_UPLOAD_CONCURRENCY'],
+            presigned_downloads=config['S3_PRESIGNED_DOWNLOADS'],
+            presign_expires=config['S3_PRESIGN_EXPIRES']
+        )
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def put_file(self, key, path):
+        # Multipart au-delà de multipart_threshold, parties envoyées en parallèle
+        self.client.upload_file(path, self.bucket, self._key(key), Config=self.transfer_config)
+        os.remove(path)
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._key(key), Config=self.transfer_config)
+
+    def open_range(self, key, start, end):
+        if end <= start:
+            return
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end - 1}")
+        body = response['Body']
+        try:
+            remaining = end - start
+            for block in body.iter_chunks(READ_BLOCK_SIZE):
+                remaining -= len(block)
+                yield block
+            if remaining > 0:
+                raise IOError(f"Objet tronqué : {key}")
+        finally:
+            body.close()
+
+    def stat(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return StoredObject(key, response['ContentLength'], response['LastModified'].timestamp())
+
+    def delete(self, key):
+        # S3 ne signale pas l'absence de l'objet : vérifier avant
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get('Contents', []):
+                yield StoredObject(item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp())
+
+    def get_download_url(self, key, content_disposition):
+        if not self.presigned_downloads:
+            return None
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._key(key), 'ResponseContentDisposition': content_disposition},
+            ExpiresIn=self.presign_expires
+        )
+
+def create_storage(config):
+    """
+    Crée le stockage choisi par STORAGE_BACKEND : 'filesystem' (UPLOAD_FOLDER) ou 's3'
+    """
+    backend = (config['STORAGE_BACKEND'] or 'filesystem').lower()
+    if backend == 's3':
+        app.logger.info(f"Stockage S3 : bucket {config['S3_BUCKET']} ({config['S3_ENDPOINT_URL'] or 'AWS'})")
+        return S3Storage.from_config(config)
+    if backend != 'filesystem':
+        raise RuntimeError(f"STORAGE_BACKEND inconnu : {backend}")
+    return FilesystemStorage(config['UPLOAD_FOLDER'])
+
+storage = create_storage(app.config)
@@ -0,0 +1,104 @@
+import tarfile
+from .zipstream import SegmentLayout
+
+try:
+    import zstandard
+except ImportError:  # zstandard absent : format tar.zst indisponible
+    zstandard = None
+
+# Les en-têtes et les données d'un tar sont alignés sur des blocs de 512 octets
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# Fin d'archive : deux blocs nuls
+END_OF_ARCHIVE = b'\0' * (2 * BLOCK_SIZE)
+
+class TarEntry:
+    """
+    Fichier d'une archive tar : en-tête ustar (étendu en pax pour les noms
+    longs ou non ASCII et les fichiers de plus de 8 Go), données, bourrage
+    """
+
+    def __init__(self, name, size, path, mtime):
+        self.name = name
+        self.size = size
+        self.path = path
+        self.mtime = mtime
+        self.header_offset = None
+        self.data_offset = None
+
+    def header(self):
+        info = tarfile.TarInfo(self.name)
+        info.size = self.size
+        info.mtime = self.mtime
+        info.mode = 0o644
+        info.type = tarfile.REGTYPE
+        return info.tobuf(tarfile.PAX_FORMAT, encoding='utf-8', errors='strict')
+
+    def padding(self):
+        return b'\0' * (-self.size % BLOCK_SIZE)
+
+class TarLayout(SegmentLayout):
+    """
+    Disposition octet par octet d'une archive tar (non compressée) générée
+    à la volée : en-têtes en mémoire, données lues depuis les fichiers
+    sources. La position des données de chaque fichier dans le tar est
+    connue sans rien lire.
+    """
+
+    def __init__(self, entries, open_range=None):
+        super().__init__(open_range)
+        self.entries = list(entries)
+        offset = 0
+        for entry in self.entries:
+            entry.header_offset = offset
+            offset = self._add(offset, entry.header())
+            entry.data_offset = offset
+            offset = self._add(offset, None, entry.size, entry.path)
+            offset = self._add(offset, entry.padding())
+        offset = self._add(offset, END_OF_ARCHIVE)
+        self._finish(offset)
+
+def is_zstd_available():
+    return zstandard is not None
+
+def get_compressor(level, threads):
+    """
+    Compresseur zstd ; avec `threads` > 0, la compression est répartie sur
+    autant de threads internes à zstd (le GIL est libéré)
+    """
+    return zstandard.ZstdCompressor(level=level, threads=threads, write_checksum=True)
+
+def compress_stream(chunks, level, threads):
+    """
+    Compresse un flux d'octets en une trame zstd, au fil de l'eau : chaque
+    bloc compressé est produit dès qu'il est prêt
+    """
+    compressor = get_compressor(level, threads).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def write_compressed(chunks, fileobj, level, threads):
+    """
+    Écrit un flux d'octets compressé en zstd dans `fileobj`
+    """
+    with get_compressor(level, threads).stream_writer(fileobj, closefd=False) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+def iter_decompressed_range(blocks, start, end):
+    """
+    Produit les octets [start, end[ du contenu d'un flux zstd, en
+    décompressant depuis le début et en sautant les octets avant start
+    """
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    position = 0
+    for block in blocks:
+        data = decompressor.decompress(block)
+        if position + len(data) > start and position < end:
+            yield data[max(start - position, 0):end - position]
+        position += len(data)
+        if position >= end:
+            return
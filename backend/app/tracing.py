@@ -0,0 +1,371 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import types
+import cProfile
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from flask import request, jsonify, send_file
+from . import app, log_handler
+
+# Trace en cours (requête ou tâche de fond)
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# Vues tracées et profilables
+TRACED_ENDPOINTS = {'upload_file', 'complete_upload', 'get_transfer_details', 'download_file', 'download_member'}
+
+class TraceLogFilter(logging.Filter):
+    """
+    Ajoute l'identifiant de la trace en cours aux logs de la requête
+    (exécuté dans le thread appelant, avant la mise en file)
+    """
+
+    def filter(self, record):
+        trace = current_trace.get()
+        if trace is not None:
+            record.trace_id = trace.id
+        return True
+
+log_handler.addFilter(TraceLogFilter())
+
+class Span:
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+
+class Trace:
+    """
+    Durées des phases d'une requête ou d'une tâche. Les phases de même nom
+    (un lot de nettoyage, par exemple) sont cumulées dans le résumé.
+    """
+
+    def __init__(self, name, attributes=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes or {}
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.profile_path = None
+        # Trace sans intérêt (passage de nettoyage sans suppression) : ni log ni conservation
+        self.discard = False
+
+    def add_span(self, span):
+        self.spans.append(span)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+        return self.duration
+
+    def summary(self):
+        phases = {}
+        for span in self.spans:
+            phase = phases.setdefault(span.name, {'seconds': 0.0, 'count': 0, 'first_at': round(span.start - self.start, 6)})
+            phase['seconds'] += span.duration
+            phase['count'] += 1
+        for phase in phases.values():
+            phase['seconds'] = round(phase['seconds'], 6)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'seconds': round(self.duration if self.duration is not None else time.perf_counter() - self.start, 6),
+            'attributes': self.attributes,
+            'phases': phases,
+            'profile': os.path.basename(self.profile_path) if self.profile_path else None
+        }
+
+@contextmanager
+def span(name):
+    """
+    Mesure une phase de la trace en cours (sans effet hors d'une trace
+    autre que la mesure elle-même). Retourne le Span, dont `duration` est
+    renseignée à la sortie du bloc.
+    """
+    current = Span(name, time.perf_counter())
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(current)
+
+class StackSampler:
+    """
+    Profilage statistique d'un thread : sa pile est relevée à intervalle
+    régulier par un thread dédié. Le résultat est au format « folded »
+    (une pile par ligne, fonctions séparées par « ; » puis le nombre
+    d'échantillons), lu par flamegraph.pl, speedscope ou inferno.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, path):
+        self.stop_event.set()
+        self.thread.join()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class DeterministicProfiler:
+    """
+    cProfile du thread de la requête, enregistré au format pstats
+    (snakeviz, gprof2dot, flameprof)
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+class TraceStore:
+    """
+    Traces lentes et profils conservés dans TRACE_DIR, partagé par les
+    workers : les plus récents sont gardés, les plus anciens supprimés
+    """
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def profile_path(self, trace, extension):
+        return os.path.join(self.directory, f"{trace.started_at:%Y%m%d%H%M%S}-{trace.id}.{extension}")
+
+    def save(self, trace):
+        path = os.path.join(self.directory, f"{trace.started_at:%Y%m%d%H%M%S}-{trace.id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace.summary(), f)
+        with self.lock:
+            self.prune()
+
+    def prune(self):
+        traces = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in traces[:-self.keep] if len(traces) > self.keep else []:
+            prefix = name[:-len('.json')]
+            for extension in ('.json', '.folded', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, prefix + extension))
+                except FileNotFoundError:
+                    pass
+
+    def recent(self, limit):
+        traces = sorted((name for name in os.listdir(self.directory) if name.endswith('.json')), reverse=True)
+        result = []
+        for name in traces[:limit]:
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                # Supprimée entre-temps par un autre worker
+                continue
+        return result
+
+    def get_profile(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        return path if os.path.isfile(path) and not path.endswith('.json') else None
+
+trace_store = TraceStore(app.config['TRACE_DIR'], app.config['TRACE_KEEP'])
+
+def finish_trace(trace, profiler=None):
+    """
+    Termine une trace : résumé structuré dans les logs, conservation si la
+    durée dépasse TRACE_SLOW_SECONDS ou si elle a été profilée
+    """
+    duration = trace.finish()
+    if profiler is not None:
+        try:
+            profiler.stop(trace.profile_path)
+        except Exception as e:
+            trace.profile_path = None
+            app.logger.error(f"Erreur lors de l'enregistrement du profil {trace.id} : {str(e)}")
+    if not app.config['TRACE_ENABLED'] or trace.discard:
+        return
+    summary = trace.summary()
+    app.logger.info("Trace %s : %.3f s", trace.name, duration, extra={'trace': summary})
+    if duration >= app.config['TRACE_SLOW_SECONDS'] or trace.profile_path:
+        try:
+            trace_store.save(trace)
+        except Exception as e:
+            app.logger.error(f"Erreur lors de l'enregistrement de la trace {trace.id} : {str(e)}")
+
+@contextmanager
+def traced_task(name, **attributes):
+    """
+    Trace une tâche de fond (nettoyage) hors requête
+    """
+    trace = Trace(name, attributes)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        finish_trace(trace)
+
+def is_admin_request():
+    token = app.config['TRACE_ADMIN_TOKEN']
+    if not token:
+        return False
+    # Comparaisons en temps constant : la durée ne révèle rien du jeton
+    expected = token.encode('utf-8')
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    admin_token = request.headers.get('X-Admin-Token', '').encode('utf-8')
+    return hmac.compare_digest(authorization, b'Bearer ' + expected) or hmac.compare_digest(admin_token, expected)
+
+def choose_profiler():
+    """
+    Profileur demandé pour cette requête : en-tête X-Profile (réservé à
+    l'administrateur) ou tirage selon TRACE_PROFILE_SAMPLE_RATE
+    """
+    mode = request.headers.get('X-Profile')
+    if mode and is_admin_request():
+        return mode
+    rate = app.config['TRACE_PROFILE_SAMPLE_RATE']
+    if rate > 0 and int.from_bytes(os.urandom(4), 'big') / 2 ** 32 < rate:
+        return 'sample'
+    return None
+
+@app.before_request
+def start_request_trace():
+    if not app.config['TRACE_ENABLED'] or request.endpoint not in TRACED_ENDPOINTS or request.method == 'OPTIONS':
+        return
+    trace = Trace(request.endpoint, {'method': request.method, 'path': request.path})
+    request.environ['itransfer.trace'] = trace
+    current_trace.set(trace)
+
+    mode = choose_profiler()
+    if mode is None:
+        return
+    if mode == 'cprofile':
+        profiler = DeterministicProfiler()
+        trace.profile_path = trace_store.profile_path(trace, 'prof')
+    else:
+        profiler = StackSampler(threading.get_ident(), app.config['TRACE_PROFILE_INTERVAL'])
+        trace.profile_path = trace_store.profile_path(trace, 'folded')
+    request.environ['itransfer.profiler'] = profiler
+    profiler.start()
+
+def close_after(body, callback):
+    """
+    Relaie un corps produit en flux puis appelle `callback` à sa fermeture
+    """
+    try:
+        yield from body
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+        callback()
+
+@app.after_request
+def end_request_trace(response):
+    trace = request.environ.get('itransfer.trace')
+    if trace is None:
+        return response
+    trace.attributes['status'] = response.status_code
+    profiler = request.environ.get('itransfer.profiler')
+    # Le cProfile ne suit que le thread de la vue : il s'arrête avec elle
+    if isinstance(profiler, DeterministicProfiler):
+        profiler.stop(trace.profile_path)
+        profiler = None
+    view_done = time.perf_counter()
+
+    def on_close():
+        # Envoi du corps : après la vue, jusqu'à la fermeture de la réponse
+        sent = Span('send', view_done)
+        sent.duration = time.perf_counter() - view_done
+        trace.add_span(sent)
+        finish_trace(trace, profiler)
+
+    if not response.direct_passthrough:
+        response.call_on_close(on_close)
+    elif isinstance(response.response, types.GeneratorType):
+        # Réponse produite en flux : Werkzeug ne rappelle pas call_on_close
+        response.response = close_after(response.response, on_close)
+    else:
+        # Fichier envoyé par le serveur (sendfile) : la réponse n'est pas enveloppée
+        finish_trace(trace, profiler)
+    request.environ['itransfer.trace_ended'] = True
+    current_trace.set(None)
+    return response
+
+@app.teardown_request
+def abort_request_trace(error=None):
+    """
+    Termine la trace d'une requête interrompue par une exception non gérée
+    (after_request n'a pas été appelé)
+    """
+    trace = request.environ.get('itransfer.trace')
+    if trace is None or request.environ.get('itransfer.trace_ended'):
+        return
+    request.environ['itransfer.trace_ended'] = True
+    trace.attributes['status'] = 500
+    current_trace.set(None)
+    finish_trace(trace, request.environ.get('itransfer.profiler'))
+
+def require_admin():
+    if not app.config['TRACE_ADMIN_TOKEN']:
+        return jsonify({'error': 'TRACE_ADMIN_TOKEN non configuré'}), 404
+    if not is_admin_request():
+        return jsonify({'error': 'Accès refusé'}), 403
+    return None
+
+@app.route('/api/admin/traces', methods=['GET'])
+def get_slow_traces():
+    """
+    Traces lentes ou profilées les plus récentes (tous workers)
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    limit = min(request.args.get('limit', 50, type=int), app.config['TRACE_KEEP'])
+    return jsonify({'traces': trace_store.recent(limit)}), 200
+
+@app.route('/api/admin/traces/profiles/<name>', methods=['GET'])
+def get_trace_profile(name):
+    """
+    Profil d'une trace : .folded (flamegraph) ou .prof (pstats)
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    path = trace_store.get_profile(name)
+    if path is None:
+        return jsonify({'error': 'Profil non trouvé'}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
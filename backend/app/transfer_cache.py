@@ -0,0 +1,345 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from . import app
+from .models import FileUpload, TransferArchive
+from .archives import get_stored_key, get_member_source, is_transfer_stored, get_archive_members, build_archive_layout
+from .storage import storage
+
+try:
+    import redis
+except ImportError:  # redis absent : cache local au processus uniquement
+    redis = None
+
+# Préfixe des clés dans le cache partagé
+SHARED_KEY_PREFIX = 'itransfer:transfer:'
+
+class CachedArchive:
+    """
+    Copie détachée d'une TransferArchive, utilisable hors de la session SQLAlchemy
+    """
+
+    def __init__(self, file_id, mode, archive_format, content_length, manifest, date_time):
+        self.file_id = file_id
+        self.mode = mode
+        self.archive_format = archive_format
+        self.content_length = content_length
+        self.manifest = manifest
+        self.date_time = date_time
+
+    @classmethod
+    def from_model(cls, archive):
+        return cls(archive.file_id, archive.mode, archive.archive_format, archive.content_length,
+                   archive.get_manifest(), archive.date_time)
+
+    def get_manifest(self):
+        return self.manifest
+
+    def to_dict(self):
+        return {
+            'file_id': self.file_id,
+            'mode': self.mode,
+            'archive_format': self.archive_format,
+            'content_length': self.content_length,
+            'manifest': self.manifest,
+            'date_time': self.date_time.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['file_id'], data['mode'], data['archive_format'], data['content_length'],
+                   data['manifest'], datetime.fromisoformat(data['date_time']))
+
+class CachedTransfer:
+    """
+    Métadonnées d'un transfert nécessaires à la page de téléchargement et à
+    l'autorisation des téléchargements : champs du FileUpload, archive,
+    fichiers, présence dans le stockage et clé du fichier final.
+    S'utilise à la place du FileUpload dans les fonctions d'archives.
+    """
+
+    FIELDS = ('id', 'filename', 'sender_email', 'encrypted_data', 'downloaded', 'expires_at',
+              'files_list', 'members', 'stored', 'stored_key', 'size')
+
+    def __init__(self, id, filename, sender_email, encrypted_data, downloaded, expires_at,
+                 files_list, members, stored, stored_key, size, archive=None):
+        self.id = id
+        self.filename = filename
+        self.sender_email = sender_email
+        self.encrypted_data = encrypted_data
+        self.downloaded = downloaded
+        self.expires_at = expires_at
+        self.files_list = files_list
+        self.members = members
+        self.stored = stored
+        self.stored_key = stored_key
+        self.size = size
+        self.archive = archive
+        self._members_by_name = None
+        self._layout = None
+
+    def get_files_list(self):
+        return self.files_list
+
+    @property
+    def streamed(self):
+        return self.archive is not None and self.archive.mode == 'streamed'
+
+    def is_expired(self, now=None):
+        return (now or datetime.now()) > self.expires_at
+
+    def find_member(self, name):
+        """
+        Fichier du transfert désigné par son chemin, None s'il n'en fait pas partie
+        """
+        if self._members_by_name is None:
+            self._members_by_name = {member['name']: member for member in self.members}
+        return self._members_by_name.get(name)
+
+    def get_member_key(self, member):
+        """
+        Clé de stockage du fichier s'il est stocké seul, None s'il se trouve
+        dans l'archive (voir archives.get_member_file)
+        """
+        if self.streamed:
+            return get_member_source(self.id, member)
+        if 'data_offset' not in member:
+            return self.stored_key
+        return None
+
+    @property
+    def archive_format(self):
+        return self.archive.archive_format if self.archive is not None else None
+
+    def get_archive_layout(self):
+        """
+        Disposition de l'archive générée à la volée (ZIP ou tar avant
+        compression), calculée une seule fois (les clés des fichiers sont
+        résolues dans le stockage à ce moment)
+        """
+        if self._layout is None:
+            self._layout = build_archive_layout(self.archive)
+        return self._layout
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data['expires_at'] = self.expires_at.isoformat()
+        data['archive'] = self.archive.to_dict() if self.archive is not None else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        values = {field: data[field] for field in cls.FIELDS}
+        values['expires_at'] = datetime.fromisoformat(data['expires_at'])
+        archive = CachedArchive.from_dict(data['archive']) if data['archive'] else None
+        return cls(archive=archive, **values)
+
+def load_transfer(file_id):
+    """
+    Lit les métadonnées d'un transfert en base et dans le stockage.
+    Retourne un CachedTransfer, None si le transfert n'existe pas.
+    """
+    file_info = FileUpload.query.get(file_id)
+    if file_info is None:
+        return None
+    archive = TransferArchive.query.get(file_id)
+
+    stored_key = None
+    size = None
+    if archive is not None and archive.mode == 'streamed':
+        stored = is_transfer_stored(file_info, archive)
+    else:
+        stored_key = get_stored_key(file_info, archive)
+        stat = storage.stat(stored_key)
+        stored = stat is not None
+        size = stat.size if stored else None
+
+    members = []
+    if stored:
+        try:
+            members = get_archive_members(file_info, archive)
+        except Exception as e:
+            app.logger.warning(f"Index de l'archive indisponible pour {file_id} : {str(e)}")
+        # L'indexation d'un ancien ZIP crée son archive
+        if archive is None:
+            archive = TransferArchive.query.get(file_id)
+
+    return CachedTransfer(
+        file_info.id, file_info.filename, file_info.sender_email, file_info.encrypted_data,
+        bool(file_info.downloaded), file_info.expires_at, file_info.get_files_list(), members,
+        stored, stored_key, size, CachedArchive.from_model(archive) if archive is not None else None
+    )
+
+class TransferMetadataCache:
+    """
+    Cache en lecture des métadonnées des transferts : LRU en mémoire avec
+    durée de vie (ttl), éventuellement adossé à un cache partagé (Redis)
+    entre les workers. Une entrée absente est lue en base et dans le
+    stockage, puis gardée pour les requêtes suivantes : la page de
+    téléchargement puis le téléchargement ne coûtent qu'une lecture.
+    Un transfert expiré n'est jamais servi : sa date d'expiration fait
+    partie de l'entrée.
+    """
+
+    def __init__(self, max_size=1024, ttl=60, shared_url=None, shared_ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.shared = None
+        if shared_url:
+            if redis is None:
+                app.logger.warning("TRANSFER_CACHE_REDIS_URL ignoré : le paquet redis n'est pas installé")
+            else:
+                self.shared = redis.Redis.from_url(shared_url)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_size=config['TRANSFER_CACHE_SIZE'],
+            ttl=config['TRANSFER_CACHE_TTL'],
+            shared_url=config['TRANSFER_CACHE_REDIS_URL'],
+            shared_ttl=config['TRANSFER_CACHE_SHARED_TTL']
+        )
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def _get_local(self, file_id, now):
+        with self.lock:
+            entry = self.entries.get(file_id)
+            if entry is None:
+                return None
+            transfer, cached_at = entry
+            if now - cached_at > self.ttl:
+                del self.entries[file_id]
+                return None
+            self.entries.move_to_end(file_id)
+            return transfer
+
+    def _put_local(self, transfer, now):
+        with self.lock:
+            self.entries[transfer.id] = (transfer, now)
+            self.entries.move_to_end(transfer.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _get_shared(self, file_id):
+        if self.shared is None:
+            return None
+        try:
+            data = self.shared.get(SHARED_KEY_PREFIX + file_id)
+            return CachedTransfer.from_dict(json.loads(data)) if data else None
+        except Exception as e:
+            # Cache partagé indisponible : lecture en base
+            self._count_error(e)
+            return None
+
+    def _put_shared(self, transfer):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(SHARED_KEY_PREFIX + transfer.id, json.dumps(transfer.to_dict()), ex=self.shared_ttl)
+        except Exception as e:
+            self._count_error(e)
+
+    def _count_error(self, error):
+        with self.lock:
+            self.errors += 1
+        app.logger.warning(f"Cache partagé des transferts indisponible : {str(error)}")
+
+    def get(self, file_id):
+        """
+        Retourne le CachedTransfer d'un transfert, None s'il n'existe pas
+        """
+        if not self.enabled:
+            return load_transfer(file_id)
+        now = time.monotonic()
+        transfer = self._get_local(file_id, now)
+        if transfer is not None:
+            with self.lock:
+                self.hits += 1
+            return transfer
+
+        transfer = self._get_shared(file_id)
+        if transfer is not None:
+            with self.lock:
+                self.shared_hits += 1
+        else:
+            with self.lock:
+                self.misses += 1
+            transfer = load_transfer(file_id)
+            if transfer is None:
+                return None
+            # Un transfert dont le contenu manque n'est pas gardé : il peut réapparaître
+            if transfer.stored:
+                self._put_shared(transfer)
+        if transfer.stored:
+            self._put_local(transfer, now)
+        return transfer
+
+    def mark_downloaded(self, file_id):
+        """
+        Met à jour l'entrée après le premier téléchargement
+        """
+        with self.lock:
+            entry = self.entries.get(file_id)
+            if entry is not None:
+                entry[0].downloaded = True
+                transfer = entry[0]
+            else:
+                transfer = None
+        if transfer is not None:
+            self._put_shared(transfer)
+        elif self.shared is not None:
+            self.invalidate(file_id)
+
+    def invalidate(self, file_id):
+        """
+        Retire un transfert du cache (suppression, modification)
+        """
+        with self.lock:
+            self.entries.pop(file_id, None)
+            self.invalidations += 1
+        if self.shared is not None:
+            try:
+                self.shared.delete(SHARED_KEY_PREFIX + file_id)
+            except Exception as e:
+                self._count_error(e)
+
+    def as_dict(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'shared': self.shared is not None,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+                'hit_ratio': round((self.hits + self.shared_hits) / lookups, 3) if lookups else None
+            }
+
+transfer_cache = TransferMetadataCache.from_config(app.config)
+
+def get_transfer(file_id):
+    """
+    Métadonnées d'un transfert, lues dans le cache si possible
+    """
+    return transfer_cache.get(file_id)
+
+def get_transfer_cache_stats():
+    """
+    Retourne les statistiques du cache des transferts du processus
+    """
+    return transfer_cache.as_dict()
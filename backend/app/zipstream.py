@@ -0,0 +1,234 @@
+import struct
+import zipfile
+from bisect import bisect_right
+
+# Au-delà de ces valeurs, les champs ZIP classiques débordent et ZIP64 est nécessaire
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# Valeurs écrites dans un champ classique dont la vraie valeur est dans l'extra ZIP64
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+# Taille des blocs lus depuis les fichiers sources
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Attributs externes : fichier ordinaire 0644 (créé sous Unix)
+EXTERNAL_ATTR = 0o100644 << 16
+MADE_BY_UNIX = 3 << 8
+# Bit 11 : noms encodés en UTF-8
+FLAG_UTF8 = 0x0800
+
+def dos_date_time(date_time):
+    """
+    Convertit un tuple (année, mois, jour, heure, minute, seconde) au format MS-DOS
+    """
+    year, month, day, hour, minute, second = date_time[:6]
+    year = max(year, 1980)
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_date, dos_time
+
+class ZipEntry:
+    """
+    Fichier d'une archive ZIP dont la taille et le CRC sont connus à l'avance.
+    `path` désigne les données telles qu'elles seront écrites dans l'archive
+    (brutes pour STORED, déjà compressées pour DEFLATED).
+    """
+
+    def __init__(self, name, size, crc32, path, date_time, compress_type=zipfile.ZIP_STORED, compressed_size=None):
+        self.name = name
+        self.size = size
+        self.crc32 = crc32
+        self.path = path
+        self.date_time = date_time
+        self.compress_type = compress_type
+        self.compressed_size = size if compressed_size is None else compressed_size
+        self.header_offset = None
+        self.data_offset = None
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT or self.compressed_size >= ZIP64_LIMIT
+
+    def local_header(self):
+        name = self.name.encode('utf-8')
+        dos_date, dos_time = dos_date_time(self.date_time)
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, self.size, self.compressed_size)
+            sizes = (ZIP64_MARKER, ZIP64_MARKER)
+            version = 45
+        else:
+            extra = b''
+            sizes = (self.compressed_size, self.size)
+            version = 20
+        return struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50, version, FLAG_UTF8, self.compress_type, dos_time, dos_date,
+            self.crc32, sizes[0], sizes[1], len(name), len(extra)
+        ) + name + extra
+
+    def central_header(self):
+        name = self.name.encode('utf-8')
+        dos_date, dos_time = dos_date_time(self.date_time)
+        # Seuls les champs qui débordent sont reportés dans l'extra ZIP64
+        zip64_fields = []
+        size, compressed_size, offset = self.size, self.compressed_size, self.header_offset
+        if size >= ZIP64_LIMIT:
+            zip64_fields.append(size)
+            size = ZIP64_MARKER
+        if compressed_size >= ZIP64_LIMIT:
+            zip64_fields.append(compressed_size)
+            compressed_size = ZIP64_MARKER
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = ZIP64_MARKER
+        extra = b''
+        if zip64_fields:
+            extra = struct.pack('<HH', 0x0001, 8 * len(zip64_fields)) + struct.pack(f"<{len(zip64_fields)}Q", *zip64_fields)
+        version = 45 if (zip64_fields or self.zip64) else 20
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014b50, MADE_BY_UNIX | version, version, FLAG_UTF8, self.compress_type,
+            dos_time, dos_date, self.crc32, compressed_size, size,
+            len(name), len(extra), 0, 0, 0, EXTERNAL_ATTR, offset
+        ) + name + extra
+
+def end_of_central_directory(count, cd_offset, cd_size):
+    """
+    Construit la fin de l'archive, avec les enregistrements ZIP64 si nécessaire
+    """
+    records = b''
+    if count >= ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        records += struct.pack(
+            '<IQHHIIQQQQ',
+            0x06064b50, 44, MADE_BY_UNIX | 45, 45, 0, 0, count, count, cd_size, cd_offset
+        )
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+        count = ZIP64_COUNT_MARKER if count >= ZIP64_COUNT_LIMIT else count
+        cd_offset = ZIP64_MARKER if cd_offset >= ZIP64_LIMIT else cd_offset
+        cd_size = ZIP64_MARKER if cd_size >= ZIP64_LIMIT else cd_size
+    records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+    return records
+
+def iter_local_range(path, start, end):
+    """
+    Produit les octets [start, end[ d'un fichier source local
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise IOError(f"Fichier source tronqué : {path}")
+            remaining -= len(block)
+            yield block
+
+class SegmentLayout:
+    """
+    Contenu produit à la volée, décrit comme une suite de segments : octets
+    en mémoire (en-têtes) ou plage d'un fichier source. N'importe quelle
+    plage d'octets peut être produite sans produire ce qui la précède.
+    `open_range(path, start, end)` lit les données d'un segment ; par défaut
+    `path` est un fichier local.
+    """
+
+    def __init__(self, open_range=None):
+        self.open_range = open_range or iter_local_range
+        # Segments : (début, longueur, données en mémoire ou None, chemin source)
+        self.segments = []
+        self.content_length = 0
+        self.starts = []
+
+    def _add(self, offset, data, length=None, path=None):
+        length = len(data) if data is not None else length
+        if length:
+            self.segments.append((offset, length, data, path))
+        return offset + length
+
+    def _finish(self, offset):
+        self.content_length = offset
+        self.starts = [segment[0] for segment in self.segments]
+
+    def iter_range(self, start=0, end=None):
+        """
+        Produit les octets du contenu dans l'intervalle [start, end[
+        """
+        if end is None or end > self.content_length:
+            end = self.content_length
+        index = max(bisect_right(self.starts, start) - 1, 0)
+        position = start
+        while position < end and index < len(self.segments):
+            seg_start, seg_length, data, path = self.segments[index]
+            seg_end = min(seg_start + seg_length, end)
+            if data is not None:
+                yield data[position - seg_start:seg_end - seg_start]
+            else:
+                yield from self.open_range(path, position - seg_start, seg_end - seg_start)
+            position = seg_end
+            index += 1
+
+    def __iter__(self):
+        return self.iter_range(0, self.content_length)
+
+class ZipLayout(SegmentLayout):
+    """
+    Disposition octet par octet d'une archive ZIP générée à la volée.
+    Comme toutes les tailles et tous les CRC sont connus, la longueur totale
+    est calculée sans rien lire et n'importe quelle plage d'octets peut être
+    produite indépendamment (reprise de téléchargement, requêtes Range).
+    """
+
+    def __init__(self, entries, open_range=None):
+        super().__init__(open_range)
+        self.entries = list(entries)
+        offset = 0
+        for entry in self.entries:
+            entry.header_offset = offset
+            header = entry.local_header()
+            offset = self._add(offset, header)
+            entry.data_offset = offset
+            offset = self._add(offset, None, entry.compressed_size, entry.path)
+
+        cd_offset = offset
+        central_directory = b''.join(entry.central_header() for entry in self.entries)
+        offset = self._add(offset, central_directory)
+        offset = self._add(offset, end_of_central_directory(len(self.entries), cd_offset, len(central_directory)))
+        self._finish(offset)
+
+class ZipStreamWriter:
+    """
+    Écrit séquentiellement une archive ZIP dont chaque entrée est déjà prête
+    (données brutes ou compressées, taille et CRC connus). Les entrées sont
+    ajoutées dans l'ordre, le répertoire central est écrit à la fermeture.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.entries = []
+        self.offset = 0
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add(self, entry):
+        entry.header_offset = self.offset
+        self._write(entry.local_header())
+        entry.data_offset = self.offset
+        remaining = entry.compressed_size
+        with open(entry.path, 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError(f"Fichier source tronqué : {entry.path}")
+                remaining -= len(block)
+                self._write(block)
+        self.entries.append(entry)
+
+    def close(self):
+        cd_offset = self.offset
+        central_directory = b''.join(entry.central_header() for entry in self.entries)
+        self._write(central_directory)
+        self._write(end_of_central_directory(len(self.entries), cd_offset, len(central_directory)))
@@ -0,0 +1,77 @@
+"""
+Serveur SMTP local qui accepte et compte les emails sans les envoyer.
+Utilisé par bench.py, ou seul : python benchmarks/smtp_sink.py --port 2525
+"""
+import argparse
+import threading
+import socketserver
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """
+    Dialogue SMTP minimal : EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self.reply('220 smtp-sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('latin-1').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b'250-smtp-sink\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                self.server.record(size)
+                self.reply('250 OK: queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+
+    def record(self, size):
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    args = parser.parse_args()
+    with SMTPSink((args.host, args.port)) as sink:
+        print(f"SMTP sink sur {args.host}:{args.port}")
+        sink.serve_forever()
@@ -1,7 +1,20 @@
 #!/bin/bash
 
 # Exécuter les migrations
+[ -n "$PROMETHEUS_MULTIPROC_DIR" ] && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 flask db upgrade
 
+# Métriques partagées entre les workers : repartir d'un dossier vide (sans celles de la migration)
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+# Mode asynchrone : serveur ASGI (uvicorn), un processus sert de nombreux transferts lents
+if [ "${SERVER_MODE:-sync}" = "async" ]; then
+    exec uvicorn app.asgi:asgi_app --host 0.0.0.0 --port 5000 --workers "${SERVER_WORKERS:-4}" \
+        --proxy-headers --forwarded-allow-ips "*" --no-server-header
+fi
+
 # Lancer l'application
 exec "$@"
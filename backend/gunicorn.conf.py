@@ -0,0 +1,14 @@
+# Configuration Gunicorn chargée automatiquement depuis le répertoire de travail (/app)
+import os
+
+def child_exit(server, worker):
+    """
+    Retire les métriques des jauges d'un worker arrêté (mode multiprocessus de prometheus_client)
+    """
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
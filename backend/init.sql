@@ -7,5 +7,94 @@ CREATE TABLE IF NOT EXISTS file_upload (
     downloaded BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     expires_at TIMESTAMP NOT NULL,
-    files_list TEXT -- Stocke la liste des fichiers en JSON
+    files_list TEXT, -- Stocke la liste des fichiers en JSON
+    INDEX ix_file_upload_expires_at (expires_at),
+    INDEX ix_file_upload_email (email),
+    INDEX ix_file_upload_sender_email (sender_email),
+    INDEX ix_file_upload_downloaded (downloaded)
+);
+
+CREATE TABLE IF NOT EXISTS transfer_member (
+    file_id VARCHAR(36) NOT NULL,
+    position INTEGER NOT NULL, -- Ordre dans l'archive
+    path VARCHAR(512) NOT NULL,
+    size BIGINT NOT NULL,
+    sha256 VARCHAR(64),
+    crc32 BIGINT,
+    compress_type SMALLINT, -- Position dans le ZIP stocké (absente si le fichier est stocké seul)
+    compressed_size BIGINT,
+    data_offset BIGINT,
+    PRIMARY KEY (file_id, position),
+    FOREIGN KEY (file_id) REFERENCES file_upload(id) ON DELETE CASCADE,
+    INDEX ix_transfer_member_path (file_id, path)
+);
+
+CREATE TABLE IF NOT EXISTS upload_session (
+    id VARCHAR(36) PRIMARY KEY,
+    email VARCHAR(256) NOT NULL,
+    sender_email VARCHAR(256) NOT NULL,
+    expiration_days INTEGER NOT NULL DEFAULT 7,
+    chunk_size INTEGER NOT NULL,
+    files_list TEXT, -- Liste déclarée par le client en JSON
+    members TEXT NOT NULL, -- Fichiers attendus en JSON
+    status VARCHAR(16) NOT NULL DEFAULT 'open',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS upload_chunk (
+    session_id VARCHAR(36) NOT NULL,
+    member_index INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    size BIGINT NOT NULL,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, member_index, chunk_index),
+    FOREIGN KEY (session_id) REFERENCES upload_session(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS transfer_archive (
+    file_id VARCHAR(36) PRIMARY KEY,
+    mode VARCHAR(16) NOT NULL DEFAULT 'streamed',
+    archive_format VARCHAR(16) NOT NULL DEFAULT 'zip',
+    content_length BIGINT NOT NULL,
+    manifest TEXT NOT NULL, -- Fichiers de l'archive en JSON
+    date_time DATETIME NOT NULL,
+    FOREIGN KEY (file_id) REFERENCES file_upload(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    recipient VARCHAR(256) NOT NULL,
+    subject VARCHAR(512),
+    message MEDIUMTEXT NOT NULL, -- Message MIME complet
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at DATETIME,
+    INDEX idx_email_outbox_due (status, next_attempt_at)
+);
+
+CREATE TABLE IF NOT EXISTS blob (
+    sha256 VARCHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0, -- Nombre de transferts qui l'utilisent
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_blob_refcount (refcount)
+);
+
+CREATE TABLE IF NOT EXISTS transfer_blob (
+    file_id VARCHAR(36) NOT NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    PRIMARY KEY (file_id, sha256),
+    FOREIGN KEY (file_id) REFERENCES file_upload(id),
+    FOREIGN KEY (sha256) REFERENCES blob(sha256),
+    INDEX idx_transfer_blob_sha256 (sha256)
+);
+
+CREATE TABLE IF NOT EXISTS maintenance_lease (
+    name VARCHAR(64) PRIMARY KEY,
+    holder VARCHAR(128), -- Worker leader (hôte:pid:jeton)
+    expires_at DATETIME NOT NULL
 );
@@ -0,0 +1,125 @@
+"""Schéma initial (tables créées jusqu'ici par init.sql et db.create_all)
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-16 22:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def has_index(inspector, table, name):
+    return any(index['name'] == name for index in inspector.get_indexes(table))
+
+
+def upgrade():
+    # Les bases existantes ont déjà ces tables : seules les manquantes sont créées
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if 'file_upload' not in tables:
+        op.create_table(
+            'file_upload',
+            sa.Column('id', sa.String(36), primary_key=True),
+            sa.Column('filename', sa.String(256), nullable=False),
+            sa.Column('email', sa.String(256), nullable=False),
+            sa.Column('sender_email', sa.String(256), nullable=False),
+            sa.Column('encrypted_data', sa.String(256), nullable=False),
+            sa.Column('downloaded', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.Column('files_list', sa.Text(), nullable=True)
+        )
+    if not has_index(inspector, 'file_upload', 'ix_file_upload_expires_at'):
+        op.create_index('ix_file_upload_expires_at', 'file_upload', ['expires_at'])
+
+    if 'upload_session' not in tables:
+        op.create_table(
+            'upload_session',
+            sa.Column('id', sa.String(36), primary_key=True),
+            sa.Column('email', sa.String(256), nullable=False),
+            sa.Column('sender_email', sa.String(256), nullable=False),
+            sa.Column('expiration_days', sa.Integer(), nullable=False, server_default='7'),
+            sa.Column('chunk_size', sa.Integer(), nullable=False),
+            sa.Column('files_list', sa.Text(), nullable=True),
+            sa.Column('members', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(16), nullable=False, server_default='open'),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True)
+        )
+
+    if 'upload_chunk' not in tables:
+        op.create_table(
+            'upload_chunk',
+            sa.Column('session_id', sa.String(36), sa.ForeignKey('upload_session.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('member_index', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('chunk_index', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('received_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True)
+        )
+
+    if 'transfer_archive' not in tables:
+        op.create_table(
+            'transfer_archive',
+            sa.Column('file_id', sa.String(36), sa.ForeignKey('file_upload.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('mode', sa.String(16), nullable=False, server_default='streamed'),
+            sa.Column('archive_format', sa.String(16), nullable=False, server_default='zip'),
+            sa.Column('content_length', sa.BigInteger(), nullable=False),
+            sa.Column('manifest', sa.Text(), nullable=False),
+            sa.Column('date_time', sa.DateTime(), nullable=False)
+        )
+
+    if 'email_outbox' not in tables:
+        op.create_table(
+            'email_outbox',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('recipient', sa.String(256), nullable=False),
+            sa.Column('subject', sa.String(512), nullable=True),
+            sa.Column('message', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(16), nullable=False, server_default='pending'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True),
+            sa.Column('sent_at', sa.DateTime(), nullable=True)
+        )
+        op.create_index('idx_email_outbox_due', 'email_outbox', ['status', 'next_attempt_at'])
+
+    if 'blob' not in tables:
+        op.create_table(
+            'blob',
+            sa.Column('sha256', sa.String(64), primary_key=True),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('refcount', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True)
+        )
+        op.create_index('idx_blob_refcount', 'blob', ['refcount'])
+
+    if 'transfer_blob' not in tables:
+        op.create_table(
+            'transfer_blob',
+            sa.Column('file_id', sa.String(36), sa.ForeignKey('file_upload.id'), primary_key=True),
+            sa.Column('sha256', sa.String(64), sa.ForeignKey('blob.sha256'), primary_key=True)
+        )
+        op.create_index('idx_transfer_blob_sha256', 'transfer_blob', ['sha256'])
+
+    if 'maintenance_lease' not in tables:
+        op.create_table(
+            'maintenance_lease',
+            sa.Column('name', sa.String(64), primary_key=True),
+            sa.Column('holder', sa.String(128), nullable=True),
+            sa.Column('expires_at', sa.DateTime(), nullable=False)
+        )
+
+
+def downgrade():
+    # Le schéma initial n'est pas supprimé : les données des transferts y sont stockées
+    pass
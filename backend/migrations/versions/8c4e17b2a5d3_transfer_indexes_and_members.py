@@ -0,0 +1,145 @@
+"""Index des transferts et table transfer_member (fichiers d'un transfert)
+
+Revision ID: 8c4e17b2a5d3
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-16 22:40:00.000000
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e17b2a5d3'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+# Transferts relus par lot lors du remplissage de transfer_member
+BACKFILL_BATCH_SIZE = 500
+
+FILE_UPLOAD_INDEXES = {
+    'ix_file_upload_email': ['email'],
+    'ix_file_upload_sender_email': ['sender_email'],
+    'ix_file_upload_downloaded': ['downloaded'],
+}
+
+# Champs du manifeste reportés dans transfer_member s'ils sont présents
+OPTIONAL_FIELDS = ('sha256', 'crc32', 'compress_type', 'compressed_size', 'data_offset')
+
+file_upload = sa.table(
+    'file_upload',
+    sa.column('id', sa.String),
+    sa.column('filename', sa.String),
+    sa.column('encrypted_data', sa.String),
+    sa.column('files_list', sa.Text)
+)
+transfer_archive = sa.table(
+    'transfer_archive',
+    sa.column('file_id', sa.String),
+    sa.column('manifest', sa.Text)
+)
+
+
+def has_index(inspector, table, name):
+    return any(index['name'] == name for index in inspector.get_indexes(table))
+
+
+def get_members(filename, encrypted_data, files_list, manifest):
+    """
+    Fichiers d'un transfert existant : le manifeste de son archive, ou le
+    fichier unique décrit par files_list. Un ZIP construit avant l'index n'a
+    pas de manifeste : il est indexé au premier accès.
+    """
+    if manifest:
+        return json.loads(manifest)
+    files = json.loads(files_list) if files_list else []
+    if len(files) == 1 and files[0]['name'] == filename:
+        return [{'name': filename, 'size': files[0]['size'], 'sha256': encrypted_data}]
+    return []
+
+
+def backfill_members(bind, transfer_member):
+    """
+    Remplit transfer_member pour les transferts existants, par lots ordonnés
+    sur la clé primaire (aucun transfert n'est chargé en entier en mémoire)
+    """
+    last_id = ''
+    while True:
+        rows = bind.execute(
+            sa.select(file_upload.c.id, file_upload.c.filename, file_upload.c.encrypted_data,
+                      file_upload.c.files_list, transfer_archive.c.manifest)
+            .select_from(file_upload.outerjoin(transfer_archive, transfer_archive.c.file_id == file_upload.c.id))
+            .where(file_upload.c.id > last_id)
+            .order_by(file_upload.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+
+        file_ids = [row.id for row in rows]
+        done = {
+            file_id for (file_id,) in bind.execute(
+                sa.select(transfer_member.c.file_id).where(transfer_member.c.file_id.in_(file_ids)).distinct()
+            )
+        }
+        members = []
+        for row in rows:
+            if row.id in done:
+                continue
+            for position, member in enumerate(get_members(row.filename, row.encrypted_data, row.files_list, row.manifest)):
+                members.append({
+                    'file_id': row.id,
+                    'position': position,
+                    'path': member['name'],
+                    'size': member['size'],
+                    **{field: member.get(field) for field in OPTIONAL_FIELDS}
+                })
+        if members:
+            op.bulk_insert(transfer_member, members)
+        last_id = file_ids[-1]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Recherches par destinataire, expéditeur et état de téléchargement
+    for name, columns in FILE_UPLOAD_INDEXES.items():
+        if not has_index(inspector, 'file_upload', name):
+            op.create_index(name, 'file_upload', columns)
+
+    # La table peut déjà avoir été créée par db.create_all au démarrage des versions précédentes de l'application
+    if 'transfer_member' not in inspector.get_table_names():
+        op.create_table(
+            'transfer_member',
+            sa.Column('file_id', sa.String(36), sa.ForeignKey('file_upload.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('position', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('path', sa.String(512), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('sha256', sa.String(64), nullable=True),
+            sa.Column('crc32', sa.BigInteger(), nullable=True),
+            sa.Column('compress_type', sa.SmallInteger(), nullable=True),
+            sa.Column('compressed_size', sa.BigInteger(), nullable=True),
+            sa.Column('data_offset', sa.BigInteger(), nullable=True)
+        )
+    if not has_index(sa.inspect(bind), 'transfer_member', 'ix_transfer_member_path'):
+        op.create_index('ix_transfer_member_path', 'transfer_member', ['file_id', 'path'])
+
+    transfer_member = sa.table(
+        'transfer_member',
+        sa.column('file_id', sa.String),
+        sa.column('position', sa.Integer),
+        sa.column('path', sa.String),
+        sa.column('size', sa.BigInteger),
+        *(sa.column(field) for field in OPTIONAL_FIELDS)
+    )
+    backfill_members(bind, transfer_member)
+
+
+def downgrade():
+    op.drop_index('ix_transfer_member_path', table_name='transfer_member')
+    op.drop_table('transfer_member')
+    for name in FILE_UPLOAD_INDEXES:
+        op.drop_index(name, table_name='file_upload')
@@ -0,0 +1,27 @@
+"""Format d'archive demandé par l'expéditeur d'un upload par morceaux
+
+Revision ID: b7d2f4e9a1c6
+Revises: 8c4e17b2a5d3
+Create Date: 2026-10-16 23:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f4e9a1c6'
+down_revision = '8c4e17b2a5d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La colonne peut déjà avoir été créée par db.create_all au démarrage des versions précédentes de l'application
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('upload_session')}
+    if 'archive_format' not in columns:
+        op.add_column('upload_session', sa.Column('archive_format', sa.String(16), nullable=True))
+
+
+def downgrade():
+    op.drop_column('upload_session', 'archive_format')
@@ -0,0 +1,31 @@
+"""Empreinte du contenu des archives construites à l'upload
+
+Revision ID: d41c8e6f2b97
+Revises: b7d2f4e9a1c6
+Create Date: 2026-10-17 00:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c8e6f2b97'
+down_revision = 'b7d2f4e9a1c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # La colonne peut déjà avoir été créée par db.create_all au démarrage des versions précédentes de l'application
+    columns = {column['name'] for column in inspector.get_columns('transfer_archive')}
+    if 'content_key' not in columns:
+        op.add_column('transfer_archive', sa.Column('content_key', sa.String(64), nullable=True))
+    if not any(index['name'] == 'ix_transfer_archive_content_key' for index in inspector.get_indexes('transfer_archive')):
+        op.create_index('ix_transfer_archive_content_key', 'transfer_archive', ['content_key'])
+
+
+def downgrade():
+    op.drop_index('ix_transfer_archive_content_key', table_name='transfer_archive')
+    op.drop_column('transfer_archive', 'content_key')
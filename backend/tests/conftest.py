@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+import json
+import tempfile
+import pytest
+
+# La configuration est lue à l'import de l'application : environnement de test d'abord
+TEST_ROOT = tempfile.mkdtemp(prefix='itransfer-tests-')
+os.environ.update(
+    UPLOAD_FOLDER=os.path.join(TEST_ROOT, 'uploads'),
+    DATABASE_URL='sqlite:///' + os.path.join(TEST_ROOT, 'itransfer.db'),
+    SMTP_CONFIG_PATH=os.path.join(TEST_ROOT, 'smtp_config.json'),
+    TRACE_DIR=os.path.join(TEST_ROOT, 'traces'),
+    BANDWIDTH_STATE_PATH=os.path.join(TEST_ROOT, 'bandwidth'),
+    OUTBOX_SENDER_ENABLED='false',
+    CLEANUP_ENABLED='false',
+    TIMEZONE='Europe/Paris'
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+from flask_migrate import upgrade  # noqa: E402
+
+# Schéma créé par les migrations, comme en production (entrypoint.sh)
+with flask_app.app_context():
+    upgrade()
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def upload_form(files, **fields):
+    """
+    Formulaire d'upload pour une liste de (chemin, contenu)
+    """
+    data = {
+        'email': 'destinataire@example.com',
+        'sender_email': 'expediteur@example.com',
+        'expiration_days': '3',
+        'files_list': json.dumps([{'name': path, 'size': len(content)} for path, content in files]),
+        'files[]': [(io.BytesIO(content), path.split('/')[-1]) for path, content in files],
+        'paths[]': [path for path, _ in files]
+    }
+    data.update(fields)
+    return data
+
+@pytest.fixture
+def upload(client):
+    def upload(files, **fields):
+        response = client.post('/upload', data=upload_form(files, **fields), content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()['file_id']
+    return upload
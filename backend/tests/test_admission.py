@@ -0,0 +1,14 @@
+from app.admission import estimate_upload_space
+
+def test_estimate_counts_archive_and_spool_copies(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    folder = ['dossier/a.txt', 'dossier/b.txt']
+
+    assert estimate_upload_space(100, ['a.txt']) == 100
+    assert estimate_upload_space(100, folder) == 200
+    # Serveur asynchrone : corps en tampon, fichiers reçus, puis archive
+    assert estimate_upload_space(100, spooled=True) == 200
+    assert estimate_upload_space(100, folder, spooled=True) == 300
+
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'streamed')
+    assert estimate_upload_space(100, folder, spooled=True) == 200
@@ -0,0 +1,66 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+import pytest
+from app.models import Blob, FileUpload
+
+def download_zip(client, file_id):
+    response = client.get(f'/download/{file_id}')
+    assert response.status_code == 200
+    return zipfile.ZipFile(io.BytesIO(response.get_data()))
+
+def test_deflate_scratch_file_does_not_collide_with_member(app, client, upload, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    monkeypatch.setitem(app.config, 'ARCHIVE_FORMAT', 'zip')
+    compressible = b'du texte tres compressible\n' * 4096
+    other = os.urandom(4096)
+
+    file_id = upload([('dossier/foo', compressible), ('dossier/foo.deflate', other)])
+
+    with download_zip(client, file_id) as archive:
+        assert archive.getinfo('dossier/foo').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read('dossier/foo') == compressible
+        assert archive.read('dossier/foo.deflate') == other
+    # Aucun fichier de travail ne doit subsister
+    scratch_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp', 'scratch')
+    assert not os.listdir(scratch_dir)
+
+def upload_in_chunks(client, files, **fields):
+    payload = {
+        'email': 'destinataire@example.com',
+        'sender_email': 'expediteur@example.com',
+        'expiration_days': 3,
+        'files_list': [{'name': path, 'size': len(content)} for path, content in files],
+        'files': [{'path': path, 'size': len(content)} for path, content in files],
+        **fields
+    }
+    upload_id = client.post('/upload/init', json=payload).get_json()['upload_id']
+    for index, (_, content) in enumerate(files):
+        assert client.put(f'/upload/{upload_id}/chunk/{index}/0', data=content).status_code == 200
+    assert client.post(f'/upload/{upload_id}/complete').status_code == 200
+    return upload_id
+
+@pytest.mark.parametrize('archive_format', ['zip', 'tar.zst'])
+def test_identical_folders_share_one_blob(app, client, upload, monkeypatch, archive_format):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    files = [('photos/a.txt', b'premier fichier\n' * 1000), ('photos/b.bin', os.urandom(2048))]
+
+    first = FileUpload.query.get(upload(files, archive_format=archive_format))
+    second = FileUpload.query.get(upload(files, archive_format=archive_format))
+    # Upload par morceaux : fichiers hashés après la construction de l'archive
+    third = FileUpload.query.get(upload_in_chunks(client, files, archive_format=archive_format))
+
+    assert first.encrypted_data == second.encrypted_data == third.encrypted_data
+    assert Blob.query.get(first.encrypted_data).refcount == 3
+    assert client.get(f'/download/{third.id}').status_code == 200
+    # Un contenu différent a sa propre archive
+    other = FileUpload.query.get(upload([('photos/a.txt', b'autre contenu')], archive_format=archive_format))
+    assert other.encrypted_data != first.encrypted_data
+
+def test_archive_members_keep_the_upload_date(app, client, upload, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    file_id = upload([('dossier/a.txt', b'a'), ('dossier/b.txt', b'b')], archive_format='zip')
+
+    with download_zip(client, file_id) as archive:
+        assert {info.date_time[0] for info in archive.infolist()} == {datetime.now().year}
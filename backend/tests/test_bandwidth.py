@@ -0,0 +1,78 @@
+import time
+import pytest
+from app import bandwidth
+from app.bandwidth import BUCKET_SLOTS, MAX_BACKLOG_SECONDS, DownloadShaper, SharedBuckets, ShapedStream, bandwidth_stats
+
+ADMIN_TOKEN = 'jeton-de-test'
+
+def test_public_stats_hide_transfer_ids_and_clients(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'TRACE_ADMIN_TOKEN', ADMIN_TOKEN)
+    stream = ShapedStream('identifiant-secret', '203.0.113.7')
+    bandwidth_stats.start(stream)
+    try:
+        public = repr(bandwidth_stats.as_dict())
+        assert 'identifiant-secret' not in public
+        assert '203.0.113.7' not in public
+        assert bandwidth_stats.as_dict()['active'] == 1
+
+        assert client.get('/api/admin/bandwidth').status_code == 403
+        response = client.get('/api/admin/bandwidth', headers={'X-Admin-Token': ADMIN_TOKEN})
+        assert response.status_code == 200
+        assert response.get_json()['streams'][0]['transfer_id'] == 'identifiant-secret'
+    finally:
+        bandwidth_stats.finish(stream)
+
+@pytest.fixture
+def buckets(tmp_path):
+    return SharedBuckets(str(tmp_path / 'buckets'), 4)
+
+def test_burst_is_allowed_then_sends_are_spaced(buckets):
+    now = 1000.0
+    # 0,1 s d'émission par envoi, 0,25 s d'avance tolérée : deux envois immédiats, puis attente
+    waits = [buckets.reserve(0, 0.1, 0.25, now) for _ in range(4)]
+    assert waits == pytest.approx([-0.15, -0.05, 0.05, 0.15])
+
+    # Après une pause, le bucket repart de zéro (pas de crédit accumulé au-delà de la tolérance)
+    assert buckets.reserve(0, 0.1, 0.25, now + 10) == pytest.approx(-0.15)
+
+def test_buckets_are_independent_and_shared_between_workers(buckets, tmp_path):
+    now = 1000.0
+    assert buckets.reserve(1, 2.0, 0.0, now) == pytest.approx(2.0)
+    assert buckets.reserve(2, 0.5, 0.0, now) == pytest.approx(0.5)
+
+    # Un autre worker ouvre le même fichier et voit le retard du bucket
+    other = SharedBuckets(str(tmp_path / 'buckets'), 4)
+    assert other.reserve(1, 1.0, 0.0, now) == pytest.approx(3.0)
+
+def test_stale_backlog_is_reset(buckets):
+    now = 1000.0
+    buckets.reserve(0, MAX_BACKLOG_SECONDS * 2, 0.0, now)
+    assert buckets.reserve(0, 1.0, 0.0, now) == pytest.approx(1.0)
+
+def test_strictest_limit_applies(buckets, monkeypatch):
+    monkeypatch.setattr(bandwidth.time, 'time', lambda: 1000.0)
+    # Global à 1 Mo/s, client à 100 ko/s : le client impose son rythme
+    shaper = DownloadShaper(buckets, [(0, 1_000_000), (1, 100_000)], 0.0)
+    assert shaper.reserve(50_000) == pytest.approx(0.5)
+    assert shaper.reserve(50_000) == pytest.approx(1.0)
+    # Un autre client ne partage que la limite globale
+    other = DownloadShaper(buckets, [(0, 1_000_000), (2, 100_000)], 0.0)
+    assert other.reserve(50_000) == pytest.approx(0.5)
+
+def test_download_is_shaped_to_the_transfer_limit(app, client, upload, tmp_path, monkeypatch):
+    content = b'x' * 200_000
+    file_id = upload([('lent.bin', content)])
+    monkeypatch.setattr(bandwidth, 'shared_buckets', SharedBuckets(str(tmp_path / 'buckets'), 1 + 2 * BUCKET_SLOTS))
+    monkeypatch.setitem(app.config, 'BANDWIDTH_PER_TRANSFER_LIMIT', 1_000_000)
+    monkeypatch.setitem(app.config, 'BANDWIDTH_BURST_SECONDS', 0.05)
+    monkeypatch.setitem(app.config, 'BANDWIDTH_CHUNK_SIZE', 20_000)
+    waited = bandwidth_stats.wait_seconds
+
+    started = time.monotonic()
+    response = client.get(f'/download/{file_id}')
+    assert response.get_data() == content
+    elapsed = time.monotonic() - started
+
+    # 200 ko à 1 Mo/s, moins l'avance tolérée
+    assert 0.14 <= elapsed < 1.0
+    assert bandwidth_stats.wait_seconds - waited >= 0.14
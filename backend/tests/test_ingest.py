@@ -0,0 +1,46 @@
+import os
+from app import app
+
+BOUNDARY = 'itransfer-test'
+
+def multipart_body(fields, files):
+    parts = []
+    for name, value in fields:
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, filename, content in files:
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+        )
+    return b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode('utf-8')
+
+def test_truncated_body_is_rejected_and_cleaned_up(client):
+    content = os.urandom(200000)
+    body = multipart_body(
+        [('email', 'destinataire@example.com'), ('sender_email', 'expediteur@example.com'),
+         ('files_list', '[{"name": "a.bin", "size": 200000}]'), ('paths[]', 'a.bin')],
+        [('files[]', 'a.bin', content)]
+    )
+    # Client déconnecté au milieu du fichier
+    cut = body[:len(body) - 100000]
+    response = client.post(
+        '/upload',
+        data=cut,
+        content_type=f'multipart/form-data; boundary={BOUNDARY}'
+    )
+    assert response.status_code == 400
+    assert 'incomplet' in response.get_json()['error']
+
+    # Seul le répertoire de travail partagé des archives peut subsister
+    temp_root = os.path.join(app.config['UPLOAD_FOLDER'], 'temp')
+    assert not os.path.exists(temp_root) or set(os.listdir(temp_root)) <= {'scratch'}
+
+def test_malformed_body_is_rejected(client):
+    response = client.post(
+        '/upload',
+        data=b'--' + BOUNDARY.encode() + b'\r\nnot a header line\r\n\r\n',
+        content_type=f'multipart/form-data; boundary={BOUNDARY}'
+    )
+    assert response.status_code == 400
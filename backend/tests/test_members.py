@@ -0,0 +1,90 @@
+import io
+import os
+import zipfile
+import pytest
+from urllib.parse import quote
+from app.archives import iter_tar_member
+from app.transfer_cache import get_transfer
+
+# Texte compressible mais non répétitif : la décompression traverse plusieurs blocs DEFLATE
+TEXT = b''.join(b'ligne %07d du fichier texte\n' % index for index in range(120000))
+RANDOM = os.urandom(300000)
+FILES = [('docs/rapport.txt', TEXT), ('docs/données.bin', RANDOM), ('vide.txt', b'')]
+
+def member_url(file_id, path):
+    return f'/download/{file_id}/member/{quote(path)}'
+
+@pytest.fixture(params=['materialized', 'streamed'])
+def archive_mode(request, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', request.param)
+    monkeypatch.setitem(app.config, 'ARCHIVE_FORMAT', 'zip')
+    return request.param
+
+def test_each_member_can_be_downloaded_alone(client, upload, archive_mode):
+    file_id = upload(FILES)
+
+    for path, content in FILES:
+        response = client.get(member_url(file_id, path))
+        assert response.status_code == 200, path
+        assert int(response.headers['Content-Length']) == len(content)
+        assert response.get_data() == content
+        assert quote(os.path.basename(path)) in response.headers['Content-Disposition']
+
+    assert client.get(member_url(file_id, 'docs/absent.txt')).status_code == 404
+
+def test_member_ranges(client, upload, archive_mode):
+    file_id = upload(FILES)
+
+    for path, content in FILES[:2]:
+        for start, end in [(0, 99), (len(content) // 2, len(content) // 2 + 100000), (len(content) - 10, len(content) - 1)]:
+            response = client.get(member_url(file_id, path), headers={'Range': f'bytes={start}-{end}'})
+            assert response.status_code == 206
+            assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(content)}'
+            assert response.get_data() == content[start:end + 1]
+
+def test_deflated_member_is_decompressed_at_its_position(app, client, upload, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    monkeypatch.setitem(app.config, 'ARCHIVE_FORMAT', 'zip')
+    file_id = upload(FILES)
+
+    with zipfile.ZipFile(io.BytesIO(client.get(f'/download/{file_id}').get_data())) as archive:
+        assert archive.getinfo('docs/rapport.txt').compress_type == zipfile.ZIP_DEFLATED
+    # Plage au milieu du membre compressé, puis reprise juste après
+    middle = len(TEXT) // 3
+    first = client.get(member_url(file_id, 'docs/rapport.txt'), headers={'Range': f'bytes={middle}-{middle + 65535}'})
+    rest = client.get(member_url(file_id, 'docs/rapport.txt'), headers={'Range': f'bytes={middle + 65536}-'})
+    assert first.get_data() + rest.get_data() == TEXT[middle:]
+
+def test_member_is_not_resent_when_unchanged(client, upload, archive_mode):
+    file_id = upload(FILES)
+
+    response = client.get(member_url(file_id, 'docs/rapport.txt'))
+    etag = response.headers['ETag']
+    assert client.get(member_url(file_id, 'docs/rapport.txt'), headers={'If-None-Match': etag}).status_code == 304
+
+@pytest.fixture
+def tar_zst(app, monkeypatch):
+    pytest.importorskip('zstandard')
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'materialized')
+    monkeypatch.setitem(app.config, 'ARCHIVE_FORMAT', 'tar.zst')
+
+def test_tar_zst_member_is_extracted_from_the_archive(client, upload, tar_zst):
+    file_id = upload(FILES)
+    transfer = get_transfer(file_id)
+    assert transfer.archive_format == 'tar.zst'
+
+    # Lecture directe dans l'archive compressée, à la position de chaque fichier
+    for path, content in FILES:
+        member = transfer.find_member(path)
+        assert transfer.get_member_key(member) is None
+        assert b''.join(iter_tar_member(transfer.stored_key, transfer.size, member)) == content
+    member = transfer.find_member('docs/rapport.txt')
+    middle = len(TEXT) // 2
+    assert b''.join(iter_tar_member(transfer.stored_key, transfer.size, member, middle, middle + 1000)) == TEXT[middle:middle + 1000]
+
+    # Même chose par la route, plages comprises
+    for path, content in FILES:
+        assert client.get(member_url(file_id, path)).get_data() == content
+    response = client.get(member_url(file_id, 'docs/données.bin'), headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.get_data() == RANDOM[1000:2000]
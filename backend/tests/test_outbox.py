@@ -0,0 +1,114 @@
+import socket
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+import pytest
+from app import db
+from app.models import EmailOutbox
+from app.outbox import enqueue_email, claim_due_emails, process_outbox, get_retry_delay
+from app.smtp_settings import save_smtp_config
+from benchmarks.smtp_sink import SMTPSink
+
+@pytest.fixture(scope='module')
+def sink():
+    server = SMTPSink(('127.0.0.1', 0)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def smtp_config(port):
+    return {
+        'smtp_server': '127.0.0.1',
+        'smtp_port': str(port),
+        'smtp_security': 'none',
+        'smtp_user': '',
+        'smtp_password': '',
+        'smtp_sender_email': 'itransfer@example.com'
+    }
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def outbox(app, sink):
+    """
+    File d'attente vide, envois vers le serveur SMTP local
+    """
+    EmailOutbox.query.delete()
+    db.session.commit()
+    save_smtp_config(smtp_config(sink.port))
+    yield
+    EmailOutbox.query.delete()
+    db.session.commit()
+
+def queue_email():
+    msg = MIMEText('Bonjour')
+    msg['To'] = 'destinataire@example.com'
+    msg['Subject'] = 'Test'
+    assert enqueue_email(msg)
+    return EmailOutbox.query.order_by(EmailOutbox.id.desc()).first()
+
+def make_due(outbox_email):
+    outbox_email.next_attempt_at = datetime.now() - timedelta(seconds=1)
+    db.session.commit()
+
+def test_email_is_sent_through_the_sink(outbox, sink):
+    before = sink.messages
+    outbox_email = queue_email()
+
+    assert process_outbox() == (1, 1)
+    assert sink.messages == before + 1
+    assert (outbox_email.status, outbox_email.attempts) == ('sent', 1)
+
+def test_failed_send_is_retried_with_backoff(app, outbox, sink):
+    save_smtp_config(smtp_config(closed_port()))
+    outbox_email = queue_email()
+
+    assert process_outbox() == (1, 0)
+    assert (outbox_email.status, outbox_email.attempts) == ('pending', 1)
+    assert outbox_email.next_attempt_at > datetime.now() + get_retry_delay(1) - timedelta(seconds=5)
+    # Pas de nouvel essai avant l'échéance
+    assert process_outbox() == (0, 0)
+
+    save_smtp_config(smtp_config(sink.port))
+    make_due(outbox_email)
+    assert process_outbox() == (1, 1)
+    assert (outbox_email.status, outbox_email.attempts) == ('sent', 2)
+
+def test_retry_delay_grows_and_is_capped(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+    monkeypatch.setitem(app.config, 'OUTBOX_RETRY_MAX_SECONDS', 100)
+    assert [get_retry_delay(n).total_seconds() for n in (1, 2, 3, 4)] == [30, 60, 100, 100]
+
+def test_email_is_dead_lettered_after_max_attempts(app, outbox, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 2)
+    save_smtp_config(smtp_config(closed_port()))
+    outbox_email = queue_email()
+
+    assert process_outbox() == (1, 0)
+    make_due(outbox_email)
+    assert process_outbox() == (1, 0)
+    assert (outbox_email.status, outbox_email.attempts) == ('dead', 2)
+    assert outbox_email.last_error
+
+def test_expired_lease_is_reclaimed(outbox, sink):
+    outbox_email = queue_email()
+    # Worker arrêté après la réservation, avant l'envoi
+    assert claim_due_emails(10) == [outbox_email]
+    assert (outbox_email.status, outbox_email.attempts) == ('sending', 1)
+    assert process_outbox() == (0, 0)
+
+    make_due(outbox_email)
+    assert process_outbox() == (1, 1)
+    assert (outbox_email.status, outbox_email.attempts) == ('sent', 2)
+
+def test_email_that_never_finishes_is_dead_lettered(app, outbox, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 2)
+    outbox_email = queue_email()
+    for _ in range(2):
+        assert claim_due_emails(10) == [outbox_email]
+        make_due(outbox_email)
+
+    assert claim_due_emails(10) == []
+    assert (outbox_email.status, outbox_email.attempts) == ('dead', 2)
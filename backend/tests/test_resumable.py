@@ -0,0 +1,104 @@
+import io
+import shutil
+import zipfile
+import pytest
+from app import routes
+from app.admission import admission
+
+def init_payload(size, path='gros-fichier.bin'):
+    return files_payload([(path, size)])
+
+def files_payload(files):
+    return {
+        'email': 'destinataire@example.com',
+        'sender_email': 'expediteur@example.com',
+        'expiration_days': 3,
+        'files_list': [{'name': path, 'size': size} for path, size in files],
+        'files': [{'path': path, 'size': size} for path, size in files]
+    }
+
+@pytest.fixture
+def limited_disk(app, monkeypatch):
+    """
+    Ne laisse à l'admission qu'environ 96 Mo d'espace disque utilisable
+    """
+    free = shutil.disk_usage(admission.disk_path).free
+    monkeypatch.setattr(admission, 'min_free_bytes', free - 96 * 1024 * 1024)
+    return 64 * 1024 * 1024
+
+def test_init_reserves_space_for_the_session(client, limited_disk):
+    first = client.post('/upload/init', json=init_payload(limited_disk))
+    assert first.status_code == 201
+
+    # La réservation de la première session survit à sa requête d'ouverture
+    second = client.post('/upload/init', json=init_payload(limited_disk))
+    assert second.status_code == 507
+    assert second.headers['Retry-After']
+
+    # Annuler la première session libère son espace
+    upload_id = first.get_json()['upload_id']
+    assert client.delete(f'/upload/{upload_id}').status_code == 200
+    third = client.post('/upload/init', json=init_payload(limited_disk))
+    assert third.status_code == 201
+    assert client.delete(f"/upload/{third.get_json()['upload_id']}").status_code == 200
+
+def test_complete_releases_the_reservation(client):
+    content = b'contenu du fichier'
+    init = client.post('/upload/init', json=init_payload(len(content), 'petit.txt'))
+    assert init.status_code == 201
+    upload_id = init.get_json()['upload_id']
+    assert client.put(f'/upload/{upload_id}/chunk/0/0', data=content).status_code == 200
+
+    response = client.post(f'/upload/{upload_id}/complete')
+    assert response.status_code == 200
+    assert response.get_json()['file_id'] == upload_id
+    with admission.ledger_lock():
+        assert admission.read_ledger() == (0, 0)
+
+@pytest.mark.parametrize('archive_mode, files', [
+    ('materialized', [('seul.txt', b'un seul fichier')]),
+    ('streamed', [('dossier/a.txt', b'premier'), ('dossier/b.txt', b'second')])
+])
+def test_complete_can_be_retried_after_a_failure(app, client, monkeypatch, archive_mode, files):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', archive_mode)
+    init = client.post('/upload/init', json=files_payload([(path, len(content)) for path, content in files]))
+    upload_id = init.get_json()['upload_id']
+    for index, (_, content) in enumerate(files):
+        assert client.put(f'/upload/{upload_id}/chunk/{index}/0', data=content).status_code == 200
+
+    # Échec après que les fichiers ont été rangés dans le magasin de blobs
+    real_add_blob = routes.add_blob
+    def failing_add_blob(*args):
+        real_add_blob(*args)
+        raise OSError('stockage indisponible')
+    monkeypatch.setattr(routes, 'add_blob', failing_add_blob)
+    assert client.post(f'/upload/{upload_id}/complete').status_code == 500
+    assert client.get(f'/upload/{upload_id}').get_json()['status'] == 'open'
+
+    monkeypatch.setattr(routes, 'add_blob', real_add_blob)
+    response = client.post(f'/upload/{upload_id}/complete')
+    assert response.status_code == 200, response.get_json()
+
+    download = client.get(f'/download/{upload_id}')
+    assert download.status_code == 200
+    if len(files) == 1:
+        assert download.get_data() == files[0][1]
+    else:
+        with zipfile.ZipFile(io.BytesIO(download.get_data())) as archive:
+            assert {name: archive.read(name) for name in archive.namelist()} == dict(files)
+
+@pytest.mark.parametrize('changes', [
+    {'files': ['pas-un-objet']},
+    {'files_list': [42]},
+    {'files': [{'path': 'a', 'size': 1}, {'path': 'a/b', 'size': 1}]},
+    {'files': [{'path': 'x/a/b', 'size': 1}, {'path': 'x/a', 'size': 1}]},
+    {'files': [{'path': 'a', 'size': [1]}]},
+    {'archive_format': 'x' * 100},
+    {'chunk_size': 'beaucoup'}
+])
+def test_init_rejects_invalid_requests(client, changes):
+    response = client.post('/upload/init', json={**init_payload(1, 'a'), **changes})
+    assert response.status_code == 400
+
+def test_init_rejects_non_object_body(client):
+    assert client.post('/upload/init', json=['liste']).status_code == 400
@@ -0,0 +1,11 @@
+ADMIN_TOKEN = 'jeton-de-test'
+
+def test_stats_require_the_admin_token(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'TRACE_ADMIN_TOKEN', None)
+    assert client.get('/api/stats').status_code == 404
+
+    monkeypatch.setitem(app.config, 'TRACE_ADMIN_TOKEN', ADMIN_TOKEN)
+    assert client.get('/api/stats').status_code == 403
+    response = client.get('/api/stats', headers={'Authorization': f'Bearer {ADMIN_TOKEN}'})
+    assert response.status_code == 200
+    assert 'admission' in response.get_json()
@@ -0,0 +1,107 @@
+import io
+import os
+import threading
+import pytest
+from app import archives, blobstore, cleanup, downloads, routes, transfer_cache
+from app.storage import FilesystemStorage, S3Storage
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'itransfer-test'
+CHUNK_SIZE = 5 * 1024 * 1024  # Plus petite partie acceptée par S3
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    """
+    Stockage S3 sur un bucket simulé (moto)
+    """
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'test')
+    with moto.mock_aws():
+        store = S3Storage(BUCKET, prefix='itransfer', region='us-east-1', chunk_size=CHUNK_SIZE, concurrency=2)
+        store.client.create_bucket(Bucket=BUCKET)
+        yield store
+
+def write_temp(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_put_file_uses_multipart_and_consumes_the_file(s3_storage, tmp_path):
+    data = os.urandom(2 * CHUNK_SIZE + 1024)
+    path = write_temp(tmp_path, 'gros.bin', data)
+
+    s3_storage.put_file('blobs/gros', path)
+
+    assert not os.path.exists(path)
+    head = s3_storage.client.head_object(Bucket=BUCKET, Key='itransfer/blobs/gros')
+    # ETag d'un objet multipart : « <hash>-<nombre de parties> »
+    assert head['ETag'].strip('"').endswith('-3')
+    assert s3_storage.stat('blobs/gros').size == len(data)
+
+def test_open_range_reads_exact_bytes(s3_storage, tmp_path):
+    data = bytes(range(256)) * 100
+    s3_storage.put_file('objet', write_temp(tmp_path, 'objet', data))
+
+    assert b''.join(s3_storage.open_range('objet', 0, len(data))) == data
+    assert b''.join(s3_storage.open_range('objet', 1000, 1010)) == data[1000:1010]
+    assert b''.join(s3_storage.open_range('objet', 5, 5)) == b''
+
+def test_stat_list_and_delete(s3_storage, tmp_path):
+    s3_storage.put_file('dossier/a', write_temp(tmp_path, 'a', b'abc'))
+    s3_storage.put_file('dossier/b', write_temp(tmp_path, 'b', b'de'))
+
+    assert s3_storage.stat('absent') is None
+    assert sorted((item.key, item.size) for item in s3_storage.list('dossier/')) == [('dossier/a', 3), ('dossier/b', 2)]
+    assert s3_storage.delete('dossier/a') is True
+    assert s3_storage.delete('dossier/a') is False
+    assert s3_storage.stat('dossier/a') is None
+
+@pytest.fixture
+def s3_backend(s3_storage, monkeypatch):
+    """
+    Application entière branchée sur le stockage S3 simulé
+    """
+    for module in (archives, blobstore, cleanup, downloads, routes, transfer_cache):
+        monkeypatch.setattr(module, 'storage', s3_storage)
+    return s3_storage
+
+def test_download_is_redirected_to_a_presigned_url(client, upload, s3_backend):
+    file_id = upload([('rapport.pdf', b'contenu')])
+
+    response = client.get(f'/download/{file_id}')
+    assert response.status_code == 302
+    assert response.headers['Cache-Control'] == 'no-store'
+    location = response.headers['Location']
+    assert '/itransfer/blobs/' in location and BUCKET in location
+    assert 'response-content-disposition=attachment' in location
+
+def test_download_without_presigned_url_is_streamed_by_range(client, upload, s3_backend):
+    s3_backend.presigned_downloads = False
+    file_id = upload([('fichier.txt', b'0123456789')])
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 2-5/10'
+    assert response.data == b'2345'
+
+def test_concurrent_put_stream_of_the_same_key(tmp_path):
+    store = FilesystemStorage(str(tmp_path))
+    contents = [bytes([i]) * (3 * 1024 * 1024) for i in range(8)]
+    barrier = threading.Barrier(len(contents))
+
+    class SlowStream(io.BytesIO):
+        def read(self, size=-1):
+            barrier.wait() if self.tell() == 0 else None
+            return super().read(1024 * 1024)
+
+    threads = [threading.Thread(target=store.put_stream, args=('blobs/cle', SlowStream(data))) for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Le fichier final est l'un des contenus, entier, et aucun fichier partiel ne reste
+    with open(store.local_path('blobs/cle'), 'rb') as f:
+        assert f.read() in contents
+    assert os.listdir(tmp_path / 'blobs') == ['cle']
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.cleanup import expire_batch
+from app.models import FileUpload
+from app.transfer_cache import TransferMetadataCache, transfer_cache
+
+class FakeRedis:
+    """
+    Cache partagé en mémoire (get/set/delete de redis)
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+@pytest.fixture
+def cache(app, monkeypatch):
+    """
+    Cache des transferts vide pour chaque test
+    """
+    monkeypatch.setattr(transfer_cache, 'entries', type(transfer_cache.entries)())
+    return transfer_cache
+
+def test_transfer_is_read_once_then_served_from_the_cache(client, upload, cache):
+    file_id = upload([('a.txt', b'contenu')])
+    misses = cache.misses
+
+    assert client.get(f'/transfer/{file_id}').status_code == 200
+    hits = cache.hits
+    assert client.get(f'/transfer/{file_id}').status_code == 200
+    assert client.get(f'/download/{file_id}').data == b'contenu'
+    assert cache.misses == misses + 1
+    assert cache.hits == hits + 2
+
+def test_download_marks_the_cached_transfer(client, upload, cache):
+    file_id = upload([('a.txt', b'contenu')])
+    assert client.get(f'/transfer/{file_id}').status_code == 200
+    assert cache.entries[file_id][0].downloaded is False
+
+    assert client.get(f'/download/{file_id}').status_code == 200
+    assert cache.entries[file_id][0].downloaded is True
+    assert db.session.get(FileUpload, file_id).downloaded is True
+
+def test_expired_transfer_is_removed_from_the_cache(client, upload, cache):
+    file_id = upload([('a.txt', b'contenu')])
+    assert client.get(f'/transfer/{file_id}').status_code == 200
+
+    db.session.get(FileUpload, file_id).expires_at = datetime.now() - timedelta(days=1)
+    db.session.commit()
+    with ThreadPoolExecutor(1) as executor:
+        assert expire_batch(executor, 100, set()) >= 1
+
+    assert file_id not in cache.entries
+    assert client.get(f'/transfer/{file_id}').status_code == 404
+
+def test_shared_cache_follows_downloads_and_invalidations(client, upload, app):
+    file_id = upload([('a.txt', b'contenu')])
+    shared = FakeRedis()
+
+    def worker():
+        """
+        Cache d'un autre worker, adossé au même cache partagé
+        """
+        cache = TransferMetadataCache()
+        cache.shared = shared
+        return cache
+
+    first, second = worker(), worker()
+    assert first.get(file_id).downloaded is False
+    assert second.get(file_id).downloaded is False
+    assert (first.misses, second.shared_hits) == (1, 1)
+
+    # Entrée locale présente : la mise à jour est propagée au cache partagé
+    second.mark_downloaded(file_id)
+    assert worker().get(file_id).downloaded is True
+
+    # Sans entrée locale, l'entrée partagée est retirée plutôt que laissée périmée
+    worker().mark_downloaded(file_id)
+    assert shared.values == {}
+
+    first.invalidate(file_id)
+    assert file_id not in first.entries
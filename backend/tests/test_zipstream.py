@@ -0,0 +1,101 @@
+import io
+import os
+import struct
+import zlib
+import zipfile
+import pytest
+from app import zipstream
+from app.models import TransferArchive
+from app.zipstream import ZipEntry, ZipLayout, ZipStreamWriter
+
+@pytest.fixture
+def streamed(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'ARCHIVE_MODE', 'streamed')
+    monkeypatch.setitem(app.config, 'ARCHIVE_FORMAT', 'zip')
+
+FILES = [
+    ('dossier/texte.txt', b'une ligne de texte compressible\n' * 5000),
+    ('dossier/aleatoire.bin', os.urandom(70000)),
+    ('dossier/vide.txt', b''),
+    ('été/accentué.txt', 'données accentuées'.encode('utf-8'))
+]
+
+def test_streamed_zip_content_length_matches_the_bytes_sent(client, upload, streamed):
+    file_id = upload(FILES)
+    assert TransferArchive.query.get(file_id).mode == 'streamed'
+
+    response = client.get(f'/download/{file_id}')
+    assert response.status_code == 200
+    data = response.get_data()
+    assert int(response.headers['Content-Length']) == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert {info.filename: archive.read(info) for info in archive.infolist()} == dict(FILES)
+
+    # Chaque plage annoncée correspond aux octets de l'archive complète
+    for start, end in [(0, 0), (10, 4000), (len(data) - 100, len(data) - 1)]:
+        part = client.get(f'/download/{file_id}', headers={'Range': f'bytes={start}-{end}'})
+        assert part.status_code == 206
+        assert int(part.headers['Content-Length']) == end - start + 1
+        assert part.get_data() == data[start:end + 1]
+
+def make_entries(tmp_path, files):
+    """
+    Entrées ZIP prêtes à écrire : le premier fichier stocké, les suivants compressés
+    """
+    entries = []
+    for index, (name, content) in enumerate(files):
+        path = tmp_path / f'membre-{index}'
+        if index == 0:
+            path.write_bytes(content)
+            entries.append(ZipEntry(name, len(content), zlib.crc32(content), str(path), (2024, 5, 17, 10, 30, 0)))
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            compressed = compressor.compress(content) + compressor.flush()
+            path.write_bytes(compressed)
+            entries.append(ZipEntry(name, len(content), zlib.crc32(content), str(path), (2024, 5, 17, 10, 30, 0),
+                                    zipfile.ZIP_DEFLATED, len(compressed)))
+    return entries
+
+def read_back(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+@pytest.fixture
+def forced_zip64(monkeypatch):
+    """
+    Seuils abaissés : tailles, offsets et nombre d'entrées passent tous par ZIP64
+    """
+    monkeypatch.setattr(zipstream, 'ZIP64_LIMIT', 1)
+    monkeypatch.setattr(zipstream, 'ZIP64_COUNT_LIMIT', 1)
+
+def test_forced_zip64_layout_is_readable(tmp_path, forced_zip64):
+    layout = ZipLayout(make_entries(tmp_path, FILES))
+    data = b''.join(layout)
+
+    assert len(data) == layout.content_length
+    # Enregistrements de fin ZIP64 présents, champs classiques saturés
+    assert struct.pack('<I', 0x06064b50) in data and struct.pack('<I', 0x07064b50) in data
+    assert all(entry.zip64 for entry in layout.entries if entry.size)
+    assert read_back(data) == dict(FILES)
+
+def test_forced_zip64_writer_is_readable(tmp_path, forced_zip64):
+    out = io.BytesIO()
+    writer = ZipStreamWriter(out)
+    for entry in make_entries(tmp_path, FILES):
+        writer.add(entry)
+    writer.close()
+
+    assert out.getvalue() == b''.join(ZipLayout(make_entries(tmp_path, FILES)))
+    assert read_back(out.getvalue()) == dict(FILES)
+
+def test_more_than_65535_entries(tmp_path):
+    count = zipstream.ZIP64_COUNT_LIMIT + 10
+    entries = [ZipEntry(f'vide/{index}.txt', 0, 0, None, (2024, 5, 17, 10, 30, 0)) for index in range(count)]
+    layout = ZipLayout(entries)
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(layout))) as archive:
+        names = archive.namelist()
+    assert len(names) == count
+    assert names[-1] == f'vide/{count - 1}.txt'
@@ -1,8 +1,12 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import JSZip from 'jszip';
 import banner from './assets/iTransfer Bannière.png';
 
+// Au-delà de cette taille, l'upload se fait par morceaux (reprise possible)
+const CHUNKED_UPLOAD_THRESHOLD = 100 * 1024 * 1024; // 100 MB
+const PARALLEL_CHUNKS = 4;
+const MAX_CHUNK_RETRIES = 5;
+
 function App() {
   const navigate = useNavigate();
   const [progress, setProgress] = useState(0);
@@ -16,9 +20,10 @@ function App() {
   const [error, setError] = useState(null);
   const [success, setSuccess] = useState(false);
   const [warning, setWarning] = useState(null);
-  const [compressionProgress, setCompressionProgress] = useState(0);
-  const [isCompressing, setIsCompressing] = useState(false);
+  // Format de l'archive construite par le serveur ('' : format par défaut du serveur)
+  const [archiveFormat, setArchiveFormat] = useState('');
   const xhrRef = useRef(null);
+  const abortControllerRef = useRef(null);
   const fileInputRef = useRef(null);
   const backendUrl = window.BACKEND_URL;
 
@@ -32,21 +37,21 @@ function App() {
   // Gestion de la prévention de fermeture pendant l'upload
   useEffect(() => {
     const handleBeforeUnload = (e) => {
-      if (isCompressing || (progress > 0 && progress < 100)) {
+      if (progress > 0 && progress < 100) {
         e.preventDefault();
         e.returnValue = '';
         return '';
       }
     };
 
-    if (isCompressing || (progress > 0 && progress < 100)) {
+    if (progress > 0 && progress < 100) {
       window.addEventListener('beforeunload', handleBeforeUnload);
     }
 
     return () => {
       window.removeEventListener('beforeunload', handleBeforeUnload);
     };
-  }, [isCompressing, progress]);
+  }, [progress]);
 
   const processFilesAndFolders = async (items) => {
     const allFiles = [];
@@ -278,15 +283,8 @@ function App() {
     }
   };
 
-  const generateZipName = () => {
-    const now = new Date();
-    const year = now.getFullYear().toString().slice(-2);
-    const month = String(now.getMonth() + 1).padStart(2, '0');
-    const day = String(now.getDate()).padStart(2, '0');
-    const hours = String(now.getHours()).padStart(2, '0');
-    const minutes = String(now.getMinutes()).padStart(2, '0');
-    return `iTransfer_${year}${month}${day}${hours}${minutes}.zip`;
-  };
+  // Plusieurs fichiers ou un dossier : le serveur construit une archive
+  const needsArchive = uploadedItems.length > 1 || uploadedItems.some(item => item.path.split('/').length > 2);
 
   const handleUpload = async () => {
     if (uploadedItems.length === 0) {
@@ -312,6 +310,9 @@ function App() {
       formData.append('email', recipientEmail);
       formData.append('sender_email', senderEmail);
       formData.append('expiration_days', expirationDays);
+      if (archiveFormat) {
+        formData.append('archive_format', archiveFormat);
+      }
 
       // Préparer la liste des fichiers pour les emails
       const filesList = uploadedItems.map(item => ({
@@ -320,41 +321,32 @@ function App() {
       }));
       formData.append('files_list', JSON.stringify(filesList));
 
-      // Si plusieurs fichiers, on compresse
-      if (uploadedItems.length > 1) {
-        setIsCompressing(true);
-        const zip = new JSZip();
-        
-        // Ajouter chaque fichier au zip
-        for (let i = 0; i < uploadedItems.length; i++) {
-          const item = uploadedItems[i];
-          zip.file(item.path.substring(1), item.file);
-          // Mise à jour de la progression de compression
-          setCompressionProgress(Math.round((i + 1) * 100 / uploadedItems.length));
-        }
+      // Les fichiers sont envoyés tels quels : l'archive (ZIP ou tar.zst) est construite par le serveur
+      const uploadEntries = uploadedItems.map(item => ({ blob: item.file, name: item.file.name, path: item.path }));
 
-        // Générer le zip avec compression
-        const zipBlob = await zip.generateAsync({ 
-          type: "blob",
-          compression: "DEFLATE",
-          compressionOptions: { level: 6 }
-        }, (metadata) => {
-          setCompressionProgress(Math.round(metadata.percent));
-        });
+      setUploading(true);
 
-        const zipName = generateZipName();
-        formData.append('files[]', zipBlob, zipName);
-        formData.append('paths[]', '/' + zipName);
-        setIsCompressing(false);
-      } else {
-        // Un seul fichier, pas de compression
-        uploadedItems.forEach((item) => {
-          formData.append('files[]', item.file);
-          formData.append('paths[]', item.path);
-        });
+      // Les gros transferts passent par l'upload par morceaux
+      const totalBytes = uploadEntries.reduce((sum, entry) => sum + entry.blob.size, 0);
+      if (totalBytes > CHUNKED_UPLOAD_THRESHOLD) {
+        try {
+          const response = await uploadInChunks(uploadEntries, filesList);
+          handleUploadResponse(response);
+        } catch (error) {
+          if (error.name !== 'AbortError') {
+            console.error('Erreur:', error);
+            showNotification("Une erreur réseau est survenue. Relancez l'envoi pour reprendre là où il s'est arrêté.", "error");
+          }
+        }
+        abortControllerRef.current = null;
+        setUploading(false);
+        return;
       }
 
-      setUploading(true);
+      uploadEntries.forEach((entry) => {
+        formData.append('files[]', entry.blob, entry.name);
+        formData.append('paths[]', entry.path);
+      });
 
       const xhr = new XMLHttpRequest();
       xhr.open('POST', `${backendUrl}/upload`, true);
@@ -368,12 +360,7 @@ function App() {
 
       xhr.onload = function() {
         if (xhr.status === 200) {
-          const response = JSON.parse(xhr.responseText);
-          if (response.warning) {
-            showNotification("Les fichiers ont été uploadés mais il y a eu un problème avec l'envoi des notifications.", "warning");
-          } else {
-            showNotification("Les fichiers ont été uploadés et les notifications ont été envoyées avec succès !", "success");
-          }
+          handleUploadResponse(JSON.parse(xhr.responseText));
         } else {
           showNotification("Une erreur est survenue lors de l'upload. Veuillez vérifier que les emails sont valides et réessayer.", "error");
         }
@@ -391,14 +378,118 @@ function App() {
       console.error('Erreur:', error);
       showNotification("Une erreur est survenue lors de l'upload", "error");
       setUploading(false);
-      setIsCompressing(false);
     }
   };
 
+  const handleUploadResponse = (response) => {
+    if (response.warning) {
+      showNotification("Les fichiers ont été uploadés mais il y a eu un problème avec l'envoi des notifications.", "warning");
+    } else {
+      showNotification("Les fichiers ont été uploadés et les notifications ont été envoyées avec succès !", "success");
+    }
+  };
+
+  const uploadInChunks = async (entries, filesList) => {
+    const controller = new AbortController();
+    abortControllerRef.current = controller;
+
+    // Retrouver une session interrompue pour les mêmes fichiers
+    const fingerprint = entries.map(entry => `${entry.path}:${entry.blob.size}:${entry.blob.lastModified || ''}`).join('|');
+    const storageKey = `itransfer-upload:${fingerprint}`;
+    let session = null;
+    const savedId = localStorage.getItem(storageKey);
+    if (savedId) {
+      const response = await fetch(`${backendUrl}/upload/${savedId}`, { signal: controller.signal });
+      if (response.ok) {
+        const data = await response.json();
+        if (data.status === 'open') {
+          session = data;
+        }
+      }
+    }
+
+    if (!session) {
+      const response = await fetch(`${backendUrl}/upload/init`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          email: recipientEmail,
+          sender_email: senderEmail,
+          expiration_days: expirationDays,
+          archive_format: archiveFormat || undefined,
+          files_list: filesList,
+          files: entries.map(entry => ({ path: entry.path, size: entry.blob.size }))
+        }),
+        signal: controller.signal
+      });
+      if (!response.ok) {
+        throw new Error("Impossible de créer la session d'upload");
+      }
+      session = await response.json();
+      localStorage.setItem(storageKey, session.upload_id);
+    }
+
+    const chunkSize = session.chunk_size;
+    const totalBytes = entries.reduce((sum, entry) => sum + entry.blob.size, 0);
+    const queue = [];
+    let uploadedBytes = totalBytes;
+    session.members.forEach((member, memberIndex) => {
+      member.missing.forEach(chunkIndex => {
+        queue.push({ memberIndex, chunkIndex });
+        uploadedBytes -= Math.min(chunkSize, member.size - chunkIndex * chunkSize);
+      });
+    });
+    setProgress(Math.round((uploadedBytes * 100) / Math.max(totalBytes, 1)));
+
+    const sendChunk = async ({ memberIndex, chunkIndex }) => {
+      const start = chunkIndex * chunkSize;
+      const chunk = entries[memberIndex].blob.slice(start, start + chunkSize);
+      for (let attempt = 0; ; attempt++) {
+        try {
+          const response = await fetch(
+            `${backendUrl}/upload/${session.upload_id}/chunk/${memberIndex}/${chunkIndex}`,
+            { method: 'PUT', body: chunk, signal: controller.signal }
+          );
+          if (response.ok) {
+            uploadedBytes += chunk.size;
+            setProgress(Math.round((uploadedBytes * 100) / Math.max(totalBytes, 1)));
+            return;
+          }
+          if (response.status < 500) {
+            throw new Error(`Morceau refusé (${response.status})`);
+          }
+        } catch (error) {
+          if (error.name === 'AbortError' || attempt >= MAX_CHUNK_RETRIES) {
+            throw error;
+          }
+        }
+        // Attente exponentielle avant un nouvel essai
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+      }
+    };
+
+    // Envoyer plusieurs morceaux en parallèle
+    const worker = async () => {
+      while (queue.length > 0) {
+        await sendChunk(queue.shift());
+      }
+    };
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+    const response = await fetch(`${backendUrl}/upload/${session.upload_id}/complete`, {
+      method: 'POST',
+      signal: controller.signal
+    });
+    if (!response.ok) {
+      throw new Error("Échec de la finalisation de l'upload");
+    }
+    localStorage.removeItem(storageKey);
+    setProgress(100);
+    return response.json();
+  };
+
   const resetUploadState = () => {
     setProgress(0);
-    setCompressionProgress(0);
-    setIsCompressing(false);
     setUploading(false);
     setUploadedItems([]);
     setRecipientEmail('');
@@ -466,6 +557,10 @@ function App() {
       xhrRef.current.abort();
       xhrRef.current = null;
     }
+    if (abortControllerRef.current) {
+      abortControllerRef.current.abort();
+      abortControllerRef.current = null;
+    }
     setUploading(false);
     setProgress(0);
   };
@@ -599,6 +694,41 @@ function App() {
           </select>
         </div>
 
+        {needsArchive && (
+          <div style={{
+            marginBottom: 'clamp(1rem, 3vw, 1.5rem)',
+            backgroundColor: 'var(--clr-surface-a20)',
+            padding: 'clamp(0.75rem, 2vw, 1rem)',
+            borderRadius: '6px'
+          }}>
+            <label style={{
+              display: 'block',
+              marginBottom: 'clamp(0.5rem, 1vw, 0.75rem)',
+              color: 'var(--clr-primary-a40)',
+              fontSize: 'clamp(0.875rem, 2vw, 1rem)'
+            }}>
+              Format de l'archive
+            </label>
+            <select
+              value={archiveFormat}
+              onChange={(e) => setArchiveFormat(e.target.value)}
+              style={{
+                width: '100%',
+                padding: 'clamp(0.5rem, 2vw, 0.75rem)',
+                backgroundColor: 'var(--clr-surface-a30)',
+                color: 'var(--clr-primary-a50)',
+                border: '1px solid var(--clr-surface-a40)',
+                borderRadius: '4px',
+                fontSize: 'clamp(0.875rem, 2vw, 1rem)'
+              }}
+            >
+              <option value="">Par défaut</option>
+              <option value="zip">ZIP</option>
+              <option value="tar.zst">TAR + Zstandard (plus rapide et plus compact)</option>
+            </select>
+          </div>
+        )}
+
         <div 
           className={`drop-zone ${dragActive ? 'active' : ''}`}
           onDragEnter={handleDrag}
@@ -705,7 +835,7 @@ function App() {
           </div>
         )}
 
-        {(isCompressing || progress > 0) && (
+        {progress > 0 && (
           <div style={{
             backgroundColor: 'var(--clr-surface-a20)',
             padding: 'clamp(1rem, 3vw, 1.5rem)',
@@ -716,14 +846,12 @@ function App() {
               <div
                 className="progress-bar"
                 style={{
-                  width: `${isCompressing ? compressionProgress : progress}%`
+                  width: `${progress}%`
                 }}
               />
               <div className="progress-info">
                 <span className="progress-text">
-                  {isCompressing
-                    ? `Compression : ${compressionProgress}%`
-                    : `Upload : ${progress}%`}
+                  {`Upload : ${progress}%`}
                 </span>
                 <button
                   className="cancel-button"
@@ -751,9 +879,7 @@ function App() {
                   fill="currentColor"/>
               </svg>
               <span>
-                {isCompressing
-                  ? "Compression en cours. Veuillez ne pas fermer cette fenêtre."
-                  : "Transfert en cours. Veuillez ne pas fermer cette fenêtre."}
+                Transfert en cours. Veuillez ne pas fermer cette fenêtre.
               </span>
             </div>
           </div>
@@ -2,11 +2,61 @@ import React, { useState, useEffect } from 'react';
 import { useParams } from 'react-router-dom';
 import banner from './assets/iTransfer Bannière.png';
 
+// Nombre de reprises d'un téléchargement interrompu avant abandon
+const MAX_DOWNLOAD_RETRIES = 5;
+
+// Au-delà, le téléchargement n'est pas gardé en mémoire : il est écrit sur
+// disque au fil de l'eau ou confié au gestionnaire de téléchargements du navigateur
+const IN_MEMORY_DOWNLOAD_LIMIT = 200 * 1024 * 1024;
+
+// Téléchargement gardé en mémoire puis proposé en une fois (petits transferts)
+function createMemorySink(filename) {
+  const chunks = [];
+  return {
+    write: async (value) => { chunks.push(value); },
+    reset: async () => { chunks.length = 0; },
+    close: async () => {
+      const url = window.URL.createObjectURL(new Blob(chunks));
+      saveUrl(url, filename);
+      window.URL.revokeObjectURL(url);
+    },
+    abort: async () => { chunks.length = 0; }
+  };
+}
+
+// Téléchargement écrit directement dans le fichier choisi (File System Access API)
+async function createFileSink(filename) {
+  const handle = await window.showSaveFilePicker({ suggestedName: filename });
+  const writable = await handle.createWritable();
+  return {
+    write: (value) => writable.write(value),
+    reset: async () => {
+      await writable.truncate(0);
+      await writable.seek(0);
+    },
+    close: () => writable.close(),
+    abort: () => writable.abort()
+  };
+}
+
+function saveUrl(url, filename) {
+  const a = document.createElement('a');
+  a.href = url;
+  a.download = filename;
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+
 function Download() {
   const { transferId } = useParams();
   const [files, setFiles] = useState([]);
+  const [members, setMembers] = useState([]);
+  const [filename, setFilename] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [downloading, setDownloading] = useState(false);
+  const [progress, setProgress] = useState(0);
   const backendUrl = window.BACKEND_URL;
 
   useEffect(() => {
@@ -21,6 +71,8 @@ function Download() {
       }
       const data = await response.json();
       setFiles(data.files);
+      setMembers(data.members || []);
+      setFilename(data.filename || null);
       setLoading(false);
     } catch (error) {
       setError(error.message);
@@ -37,24 +89,97 @@ function Download() {
   };
 
   const handleDownload = async () => {
+    const downloadUrl = `${backendUrl}/download/${transferId}`;
+    const downloadName = filename || files[0].name;
+    const totalSize = files.reduce((sum, file) => sum + (file.size || 0), 0);
+    let sink;
+
+    if (totalSize <= IN_MEMORY_DOWNLOAD_LIMIT) {
+      sink = createMemorySink(downloadName);
+    } else if (window.showSaveFilePicker) {
+      try {
+        sink = await createFileSink(downloadName);
+      } catch (error) {
+        // Choix du fichier annulé
+        return;
+      }
+    } else {
+      // Le navigateur télécharge lui-même et reprend les interruptions (Range / If-Range)
+      saveUrl(downloadUrl, downloadName);
+      return;
+    }
+
+    let received = 0;
+    let total = null;
+    let etag = null;
+    setDownloading(true);
+    setProgress(0);
+
     try {
-      const response = await fetch(`${backendUrl}/download/${transferId}`);
-      if (!response.ok) throw new Error('Erreur lors du téléchargement');
-      
-      const blob = await response.blob();
-      const url = window.URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      a.href = url;
-      a.download = files.length > 1 ? `iTransfer_${new Date().getFullYear().toString().slice(-2)}${String(new Date().getMonth() + 1).padStart(2, '0')}${String(new Date().getDate()).padStart(2, '0')}${String(new Date().getHours()).padStart(2, '0')}${String(new Date().getMinutes()).padStart(2, '0')}.zip` : files[0].name;
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
-      window.URL.revokeObjectURL(url);
+      for (let attempt = 0; ; attempt++) {
+        try {
+          // Reprendre là où le téléchargement s'est arrêté, si le fichier n'a pas changé
+          const headers = {};
+          if (received > 0 && etag) {
+            headers['Range'] = `bytes=${received}-`;
+            headers['If-Range'] = etag;
+          }
+          const response = await fetch(downloadUrl, { headers });
+          if (response.status === 206) {
+            const contentRange = response.headers.get('Content-Range');
+            total = contentRange ? parseInt(contentRange.split('/')[1], 10) : total;
+          } else if (response.ok) {
+            // Réponse complète : repartir du début
+            await sink.reset();
+            received = 0;
+            const contentLength = response.headers.get('Content-Length');
+            total = contentLength ? parseInt(contentLength, 10) : null;
+          } else if (response.status < 500) {
+            const fatal = new Error(`Téléchargement refusé (${response.status})`);
+            fatal.fatal = true;
+            throw fatal;
+          } else {
+            throw new Error(`Erreur serveur (${response.status})`);
+          }
+          etag = response.headers.get('ETag') || etag;
+
+          const reader = response.body.getReader();
+          for (;;) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            await sink.write(value);
+            received += value.length;
+            if (total) {
+              setProgress(Math.round((received * 100) / total));
+            }
+          }
+          if (total !== null && received < total) {
+            throw new Error('Téléchargement interrompu');
+          }
+          break;
+        } catch (error) {
+          if (error.fatal || attempt >= MAX_DOWNLOAD_RETRIES) {
+            throw error;
+          }
+          // Attente exponentielle avant de reprendre
+          await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+        }
+      }
+
+      await sink.close();
     } catch (error) {
+      await sink.abort().catch(() => {});
       setError('Erreur lors du téléchargement. Veuillez réessayer.');
+    } finally {
+      setDownloading(false);
     }
   };
 
+  // Lien de téléchargement d'un seul fichier du transfert
+  const memberNames = new Set(members.map(member => member.name));
+  const getMemberUrl = (name) =>
+    `${backendUrl}/download/${transferId}/member/${name.split('/').map(encodeURIComponent).join('/')}`;
+
   if (loading) {
     return (
       <div className="app-container" style={{
@@ -158,6 +283,20 @@ function Download() {
                     {formatFileSize(file.size)}
                   </div>
                 </div>
+                {members.length > 1 && memberNames.has(file.name) && (
+                  <a
+                    href={getMemberUrl(file.name)}
+                    download
+                    style={{
+                      color: 'var(--clr-primary-a40)',
+                      fontSize: '0.9rem',
+                      whiteSpace: 'nowrap',
+                      marginLeft: '1rem'
+                    }}
+                  >
+                    Télécharger
+                  </a>
+                )}
               </div>
             ))}
           </div>
@@ -165,6 +304,7 @@ function Download() {
 
         <button 
           onClick={handleDownload}
+          disabled={downloading}
           style={{
             width: '100%',
             padding: 'clamp(1rem, 3vw, 1.5rem)',
@@ -173,7 +313,9 @@ function Download() {
             transition: 'all 0.3s ease'
           }}
         >
-          Télécharger {files.length > 1 ? 'les fichiers' : 'le fichier'}
+          {downloading
+            ? `Téléchargement : ${progress}%`
+            : `Télécharger ${files.length > 1 ? 'les fichiers' : 'le fichier'}`}
         </button>
       </div>
 